@@ -41,10 +41,14 @@ main(int argc, char *argv[])
 
 
 	int n_auts;
-	int** auts;
+	int* auts;
 
 	int* lab = malloc(n*sizeof(int));
 	int* ptn = malloc(n*sizeof(int));
+	int* orbits = malloc(n*sizeof(int));
+	double grpsize1;
+	int grpsize2, numorbits;
+	size_t stats[NAUTYPY_N_STATS];
 
 	for(int j=0; j<sg.nv; j++)
 	{
@@ -52,7 +56,8 @@ main(int argc, char *argv[])
 		ptn[j] = 1;
 	}
 
-	canonize(sg.nv, sg.nde, sg.v, sg.d, sg.e, lab, ptn, &n_auts, &auts);
+	canonize(sg.nv, sg.nde, sg.v, sg.d, sg.e, lab, ptn, &n_auts, &auts,
+	         orbits, &grpsize1, &grpsize2, &numorbits, stats, NAUTYPY_SPARSE, NULL, 0);
 
 	printf("CANON LABEL\n(");
 	for(int j=0; j<sg.nv; j++)
@@ -67,19 +72,19 @@ main(int argc, char *argv[])
 		printf("(");
 		for(int j=0; j<sg.nv; j++)
 		{
-			printf("%d ",auts[i][j]);
+			printf("%d ",auts[i*sg.nv+j]);
 		}
 		printf(")\n");
 	}
 
+	printf("GROUP ORDER %.0f*10^%d, %d ORBITS\n", grpsize1, grpsize2, numorbits);
+	printf("SEARCH TREE %zu NODES, DEPTH %zu\n", stats[NAUTYPY_STAT_NUMNODES], stats[NAUTYPY_STAT_MAXLEVEL]);
+
 
 	free(lab);
 	free(ptn);
-	for(int i=0; i<n_auts; i++)
-	{
-		free(auts[i]);
-	}
-	free(auts);
+	free(orbits);
+	free_auts(auts);
 	SG_FREE(sg);	
 
 //    exit(0);
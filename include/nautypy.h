@@ -3,5 +3,55 @@
 
 #include <stddef.h>
 
-void canonize(int _nv, size_t _nde, size_t* _v, int* _d, int* _e, int* lab, int* ptn, int* n_auts, int*** auts);
+/* Canonization engines */
+#define NAUTYPY_SPARSE 0	/* sparsenauty */
+#define NAUTYPY_DENSE 1		/* densenauty, on packed adjacency matrices */
+#define NAUTYPY_TRACES 2	/* Traces */
+
+/* Vertex invariants (see nautinv.h). Only NAUTYPY_INV_DISTANCES and
+   NAUTYPY_INV_ADJACENCIES have sparse versions; Traces takes none. */
+#define NAUTYPY_INV_NONE 0
+#define NAUTYPY_INV_TWOPATHS 1
+#define NAUTYPY_INV_ADJTRIANG 2
+#define NAUTYPY_INV_TRIPLES 3
+#define NAUTYPY_INV_QUADRUPLES 4
+#define NAUTYPY_INV_CELLTRIPS 5
+#define NAUTYPY_INV_CELLQUADS 6
+#define NAUTYPY_INV_CELLQUINS 7
+#define NAUTYPY_INV_DISTANCES 8
+#define NAUTYPY_INV_INDSETS 9
+#define NAUTYPY_INV_CLIQUES 10
+#define NAUTYPY_INV_CELLCLIQ 11
+#define NAUTYPY_INV_CELLIND 12
+#define NAUTYPY_INV_ADJACENCIES 13
+#define NAUTYPY_INV_CELLFANO 14
+#define NAUTYPY_INV_CELLFANO2 15
+#define NAUTYPY_INV_REFINVAR 16
+
+/* Search statistics, NAUTYPY_N_STATS per graph (see statsblk in nauty.h) */
+#define NAUTYPY_STAT_NUMNODES 0
+#define NAUTYPY_STAT_NUMBADLEAVES 1
+#define NAUTYPY_STAT_MAXLEVEL 2
+#define NAUTYPY_STAT_NUMGENERATORS 3
+#define NAUTYPY_STAT_TCTOTAL 4
+#define NAUTYPY_STAT_CANUPDATES 5
+#define NAUTYPY_STAT_INVAPPLICS 6
+#define NAUTYPY_STAT_INVSUCCESSES 7
+#define NAUTYPY_STAT_INVARSUCLEVEL 8
+#define NAUTYPY_STAT_NAUTY_NS 9	/* wall time of the engine call, in nanoseconds (if timed) */
+#define NAUTYPY_N_STATS 10
+
+void canonize(int _nv, size_t _nde, size_t* _v, int* _d, int* _e, int* lab, int* ptn, int* n_auts, int** auts,
+              int* orbits, double* grpsize1, int* grpsize2, int* numorbits, size_t* stats, int engine, int* invariant, int timed);
+void canonize_batch(int n_graphs, int* engines, int* vtx_off, size_t* de_off, size_t* _v, int* _d, int* _e, int* lab, int* ptn, int* n_auts, int** auts,
+                    int* orbits, double* grpsize1, int* grpsize2, int* numorbits, size_t* stats, int* invariant, int timed);
+void free_auts(int* auts);
+
+/* Reusable workspace of canonize_with() */
+typedef struct canonizer canonizer;
+canonizer* canonizer_new(int max_nv, size_t max_nde);
+void canonizer_free(canonizer* c);
+void canonize_with(canonizer* c, int _nv, size_t _nde, size_t* _v, int* _d, int* _e, int* lab, int* ptn, int* n_auts, int** auts,
+                   int* orbits, double* grpsize1, int* grpsize2, int* numorbits, size_t* stats, int engine, int* invariant, int timed);
+int thread_safe(void);
 #endif
@@ -1,4 +1,6 @@
 #! /usr/bin/python3 
+import struct
+from itertools import accumulate, repeat
 import networkx as nx
  
 class hmap(dict): 
@@ -66,6 +68,9 @@ class HGraph(nx.Graph):
     def __hash__(self):
         return hash((self.graph, self._node, self._adj))
 
+    def __reduce__(self):
+        #Pickle through the binary codec (see encode_graph).
+        return (decode_graph, (encode_graph(self), type(self)))
 
 
 
@@ -91,7 +96,581 @@ class HMultiGraph(nx.MultiGraph):
 
     def __hash__(self):
         return hash((self.graph, self._node, self._adj))
-         
+
+    def __reduce__(self):
+        #Pickle through the binary codec (see encode_graph).
+        return (decode_graph, (encode_graph(self), type(self)))
+
+
+class fhmap(hmap):
+    """
+    Immutable hmap. The sorted tuple of items, which serves
+    as the sort key, and the hash are computed once, at
+    construction, so hashing and comparison cost O(1) and
+    O(size) rather than O(size*log(size)).
+    """
+
+    __slots__ = ('sort_key', '_hash')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sort_key = tuple(sorted(super().items()))
+        self._hash = hash(self.sort_key)
+
+    def __hash__(self):
+        return self._hash
+
+    def __lt__(self,other):
+        if isinstance(other, fhmap):
+            return self.sort_key < other.sort_key
+        return self.sort_key < tuple(sorted(other.items()))
+
+    def __reduce__(self):
+        return (fhmap, (dict(self),))
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("fhmap is immutable")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+
+class _FrozenGraph:
+    """
+    Mixin freezing an HGraph or HMultiGraph at the end of its
+    construction: all attribute dicts are replaced by fhmap
+    objects, the hash and sort key are computed once, and
+    the networkx mutation methods raise networkx.NetworkXError.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._frozen = False
+        super().__init__(*args, **kwargs)
+        self._freeze()
+
+    def _freeze(self):
+        #Attribute dicts (and MultiGraph key dicts) are shared
+        #by both directions of an edge, so freeze each only once.
+        frozen = {}
+        def freeze(d):
+            if id(d) not in frozen:
+                frozen[id(d)] = (d, fhmap(d))
+            return frozen[id(d)][1]
+        self.graph = fhmap(self.graph)
+        for node in self._node:
+            self._node[node] = fhmap(self._node[node])
+        for nbrs in self._adj.values():
+            for nbr,data in nbrs.items():
+                if self.is_multigraph():
+                    if id(data) not in frozen:
+                        frozen[id(data)] = (data, fhmap({key:freeze(d) for key,d in data.items()}))
+                    nbrs[nbr] = frozen[id(data)][1]
+                else:
+                    nbrs[nbr] = freeze(data)
+        nodes = tuple(sorted((node, attrs.sort_key) for node,attrs in self._node.items()))
+        edges = tuple(sorted((*sorted((u,v)), d.sort_key) for u,v,d in self.edges(data=True)))
+        self.sort_key = (self.graph.sort_key, nodes, edges)
+        self._hash = hash((self.graph, self._node, self._adj))
+        self._frozen = True
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self,other):
+        if isinstance(other, _FrozenGraph) and self._hash!=other._hash:
+            return False
+        return super().__eq__(other)
+
+    def __lt__(self,other):
+        return self.sort_key < other.sort_key
+
+    def copy(self, as_view=False):
+        if as_view:
+            return super().copy(as_view=True)
+        return self.__class__(self)
+
+
+def _frozen_method(name):
+    def method(self, *args, **kwargs):
+        if self._frozen:
+            raise nx.NetworkXError("Frozen graph can't be modified")
+        return getattr(super(_FrozenGraph, self), name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+for _name in ('add_node', 'add_nodes_from', 'remove_node', 'remove_nodes_from',
+              'add_edge', 'add_edges_from', 'add_weighted_edges_from',
+              'remove_edge', 'remove_edges_from', 'update', 'clear', 'clear_edges'):
+    setattr(_FrozenGraph, _name, _frozen_method(_name))
+
+
+class FrozenHGraph(_FrozenGraph, HGraph):
+    """
+    Immutable hashable_containers.HGraph, with the hash and
+    the sort key (see _FrozenGraph) computed once, when the graph
+    is constructed from its data, e.g. FrozenHGraph(g).
+    """
+
+    mutable_class = HGraph
+
+
+class FrozenHMultiGraph(_FrozenGraph, HMultiGraph):
+    """
+    Analogous to hashable_containers.FrozenHGraph, but for the
+    hashable_containers.HMultiGraph class.
+    """
+
+    mutable_class = HMultiGraph
+
+
+def freeze(g):
+    """
+    Frozen copy of a networkx graph or multigraph.
+    """
+
+    if g.is_multigraph():
+        return FrozenHMultiGraph(g)
+    return FrozenHGraph(g)
+
+
+#Binary codec.
+_MAGIC = b'HC\x02'
+_MULTIGRAPH = 0x1
+_CORES = {"edges":0x0, "graph6":0x2, "sparse6":0x4}
+_CORE_MASK = 0x6
+
+
+def _write_varint(out, n):
+    while n>0x7f:
+        out.append((n&0x7f)|0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte&0x7f)<<shift
+        if byte<0x80:
+            return n, pos
+        shift += 7
+
+
+def _write_varints(out, values):
+    if max(values, default=0)<0x80:
+        out += bytes(values)
+    else:
+        for n in values:
+            _write_varint(out, n)
+
+
+def _read_varints(data, pos, count):
+    #Most values (indices and color ids of small graphs) fit in one byte.
+    if max(data[pos:pos+count], default=0)<0x80:
+        return list(data[pos:pos+count]), pos+count
+    values = []
+    append = values.append
+    n = shift = 0
+    while len(values)<count:
+        byte = data[pos]
+        pos += 1
+        if byte<0x80:
+            append(n|(byte<<shift))
+            n = shift = 0
+        else:
+            n |= (byte&0x7f)<<shift
+            shift += 7
+    return values, pos
+
+
+def _read_varint_from(f):
+    n = shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            if shift:
+                raise EOFError("truncated varint")
+            return None
+        n |= (byte[0]&0x7f)<<shift
+        if byte[0]<0x80:
+            return n
+        shift += 7
+
+
+#Tags of the value encoding of _write_value.
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _COMPLEX, _STR, _BYTES = range(8)
+_SEQUENCES = {8:tuple, 9:list, 10:hlist, 11:set, 12:frozenset}
+_MAPPINGS = {13:dict, 14:hmap, 15:fhmap}
+_SEQUENCE_TAGS = {cls:tag for tag,cls in _SEQUENCES.items()}
+_MAPPING_TAGS = {cls:tag for tag,cls in _MAPPINGS.items()}
+
+
+def _write_value(out, value):
+    """
+    Append value to the bytearray out, tagged with its type: None,
+    bools, ints, floats, complex numbers, strings, bytes, and tuples,
+    lists, sets, frozensets, dicts, hlists, hmaps and fhmaps of those.
+    Raises TypeError for any other type.
+    """
+
+    cls = type(value)
+    if value is None:
+        out.append(_NONE)
+    elif cls is bool:
+        out.append(_TRUE if value else _FALSE)
+    elif cls is int:
+        #Zigzag encoding of signed ints.
+        out.append(_INT)
+        _write_varint(out, value<<1 if value>=0 else (~value<<1)|1)
+    elif cls is float:
+        out.append(_FLOAT)
+        out += struct.pack('<d', value)
+    elif cls is complex:
+        out.append(_COMPLEX)
+        out += struct.pack('<2d', value.real, value.imag)
+    elif cls is str or cls is bytes:
+        data = value.encode('utf-8', 'surrogatepass') if cls is str else value
+        out.append(_STR if cls is str else _BYTES)
+        _write_varint(out, len(data))
+        out += data
+    elif cls in _SEQUENCE_TAGS:
+        out.append(_SEQUENCE_TAGS[cls])
+        _write_varint(out, len(value))
+        for v in value:
+            _write_value(out, v)
+    elif cls in _MAPPING_TAGS:
+        out.append(_MAPPING_TAGS[cls])
+        _write_varint(out, len(value))
+        for k,v in value.items():
+            _write_value(out, k)
+            _write_value(out, v)
+    else:
+        raise TypeError(f"cannot encode values of type {cls.__qualname__}")
+
+
+def _read_value(data, pos):
+    """
+    Decode the value written by _write_value at data[pos].
+    Returns the value and the position following it.
+    """
+
+    tag = data[pos]
+    pos += 1
+    if tag<=_TRUE:
+        return (None, False, True)[tag], pos
+    if tag==_INT:
+        n, pos = _read_varint(data, pos)
+        return (~(n>>1) if n&1 else n>>1), pos
+    if tag==_FLOAT:
+        return struct.unpack_from('<d', data, pos)[0], pos+8
+    if tag==_COMPLEX:
+        return complex(*struct.unpack_from('<2d', data, pos)), pos+16
+    if tag==_STR or tag==_BYTES:
+        size, pos = _read_varint(data, pos)
+        value = bytes(data[pos:pos+size])
+        return (value.decode('utf-8', 'surrogatepass') if tag==_STR else value), pos+size
+    if tag in _SEQUENCES:
+        count, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(count):
+            v, pos = _read_value(data, pos)
+            items.append(v)
+        return _SEQUENCES[tag](items), pos
+    if tag in _MAPPINGS:
+        count, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(count):
+            k, pos = _read_value(data, pos)
+            v, pos = _read_value(data, pos)
+            items.append((k, v))
+        return _MAPPINGS[tag](items), pos
+    raise ValueError(f"unknown value tag {tag}")
+
+
+#Attribute value types whose type and value alone identify them.
+_ATOMIC = frozenset([str, int, float, bool, complex, bytes, type(None)])
+
+
+def _tagged(value):
+    """
+    A hashable key of value which tells apart values that compare
+    equal but differ in type (1, 1.0 and True), at any depth.
+    Raises TypeError if value is unhashable.
+    """
+
+    cls = type(value)
+    if cls in _ATOMIC:
+        return cls, value
+    hash(value)
+    if isinstance(value, tuple):
+        return cls, tuple(_tagged(v) for v in value)
+    if isinstance(value, frozenset):
+        return cls, frozenset(_tagged(v) for v in value)
+    if isinstance(value, dict):
+        return cls, frozenset((_tagged(k), _tagged(v)) for k,v in value.items())
+    return cls, value
+
+
+def _intern(attrs, table, colors):
+    """The index of the attribute dict ``attrs`` in the color table ``colors``, adding it if new."""
+    try:
+        key = tuple((type(k), k, type(v), v) if type(k) in _ATOMIC and type(v) in _ATOMIC
+                    else (_tagged(k), _tagged(v)) for k,v in attrs.items())
+        color_id = table.get(key)
+    except TypeError:
+        #Unhashable attribute values are not interned.
+        colors.append(dict(attrs))
+        return len(colors)-1
+    if color_id==None:
+        color_id = table[key] = len(colors)
+        colors.append(dict(attrs))
+    return color_id
+
+
+def encode_graph(g, core="edges"):
+    """
+    Encode an undirected networkx graph or multigraph as compact bytes.
+
+    Distinct attribute dicts ("colors") are interned in a table,
+    so that each node and edge is written as a varint color id.
+    Attribute values are compared with their types, so that equal
+    values of different types (1, 1.0 and True) decode as they were.
+    A record holds
+
+    1. the magic bytes b'HC', the version and a flag byte (multigraph, core),
+    2. varints: the number of nodes n and of edges m,
+    3. a tuple of the color table, the node labels (None if they are
+       the ints 0,...,n-1), the edge keys (None if they are the default
+       keys of networkx) and the graph attributes, each value tagged
+       with its type (see _write_value),
+    4. the color id of each node, as varints,
+    5. the core: with core="edges", each edge as three varints (the
+       increase of the index of its first end over that of the previous
+       edge, the index of its second end, its color id); with
+       core="graph6", a varint-length-prefixed graph6 string (sparse6
+       for multigraphs and self-loops) followed by the color id of each
+       edge, the edges (i,j), i<=j, being sorted lexicographically.
+
+    The graph6/sparse6 core is readable by other graph6 tools (and
+    smaller for dense simple graphs); the edge list is faster to
+    encode and decode. Attribute values, node labels and edge keys
+    are limited to the types of _write_value, so that decoding a
+    record only ever builds plain data. HGraph and HMultiGraph pickle
+    through this codec.
+    """
+
+    if g.is_directed():
+        raise ValueError("directed graphs are not supported")
+    if core not in ("edges", "graph6"):
+        raise ValueError(f"core must be 'edges' or 'graph6', not {core!r}")
+    table = {}
+    colors = []
+    nodes = list(g._node)
+    index = {node:i for i,node in enumerate(nodes)}
+    labels = None if all(type(node) is int and node==i for i,node in enumerate(nodes)) else nodes
+    multigraph = g.is_multigraph()
+    if multigraph:
+        edges = [(index[a], index[b], key, attrs) for a,b,key,attrs in g.edges(keys=True, data=True)]
+    else:
+        edges = [(index[a], index[b], None, attrs) for a,b,attrs in g.edges(data=True)]
+    if core=="edges":
+        edges.sort(key=lambda edge:edge[0])
+    else:
+        edges = [(min(a,b), max(a,b), key, attrs) for a,b,key,attrs in edges]
+        edges.sort(key=lambda edge:edge[:2])
+    #Edge keys are only stored if networkx would not assign them when the edges are added in order.
+    keys = None
+    if multigraph:
+        seen = {}
+        for a,b,key,attrs in edges:
+            pair = (min(a,b), max(a,b))
+            if key!=seen.get(pair, 0):
+                keys = [edge[2] for edge in edges]
+                break
+            seen[pair] = key+1
+    node_colors = [_intern(attrs, table, colors) for attrs in g._node.values()]
+    edge_colors = [_intern(attrs, table, colors) for a,b,key,attrs in edges]
+    out = bytearray(_MAGIC)
+    if core=="graph6":
+        loops = any(a==b for a,b,key,attrs in edges)
+        core = "sparse6" if multigraph or loops else "graph6"
+    out.append((_MULTIGRAPH if multigraph else 0)|_CORES[core])
+    _write_varint(out, len(nodes))
+    _write_varint(out, len(edges))
+    _write_value(out, (colors, labels, keys, dict(g.graph)))
+    _write_varints(out, node_colors)
+    if core=="edges":
+        ends = [0]*(3*len(edges))
+        firsts = [edge[0] for edge in edges]
+        ends[0::3] = [a-previous for a,previous in zip(firsts, [0]+firsts)]
+        ends[1::3] = [edge[1] for edge in edges]
+        ends[2::3] = edge_colors
+        _write_varints(out, ends)
+    else:
+        h = nx.MultiGraph() if core=="sparse6" else nx.Graph()
+        h.add_nodes_from(range(len(nodes)))
+        h.add_edges_from((a,b) for a,b,key,attrs in edges)
+        if core=="sparse6":
+            code = nx.to_sparse6_bytes(h, header=False).rstrip(b'\n')
+        else:
+            code = nx.to_graph6_bytes(h, header=False).rstrip(b'\n')
+        _write_varint(out, len(code))
+        out += code
+        _write_varints(out, edge_colors)
+    return bytes(out)
+
+
+def _decode(data, pos, create_using):
+    """
+    Decode the record of encode_graph starting at data[pos].
+    """
+
+    if bytes(data[pos:pos+3])!=_MAGIC:
+        raise ValueError("not an encoded graph")
+    flags = data[pos+3]
+    n, pos = _read_varint(data, pos+4)
+    m, pos = _read_varint(data, pos)
+    (colors, labels, keys, graph), pos = _read_value(data, pos)
+    if create_using==None:
+        create_using = HMultiGraph if flags&_MULTIGRAPH else HGraph
+    #Frozen graphs are built mutable, then frozen.
+    mutable_class = getattr(create_using, 'mutable_class', create_using)
+    g = mutable_class()
+    g.graph.update(graph)
+    nodes = range(n) if labels==None else labels
+    node_colors, pos = _read_varints(data, pos, n)
+    if flags&_CORE_MASK==_CORES["edges"]:
+        ends, pos = _read_varints(data, pos, 3*m)
+        ends[0::3] = accumulate(ends[0::3])
+        ends = zip(ends[0::3], ends[1::3], ends[2::3])
+    else:
+        size, pos = _read_varint(data, pos)
+        code = bytes(data[pos:pos+size])
+        pos += size
+        if flags&_CORE_MASK==_CORES["sparse6"]:
+            h = nx.from_sparse6_bytes(code)
+        else:
+            h = nx.from_graph6_bytes(code)
+        edge_colors, pos = _read_varints(data, pos, m)
+        pairs = sorted((min(a,b), max(a,b)) for a,b in h.edges())
+        if len(pairs)!=m:
+            raise ValueError(f"expected {m} edges in the graph6 core, not {len(pairs)}")
+        ends = ((a, b, color_id) for (a,b),color_id in zip(pairs, edge_colors))
+    #Fill the networkx dicts directly, as add_nodes_from/add_edges_from would.
+    node_attr = g.node_attr_dict_factory
+    adj_inner = g.adjlist_inner_dict_factory
+    edge_attr = g.edge_attr_dict_factory
+    for node,color_id in zip(nodes, node_colors):
+        g._node[node] = node_attr(colors[color_id])
+        g._adj[node] = adj_inner()
+    adj = [g._adj[node] for node in nodes]
+    if g.is_multigraph():
+        edge_keys = g.edge_key_dict_factory
+        if keys==None:
+            #networkx's default keys: the smallest unused int, from the number of parallel edges.
+            keys = repeat(None)
+        for (a,b,color_id),key in zip(ends, keys):
+            adj_a = adj[a]
+            v = nodes[b]
+            if v in adj_a:
+                keydict = adj_a[v]
+            else:
+                keydict = adj_a[v] = adj[b][nodes[a]] = edge_keys()
+            if key==None:
+                key = len(keydict)
+                while key in keydict:
+                    key += 1
+            keydict[key] = edge_attr(colors[color_id])
+    else:
+        for a,b,color_id in ends:
+            adj[a][nodes[b]] = adj[b][nodes[a]] = edge_attr(colors[color_id])
+    if mutable_class is not create_using:
+        g = create_using(g)
+    return g, pos
+
+
+def decode_graph(data, create_using=None):
+    """
+    Decode a graph encoded by encode_graph. By default, the graph
+    is an HGraph or an HMultiGraph; create_using may give another
+    (e.g. frozen) class.
+    """
+
+    return _decode(memoryview(data), 0, create_using)[0]
+
+
+def dump_graphs(graphs, f, core="edges"):
+    """
+    Write the graphs of an iterable to the binary file f, as
+    varint-length-prefixed records of encode_graph, consuming the
+    iterable lazily. Returns the number of graphs written.
+    """
+
+    count = 0
+    for g in graphs:
+        record = encode_graph(g, core=core)
+        prefix = bytearray()
+        _write_varint(prefix, len(record))
+        f.write(prefix)
+        f.write(record)
+        count += 1
+    return count
+
+
+def load_graphs(f, create_using=None):
+    """
+    Lazily decode the graphs of a binary file written by
+    dump_graphs, reading one record at a time.
+    """
+
+    while True:
+        size = _read_varint_from(f)
+        if size==None:
+            return
+        record = f.read(size)
+        if len(record)!=size:
+            raise EOFError("truncated record")
+        yield decode_graph(record, create_using)
+
+
+class GraphArchive:
+    """
+    Random-access sequence over the records written by dump_graphs,
+    held in a bytes-like buffer (e.g. the contents or an mmap of
+    the file). Only the record offsets are computed up front; each
+    graph is decoded when it is accessed.
+    """
+
+    def __init__(self, data, create_using=None):
+        self.data = memoryview(data)
+        self.create_using = create_using
+        self.offsets = []
+        pos = 0
+        while pos<len(self.data):
+            size, start = _read_varint(self.data, pos)
+            self.offsets.append(start)
+            pos = start+size
+        if pos!=len(self.data):
+            raise EOFError("truncated record")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return _decode(self.data, self.offsets[i], self.create_using)[0]
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield _decode(self.data, offset, self.create_using)[0]
+
 
 if __name__ == '__main__': 
  
@@ -2,16 +2,39 @@
 
 from _nautypy import ffi,lib
 import os
+import sys
+import threading
+from contextlib import nullcontext
+from functools import partial
+from time import perf_counter
+from collections import OrderedDict
+import struct
+import json
+import bisect
+import math
+import hashlib
+import sqlite3
+from itertools import chain, islice
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
 from networkx.drawing.nx_agraph import graphviz_layout, to_agraph
 import pygraphviz as pgv
-from hashable_containers import hmap,hlist,HGraph,HMultiGraph
+from hashable_containers import hmap,hlist,HGraph,HMultiGraph,freeze
+import nautypy_groups as groups
 from prettytable import PrettyTable
 
 
-def _canonize(g, _lab, _ptn):
+#cffi releases the GIL for the duration of every call into libnautypy.
+#Calls may then overlap, which is only safe if NAUTY was built with
+#thread-local storage; otherwise they are serialized.
+_nauty_lock = nullcontext() if lib.thread_safe() else threading.Lock()
+
+
+def _canonize(g, _lab, _ptn, group=False, engine="sparse", invariant=None, canonizer=None):
     """Python wrapper for the C interface :func:`_nautypy.lib.canonize`.
 
     Args:
@@ -19,11 +42,18 @@ def _canonize(g, _lab, _ptn):
         _lab (list): A list of the node labels assigning them to the color cells demarcated in ``_ptn``.
         _ptn (list): A list of ones and zeros, aligned to ``_lab``, encoding cells of like color (see Section 3 of the `NAUTY User's Guide <https://pallini.di.uniroma1.it/Guide.html>`_) for details.
 
+    Keyword Args:
+        group (bool): If True, also return the order and orbits of the automorphism group (see :func:`nautypy.canonize_arrays`).
+        engine (str): The NAUTY engine (see :func:`nautypy.canonize_arrays`).
+        invariant (None, str or tuple): The NAUTY vertex invariant (see :func:`nautypy.canonize_arrays`).
+        canonizer (None or nautypy.Canonizer): If not None, the workspace of the NAUTY call (see :class:`nautypy.Canonizer`).
+
     Returns:
-        2-element tuple containing
+        2-element tuple (3-element tuple, with ``group``) containing
 
         - **canonical_map** (*hashable_containers.hmap*): A mapping *from* the labels of the canonical isomorph *to* the input graph ``g``.
         - **autgens** (*hashable_containers.hlist*): A list of :class:`hashable_containers.hmap` encoding the generators of the automorphism group of ``g``.
+        - **group** (*dict*): The group order and orbits of ``Aut(g)``, as returned by :func:`nautypy.canonize_arrays`.
 
     Note:
         While the ordering of the labels in ``_lab`` within each cell of ``_ptn``
@@ -81,47 +111,758 @@ def _canonize(g, _lab, _ptn):
 
     """
 
-    #Initialize memory for nauty canonize()
-    nv = g.number_of_nodes()
-    nde = 2*g.number_of_edges()
-    v = ffi.new("size_t[]",nv)
-    d = ffi.new("int[]",nv)
-    e = ffi.new("int[]",nde)
-    lab = ffi.new("int[]",nv)
-    ptn = ffi.new("int[]",nv)
     #Load the nx graph g into nauty sparse format.
-    de_counter = 0
-    for i in range(0,nv):
-        lab[i]=_lab[i]
-        ptn[i]=_ptn[i]
-        d[i]=g.degree(i)
-        v[i]=de_counter
-        neighbors = list(g[i].keys())
-        for m in range(0,d[i]):
-            e[v[i]+m] = neighbors[m]
-        de_counter+=d[i]
-    #Initialize memory for automorphisms.
-    n_auts = ffi.new("int*")
-    auts = ffi.new("int***")
-    #Invoke canonize()    
-    lib.canonize(nv,nde,v,d,e,lab,ptn,n_auts,auts)
+    v, d, e = _sparse_arrays(g)
+    #Canonize
+    arrays = canonize_arrays if canonizer==None else canonizer.canonize_arrays
+    lab, auts, aut_group = arrays(v, d, e, _lab, _ptn, group=True, engine=engine, invariant=invariant)
     #Construct a relabeling map from lab.
-    canonical_map = hmap({i:int(lab[i]) for i in range(nv)})
-    #Convert automorphisms to hmaps and conjugate to input labeling.
-    autgens = hlist()
-    for i in range(0,n_auts[0]):
-        gen = hmap({j:auts[0][i][j] for j in range(nv)})
-        autgens.append(gen)
+    canonical_map = hmap(enumerate(lab.tolist()))
+    #Convert automorphisms to hmaps.
+    autgens = hlist(hmap(enumerate(aut)) for aut in auts.tolist())
+    if group:
+        return canonical_map, autgens, aut_group
     return canonical_map, autgens
 
 
+def canonize_arrays(v, d, e, lab, ptn, group=False, engine="sparse", invariant=None):
+    """Canonize a vertex-colored simple graph given directly in NAUTY sparse format.
+
+    This is the array-level entry point underlying :func:`nautypy._canonize`.
+    The graph arrays are handed to :func:`_nautypy.lib.canonize` through
+    ``ffi.from_buffer``, so arrays which already have the expected dtype
+    (``numpy.uintp`` for ``v``, ``numpy.intc`` for the rest) are not copied.
+    ``lab`` and ``ptn`` are always copied, because NAUTY overwrites them.
+
+    The graph is canonized by one of three NAUTY engines: ``sparsenauty``
+    (``"sparse"``), ``densenauty`` on a packed adjacency matrix (``"dense"``),
+    or Traces (``"traces"``). ``"auto"`` picks one from the order and density of
+    the graph (see :func:`nautypy._select_engine`). The engines compute different
+    canonical labelings, so canonical forms are only comparable between calls
+    using the same engine. Since ``"auto"`` only depends on isomorphism invariants,
+    it picks the same engine for isomorphic graphs.
+
+    On highly regular graphs, where partition refinement alone splits few
+    cells, a vertex ``invariant`` can prune the search tree of ``sparsenauty``
+    or ``densenauty`` (see the section on vertex invariants of the `NAUTY User's Guide <https://pallini.di.uniroma1.it/Guide.html>`_).
+    It changes the canonical labeling, so canonical forms are only comparable
+    between calls using the same engine and invariant options. For fixed options,
+    the labeling is deterministic. The search statistics returned with ``group``
+    tell whether the invariant paid off (fewer ``numnodes``, ``invsuccesses>0``).
+
+    Args:
+        v (array-like): Index of the first neighbor of each vertex in ``e`` (CSR offsets).
+        d (array-like): Degree of each vertex.
+        e (array-like): Concatenated neighbor lists.
+        lab (array-like): Vertex labels ordered by color cell (see :func:`nautypy._canonize`).
+        ptn (array-like): Color cell boundaries aligned to ``lab``.
+
+    Keyword Args:
+        group (bool): If True, also return the automorphism group order and orbits, and the search statistics, computed by NAUTY.
+        engine (str): ``"sparse"`` (default), ``"dense"``, ``"traces"`` or ``"auto"``.
+        invariant (None, str or tuple): None (default) for no vertex invariant, the name of one (a key of
+            ``nautypy._invariants``, e.g. ``"distances"``, ``"adjtriang"``, ``"cellquads"`` or ``"cellfano"``),
+            or a tuple ``(name, invarlev)`` or ``(name, invarlev, invararg)`` (see :func:`nautypy._invariant_options`).
+            Only ``"distances"`` and ``"adjacencies"`` are available to ``"sparse"``, and none to ``"traces"``.
+
+    Returns:
+        2-element tuple (3-element tuple, with ``group``) containing
+
+        - **lab** (*numpy.ndarray*): The canonical labeling, in one-line notation. ``lab[i]`` is the input vertex sent to vertex ``i`` of the canonical isomorph.
+        - **autgens** (*numpy.ndarray*): An ``(n_auts, nv)`` array whose rows are the generators of the automorphism group, in one-line notation.
+        - **group** (*dict*): ``'order'``, the order of the automorphism group (see :func:`nautypy._group_order`),
+          ``'orbits'``, a numpy array giving the least vertex in the orbit of each vertex, ``'n_orbits'``, the number of orbits,
+          and ``'stats'``, the search statistics (see :func:`nautypy._search_stats`).
+
+    """
+
+    v = np.ascontiguousarray(v, dtype=np.uintp)
+    d = np.ascontiguousarray(d, dtype=np.intc)
+    e = np.ascontiguousarray(e, dtype=np.intc)
+    lab = np.array(lab, dtype=np.intc)
+    ptn = np.array(ptn, dtype=np.intc)
+    nv = len(d)
+    invariant = _invariant_options(invariant)
+    engine = _select_engine(engine, nv, len(e), invariant[0])
+    #Initialize memory for automorphisms.
+    n_auts = ffi.new("int*")
+    auts = ffi.new("int**")
+    #Initialize memory for the group statistics.
+    orbits = np.empty(nv, dtype=np.intc)
+    grpsize1 = ffi.new("double*")
+    grpsize2 = ffi.new("int*")
+    numorbits = ffi.new("int*")
+    stats = np.zeros(lib.NAUTYPY_N_STATS, dtype=np.uintp)
+    #Invoke canonize()
+    with _nauty_lock:
+        lib.canonize(nv, len(e),
+                     ffi.from_buffer("size_t[]",v),
+                     ffi.from_buffer("int[]",d),
+                     ffi.from_buffer("int[]",e),
+                     ffi.from_buffer("int[]",lab),
+                     ffi.from_buffer("int[]",ptn),
+                     n_auts, auts,
+                     ffi.from_buffer("int[]",orbits),
+                     grpsize1, grpsize2, numorbits,
+                     ffi.from_buffer("size_t[]",stats), engine,
+                     ffi.from_buffer("int[]",invariant), bool(_metrics))
+    _check_n_auts(n_auts[0], auts)
+    if _metrics:
+        _nauty_ns.last = [int(stats[lib.NAUTYPY_STAT_NAUTY_NS])]
+    autgens = _unpack_auts(auts[0], n_auts[0]*nv).reshape(n_auts[0],nv)
+    if group:
+        return lab, autgens, {'order':_group_order(grpsize1[0], grpsize2[0]),
+                              'orbits':orbits,
+                              'n_orbits':numorbits[0],
+                              'stats':_search_stats(stats)}
+    return lab, autgens
+
+
+class Canonizer:
+    """Reusable NAUTY workspace, for low-latency canonization of many small graphs.
+
+    Each call to :func:`nautypy.canonize_arrays` allocates (and frees) NAUTY's
+    sparse graphs and generator buffer in libnautypy, and a handful of cffi
+    and numpy buffers in Python. A :class:`nautypy.Canonizer` owns all of these
+    buffers, backed by a libnautypy ``canonizer`` context, and reuses them from
+    call to call. The buffers are sized for ``max_nodes`` host nodes and
+    ``max_edges`` host edges up front, and only grow (on either side) when a
+    larger graph comes along.
+
+    The results are identical to those of the free functions: the methods below
+    take the same arguments, and any function accepting a ``canonizer`` keyword
+    (:func:`nautypy.canonize_simple_graph`, :func:`nautypy.canonize_multigraph`,
+    :func:`nautypy.certificate`, :func:`nautypy.canonize_compact`, ...) routes its
+    NAUTY call through it. A canonizer serializes its own calls, so threads
+    canonizing concurrently should each use their own.
+
+    Keyword Args:
+        max_nodes (int): Number of host graph nodes to reserve room for.
+        max_edges (int): Number of (undirected) host graph edges to reserve room for.
+
+    Example:
+        Canonize a stream of small multigraphs with one workspace::
+
+            canonizer = nautypy.Canonizer(max_nodes=50, max_edges=100)
+            for mg in diagrams:
+                mg_canonical, autgens, canonical_map = canonizer.canonize_multigraph(mg)
+
+    """
+
+    def __init__(self, max_nodes=64, max_edges=256):
+        ctx = lib.canonizer_new(max_nodes, 2*max_edges)
+        if ctx==ffi.NULL:
+            raise MemoryError("libnautypy could not allocate the canonizer")
+        self._ctx = ffi.gc(ctx, lib.canonizer_free)
+        self._lock = threading.Lock()
+        self._n_auts = ffi.new("int*")
+        self._auts = ffi.new("int**")
+        self._grpsize1 = ffi.new("double*")
+        self._grpsize2 = ffi.new("int*")
+        self._numorbits = ffi.new("int*")
+        self._stats = np.zeros(lib.NAUTYPY_N_STATS, dtype=np.uintp)
+        self._stats_p = ffi.from_buffer("size_t[]", self._stats)
+        #Invariant options (and their cffi pointers), by invariant.
+        self._invariants = {}
+        self._reserve(max_nodes)
+
+    def _reserve(self, nv):
+        """Allocate the ``lab``, ``ptn`` and ``orbits`` buffers for ``nv`` nodes."""
+        self._lab = np.empty(nv, dtype=np.intc)
+        self._ptn = np.empty(nv, dtype=np.intc)
+        self._orbits = np.empty(nv, dtype=np.intc)
+        self._lab_p = ffi.from_buffer("int[]", self._lab)
+        self._ptn_p = ffi.from_buffer("int[]", self._ptn)
+        self._orbits_p = ffi.from_buffer("int[]", self._orbits)
+
+    def _invariant(self, invariant):
+        """The libnautypy options of ``invariant`` and a cffi pointer to them, cached."""
+        try:
+            return self._invariants[invariant]
+        except KeyError:
+            options = _invariant_options(invariant)
+            self._invariants[invariant] = options, ffi.from_buffer("int[]", options)
+            return self._invariants[invariant]
+        except TypeError:
+            #Unhashable (e.g. list) invariant specifications are not cached.
+            options = _invariant_options(invariant)
+            return options, ffi.from_buffer("int[]", options)
+
+    @property
+    def max_nodes(self):
+        """The number of host nodes the Python-side buffers currently have room for."""
+        return len(self._lab)
+
+    def canonize_arrays(self, v, d, e, lab, ptn, group=False, engine="sparse", invariant=None):
+        """Canonize a graph given in NAUTY sparse format, as :func:`nautypy.canonize_arrays` does."""
+        v = np.ascontiguousarray(v, dtype=np.uintp)
+        d = np.ascontiguousarray(d, dtype=np.intc)
+        e = np.ascontiguousarray(e, dtype=np.intc)
+        nv = len(d)
+        options, options_p = self._invariant(invariant)
+        engine = _select_engine(engine, nv, len(e), options[0])
+        with self._lock:
+            if nv>len(self._lab):
+                self._reserve(max(nv, 2*len(self._lab)))
+            self._lab[:nv] = lab
+            self._ptn[:nv] = ptn
+            with _nauty_lock:
+                lib.canonize_with(self._ctx, nv, len(e),
+                                  ffi.from_buffer("size_t[]",v),
+                                  ffi.from_buffer("int[]",d),
+                                  ffi.from_buffer("int[]",e),
+                                  self._lab_p, self._ptn_p,
+                                  self._n_auts, self._auts, self._orbits_p,
+                                  self._grpsize1, self._grpsize2, self._numorbits,
+                                  self._stats_p, engine, options_p, bool(_metrics))
+            #Copy the results out of the reused buffers.
+            n_auts = self._n_auts[0]
+            _check_n_auts(n_auts)
+            lab = self._lab[:nv].copy()
+            if n_auts>0:
+                autgens = np.frombuffer(ffi.buffer(self._auts[0], n_auts*nv*ffi.sizeof("int")),
+                                        dtype=np.intc).reshape(n_auts,nv).copy()
+            else:
+                autgens = np.zeros((0,nv), dtype=np.intc)
+            if _metrics:
+                _nauty_ns.last = [int(self._stats[lib.NAUTYPY_STAT_NAUTY_NS])]
+            if group:
+                return lab, autgens, {'order':_group_order(self._grpsize1[0], self._grpsize2[0]),
+                                      'orbits':self._orbits[:nv].copy(),
+                                      'n_orbits':self._numorbits[0],
+                                      'stats':_search_stats(self._stats)}
+        return lab, autgens
+
+    def canonize_simple_graph(self, g, **kwargs):
+        """:func:`nautypy.canonize_simple_graph`, with this workspace."""
+        return canonize_simple_graph(g, canonizer=self, **kwargs)
+
+    def canonize_multigraph(self, mg, **kwargs):
+        """:func:`nautypy.canonize_multigraph`, with this workspace."""
+        return canonize_multigraph(mg, canonizer=self, **kwargs)
+
+    def certificate(self, g, **kwargs):
+        """:func:`nautypy.certificate`, with this workspace."""
+        return certificate(g, canonizer=self, **kwargs)
+
+    def canonize_compact(self, cmg, **kwargs):
+        """:func:`nautypy.canonize_compact`, with this workspace."""
+        return canonize_compact(cmg, canonizer=self, **kwargs)
+
+    def __repr__(self):
+        return f"Canonizer(max_nodes={len(self._lab)})"
+
+
+#NAUTY engines, as numbered by libnautypy.
+_engines = {"sparse":lib.NAUTYPY_SPARSE, "dense":lib.NAUTYPY_DENSE, "traces":lib.NAUTYPY_TRACES}
+#Thresholds of engine="auto" (see test/benchmark_engines.py).
+_auto_dense_order = 32
+_auto_dense_density = 0.25
+_auto_traces_order = 64
+
+
+def _select_engine(engine, nv, nde, invariant=lib.NAUTYPY_INV_NONE):
+    """The libnautypy engine number for ``engine``, given the order ``nv`` and the
+    number ``nde`` of directed edges of the graph, and the libnautypy number of
+    the vertex ``invariant``.
+
+    ``"auto"`` picks ``densenauty`` for graphs with at most ``_auto_dense_order``
+    nodes, or at most ``_auto_traces_order`` nodes and an edge density of at least
+    ``_auto_dense_density``, Traces for graphs with more than ``_auto_traces_order``
+    nodes, and ``sparsenauty`` otherwise. Traces is much faster on large graphs with
+    little structure for refinement to exploit (e.g. regular graphs), but up to
+    about 2.5 times slower on large strongly regular graphs. With an invariant,
+    ``"auto"`` never picks Traces, and picks ``densenauty`` for invariants
+    without a sparse version.
+    """
+
+    if engine=="auto":
+        if invariant not in _sparse_invariants:
+            return lib.NAUTYPY_DENSE
+        if nv<=_auto_dense_order or (nv<=_auto_traces_order and nde>=_auto_dense_density*nv*(nv-1)):
+            return lib.NAUTYPY_DENSE
+        if nv>_auto_traces_order and invariant==lib.NAUTYPY_INV_NONE:
+            return lib.NAUTYPY_TRACES
+        return lib.NAUTYPY_SPARSE
+    if engine not in _engines:
+        raise ValueError(f"engine must be 'sparse', 'dense', 'traces' or 'auto', not {engine!r}")
+    if engine=="traces" and invariant!=lib.NAUTYPY_INV_NONE:
+        raise ValueError("Traces does not use vertex invariants")
+    if engine=="sparse" and invariant not in _sparse_invariants:
+        raise ValueError("only the 'distances' and 'adjacencies' invariants have sparse versions, use engine='dense'")
+    return _engines[engine]
+
+
+#NAUTY vertex invariants (see nautinv.h), as numbered by libnautypy.
+_invariants = {name:getattr(lib, "NAUTYPY_INV_"+name.upper()) for name in
+               ["twopaths", "adjtriang", "triples", "quadruples", "celltrips", "cellquads", "cellquins",
+                "distances", "indsets", "cliques", "cellcliq", "cellind", "adjacencies", "cellfano", "cellfano2",
+                "refinvar"]}
+#Invariants with a sparse version (distances_sg, adjacencies_sg), or none at all.
+_sparse_invariants = {lib.NAUTYPY_INV_NONE, lib.NAUTYPY_INV_DISTANCES, lib.NAUTYPY_INV_ADJACENCIES}
+
+
+def _invariant_options(invariant):
+    """The libnautypy invariant options ``[number, mininvarlevel, maxinvarlevel, invararg]`` of ``invariant``.
+
+    The invariant is applied at the nodes of the search tree with levels from
+    ``mininvarlevel`` to ``maxinvarlevel`` (the root has level 1), with the
+    argument ``invararg``, the meaning of which depends on the invariant
+    (e.g. the maximum distance for ``"distances"``, or the clique size for
+    ``"cliques"``; see the NAUTY User's Guide). As in NAUTY, negative
+    levels count from the level of the first leaf of the search tree.
+
+    Args:
+        invariant (None, str or tuple): None, a key of ``nautypy._invariants``, or a tuple
+            ``(name, invarlev)`` or ``(name, invarlev, invararg)``. ``invarlev`` is either
+            ``maxinvarlevel`` (with ``mininvarlevel=0``) or a pair ``(mininvarlevel, maxinvarlevel)``.
+            Defaults: ``invarlev=1`` (the root only, as in NAUTY) and ``invararg=0``.
+
+    Returns:
+        numpy.ndarray: the four options, as ``numpy.intc``. All zero if ``invariant`` is None.
+
+    """
+
+    if invariant==None:
+        return np.zeros(4, dtype=np.intc)
+    name, *args = (invariant,) if isinstance(invariant, str) else invariant
+    if name not in _invariants or len(args)>2:
+        raise ValueError(f"invariant must be None, one of {list(_invariants)}, or a tuple (name, invarlev[, invararg]), not {invariant!r}")
+    invarlev = args[0] if len(args)>0 else 1
+    invararg = args[1] if len(args)>1 else 0
+    mininvarlevel, maxinvarlevel = (0, invarlev) if isinstance(invarlev, int) else invarlev
+    return np.array([_invariants[name], mininvarlevel, maxinvarlevel, invararg], dtype=np.intc)
+
+
+#Search statistics of NAUTY (see statsblk in nauty.h), as numbered by libnautypy.
+_search_stat_names = {name:getattr(lib, "NAUTYPY_STAT_"+name.upper()) for name in
+                      ["numnodes", "numbadleaves", "maxlevel", "numgenerators", "tctotal", "canupdates",
+                       "invapplics", "invsuccesses", "invarsuclevel"]}
+
+
+def _search_stats(stats):
+    """The search statistics reported by libnautypy for one graph, as a dict.
+
+    ``numnodes`` is the number of nodes of the search tree, ``numbadleaves`` the
+    number of leaves which were of no use, ``maxlevel`` the depth of the tree,
+    ``numgenerators`` the number of automorphism generators found, ``tctotal``
+    the total size of all target cells, ``canupdates`` the number of updates of the
+    best labeling, ``invapplics`` and ``invsuccesses`` the number of applications of
+    the vertex invariant and of those which split a cell, and ``invarsuclevel`` the
+    least level at which the invariant split a cell. Traces only reports
+    ``numnodes``, ``maxlevel``, ``numgenerators`` and ``canupdates`` (the others are zero).
+    """
+
+    return {name:int(stats[i]) for name,i in _search_stat_names.items()}
+
+
+def _group_order(grpsize1, grpsize2):
+    """The group order ``grpsize1*10**grpsize2`` reported by NAUTY.
+
+    NAUTY accumulates the order in a double, and moves powers of ten into
+    ``grpsize2`` once it grows too large. The order is returned as an int
+    while ``grpsize2==0`` (where it is exact), and as a float otherwise.
+    """
+
+    if grpsize2==0:
+        return int(round(grpsize1))
+    return grpsize1*10.0**grpsize2
+
+
+def _check_n_auts(n_auts, auts=None):
+    """Raise :class:`MemoryError` if libnautypy ran out of memory for the automorphism generators
+    or for its workspace.
+
+    libnautypy flags the failure with a negative generator count.
+
+    Args:
+        n_auts (int or numpy.ndarray): The generator count(s) returned by libnautypy.
+        auts (cffi int**): The generator buffer to release first, if the caller owns it.
+
+    """
+
+    if np.min(n_auts, initial=0)<0:
+        if auts!=None:
+            lib.free_auts(auts[0])
+        raise MemoryError("libnautypy ran out of memory")
+
+
+def _unpack_auts(auts, n_ints):
+    """Wrap a flat generator buffer returned by libnautypy in a numpy array.
+
+    The array views the C buffer directly and takes ownership of it: the
+    buffer is released with :func:`_nautypy.lib.free_auts` once the array
+    (and every view of it) has been garbage collected.
+
+    Args:
+        auts (cffi int*): The buffer returned by :func:`_nautypy.lib.canonize` or :func:`_nautypy.lib.canonize_batch`.
+        n_ints (int): Number of ints in the buffer.
+
+    Returns:
+        numpy.ndarray: a flat ``numpy.intc`` array of length ``n_ints``.
+
+    """
+
+    if n_ints==0:
+        lib.free_auts(auts)
+        return np.zeros(0, dtype=np.intc)
+    auts = ffi.gc(auts, lib.free_auts)
+    return np.frombuffer(ffi.buffer(auts, n_ints*ffi.sizeof("int")), dtype=np.intc)
+
+
+def _sparse_arrays(g):
+    """Convert a zero-indexed simple graph to NAUTY sparse format.
+
+    Args:
+        g (networkx.Graph-like): A simple graph with sequential integer node labels beginning with zero.
+
+    Returns:
+        3-element tuple of numpy arrays ``(v, d, e)``: the CSR offsets, degrees and
+        concatenated neighbor lists of ``g`` (see :func:`nautypy.canonize_arrays`).
+
+    """
+
+    nv = g.number_of_nodes()
+    adj = g._adj
+    d = np.fromiter((len(adj[i]) for i in range(nv)), dtype=np.intc, count=nv)
+    v = np.zeros(nv, dtype=np.uintp)
+    np.cumsum(d[:-1], out=v[1:])
+    e = np.fromiter(chain.from_iterable(adj[i] for i in range(nv)),
+                    dtype=np.intc, count=int(d.sum()))
+    return v, d, e
+
+
+def _edges_to_sparse(n, edges):
+    """Convert an undirected edge list to NAUTY sparse format.
+
+    Args:
+        n (int): Number of nodes.
+        edges (numpy.ndarray): An ``(m,2)`` integer array of distinct, loop-free, undirected edges between nodes ``0,...,n-1``.
+
+    Returns:
+        3-element tuple of numpy arrays ``(v, d, e)`` (see :func:`nautypy.canonize_arrays`).
+
+    """
+
+    src = np.concatenate([edges[:,0], edges[:,1]])
+    dst = np.concatenate([edges[:,1], edges[:,0]])
+    d = np.bincount(src, minlength=n).astype(np.intc)
+    v = np.zeros(n, dtype=np.uintp)
+    np.cumsum(d[:-1], out=v[1:])
+    e = np.ascontiguousarray(dst[np.argsort(src, kind='stable')], dtype=np.intc)
+    return v, d, e
+
+
+def _canonize_batch(gs, _labs, _ptns, engine="sparse", invariant=None):
+    """Batched version of :func:`nautypy._canonize`.
+
+    All graphs are packed into concatenated NAUTY sparse format arrays and
+    canonized by a single call to :func:`_nautypy.lib.canonize_batch`, which
+    reuses one NAUTY workspace for the whole batch.
+
+    Args:
+        gs (list): Simple, vertex-labeled graphs, each zero-indexed as required by :func:`nautypy._canonize`.
+        _labs (list): One ``_lab`` list per graph.
+        _ptns (list): One ``_ptn`` list per graph.
+
+    Keyword Args:
+        engine (str): The NAUTY engine, chosen graph by graph for ``"auto"`` (see :func:`nautypy.canonize_arrays`).
+        invariant (None, str or tuple): The NAUTY vertex invariant, for all graphs (see :func:`nautypy.canonize_arrays`).
+
+    Returns:
+        list: One ``(canonical_map, autgens, group)`` tuple per graph, as returned by :func:`nautypy._canonize` with ``group=True``.
+
+    """
+
+    batch = _pack_batch(gs, _labs, _ptns, engine, invariant)
+    n_auts, all_auts = _run_batch(batch)
+    return _unpack_batch(batch, n_auts, all_auts)
+
+
+def _pack_batch(gs, _labs, _ptns, engine="sparse", invariant=None):
+    """Pack zero-indexed simple graphs and their color partitions into the
+    concatenated arrays expected by :func:`_nautypy.lib.canonize_batch`.
+
+    Returns:
+        dict: the numpy arrays ``engines``, ``vtx_off``, ``de_off``, ``v``, ``d``, ``e``, ``lab``, ``ptn`` and ``invariant``
+        (see :func:`nautypy._invariant_options`), keyed by name, and the output arrays ``orbits``, ``grpsize1``,
+        ``grpsize2``, ``numorbits`` and ``stats`` (``NAUTYPY_N_STATS`` search statistics per graph).
+
+    """
+
+    ng = len(gs)
+    invariant = _invariant_options(invariant)
+    csr = [_sparse_arrays(g) for g in gs]
+    #Compute per-graph offsets into the concatenated arrays.
+    vtx_off = np.zeros(ng+1, dtype=np.intc)
+    np.cumsum([len(d) for v,d,e in csr], out=vtx_off[1:])
+    de_off = np.zeros(ng+1, dtype=np.uintp)
+    np.cumsum([len(e) for v,d,e in csr], out=de_off[1:])
+    #Concatenate the graphs. Entries of v stay relative to each graph's block of e.
+    return {'engines':np.array([_select_engine(engine, len(d), len(e), invariant[0]) for v,d,e in csr],
+                               dtype=np.intc),
+            'vtx_off':vtx_off,
+            'de_off':de_off,
+            'v':np.concatenate([v for v,d,e in csr]+[np.zeros(0,dtype=np.uintp)]),
+            'd':np.concatenate([d for v,d,e in csr]+[np.zeros(0,dtype=np.intc)]),
+            'e':np.concatenate([e for v,d,e in csr]+[np.zeros(0,dtype=np.intc)]),
+            'lab':np.fromiter(chain.from_iterable(_labs), dtype=np.intc, count=vtx_off[ng]),
+            'ptn':np.fromiter(chain.from_iterable(_ptns), dtype=np.intc, count=vtx_off[ng]),
+            'invariant':invariant,
+            #Outputs: the orbits of every vertex and the group statistics of every graph.
+            'orbits':np.zeros(vtx_off[ng], dtype=np.intc),
+            'grpsize1':np.zeros(ng, dtype=np.float64),
+            'grpsize2':np.zeros(ng, dtype=np.intc),
+            'numorbits':np.zeros(ng, dtype=np.intc),
+            'stats':np.zeros(ng*lib.NAUTYPY_N_STATS, dtype=np.uintp)}
+
+
+def _run_batch(batch, timed=None):
+    """Invoke :func:`_nautypy.lib.canonize_batch` on the arrays of :func:`nautypy._pack_batch`.
+
+    The canonical labelings overwrite ``batch['lab']`` in place, and the group
+    statistics are written to the output arrays of the batch.
+
+    Keyword Args:
+        timed (None or bool): Whether NAUTY times each graph, for the active
+            :class:`nautypy.Metrics` collectors. If None, whether any collector is active.
+
+    Returns:
+        2-element tuple of numpy arrays: the number of generators of each graph, and all generators, concatenated.
+
+    """
+
+    vtx_off = batch['vtx_off']
+    ng = len(vtx_off)-1
+    #Initialize memory for automorphisms.
+    n_auts = np.zeros(ng, dtype=np.intc)
+    auts = ffi.new("int**")
+    #Invoke canonize_batch()
+    with _nauty_lock:
+        lib.canonize_batch(ng,
+                           ffi.from_buffer("int[]",batch['engines']),
+                           ffi.from_buffer("int[]",vtx_off),
+                           ffi.from_buffer("size_t[]",batch['de_off']),
+                           ffi.from_buffer("size_t[]",batch['v']),
+                           ffi.from_buffer("int[]",batch['d']),
+                           ffi.from_buffer("int[]",batch['e']),
+                           ffi.from_buffer("int[]",batch['lab']),
+                           ffi.from_buffer("int[]",batch['ptn']),
+                           ffi.from_buffer("int[]",n_auts),
+                           auts,
+                           ffi.from_buffer("int[]",batch['orbits']),
+                           ffi.from_buffer("double[]",batch['grpsize1']),
+                           ffi.from_buffer("int[]",batch['grpsize2']),
+                           ffi.from_buffer("int[]",batch['numorbits']),
+                           ffi.from_buffer("size_t[]",batch['stats']),
+                           ffi.from_buffer("int[]",batch['invariant']),
+                           bool(_metrics) if timed==None else timed)
+    _check_n_auts(n_auts, auts)
+    if _metrics:
+        _nauty_ns.last = batch['stats'][lib.NAUTYPY_STAT_NAUTY_NS::lib.NAUTYPY_N_STATS].tolist()
+    return n_auts, _unpack_auts(auts[0], int(np.dot(n_auts, np.diff(vtx_off))))
+
+
+def _unpack_batch(batch, n_auts, all_auts):
+    """Split the output of :func:`nautypy._run_batch` into one
+    ``(canonical_map, autgens, group)`` tuple per graph (see :func:`nautypy._canonize`).
+    """
+
+    vtx_off = batch['vtx_off']
+    lab = batch['lab']
+    results = []
+    aut_start = 0
+    for i in range(len(vtx_off)-1):
+        nv = int(vtx_off[i+1]-vtx_off[i])
+        canonical_map = hmap(enumerate(lab[vtx_off[i]:vtx_off[i+1]].tolist()))
+        aut_end = aut_start+int(n_auts[i])*nv
+        autgens = hlist(hmap(enumerate(aut)) for aut in
+                        all_auts[aut_start:aut_end].reshape(int(n_auts[i]),nv).tolist())
+        aut_start = aut_end
+        group = {'order':_group_order(float(batch['grpsize1'][i]), int(batch['grpsize2'][i])),
+                 'orbits':batch['orbits'][vtx_off[i]:vtx_off[i+1]],
+                 'n_orbits':int(batch['numorbits'][i]),
+                 'stats':_search_stats(batch['stats'][i*lib.NAUTYPY_N_STATS:(i+1)*lib.NAUTYPY_N_STATS])}
+        results.append((canonical_map, autgens, group))
+    return results
+
+
+def _share_batch(batch):
+    """Copy the arrays of :func:`nautypy._pack_batch` into one block of shared memory.
+
+    Returns:
+        2-element tuple containing the ``multiprocessing.shared_memory.SharedMemory``
+        block and its layout, a list of ``(name, dtype, offset, length)`` tuples
+        from which :func:`nautypy._attach_batch` rebuilds the arrays.
+
+    """
+
+    layout = []
+    nbytes = 0
+    for name,array in batch.items():
+        layout.append((name, array.dtype.str, nbytes, len(array)))
+        nbytes += -(-array.nbytes//8)*8
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes,1))
+    for name,array in _attach_batch(shm, layout).items():
+        array[:] = batch[name]
+    return shm, layout
+
+
+def _attach_batch(shm, layout):
+    """Numpy views of the batch arrays stored in the shared memory block ``shm``."""
+    return {name:np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=offset)
+            for name,dtype,offset,length in layout}
+
+
+def _run_shared_batch(shm_name, layout, timed=False):
+    """Worker-process task of :func:`nautypy.canonize_many`: canonize a batch held in
+    shared memory, writing the canonical labelings in place. NAUTY times each
+    graph if ``timed`` is set, as the collectors of the parent process are not active in the worker.
+
+    Returns:
+        The output of :func:`nautypy._run_batch`, copied out of libnautypy's buffer.
+
+    """
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        batch = _attach_batch(shm, layout)
+        n_auts, all_auts = _run_batch(batch, timed)
+        del batch
+    finally:
+        shm.close()
+    return n_auts, np.array(all_auts)
+
+
+#Color registry of nautypy.CompactMultiGraph: every distinct node/edge attribute
+#dictionary stored in a compact multigraph is interned once as an integer id (see
+#intern_color()). Canonization of networkx graphs ranks its colors per call
+#(see _rank_colors()), so the registry only grows with the colors of compact multigraphs.
+_palette = []
+_palette_ids = {}
+_palette_lock = threading.Lock()
+
+#Attribute value types whose type and value alone identify their color key.
+_atomic_types = frozenset([str, int, float, bool, complex, bytes, type(None)])
+
+
+def _color_key(value):
+    """The canonical, type-tagged form of a color (or of an attribute value).
+
+    Values which compare equal but differ in type, such as ``1``, ``1.0`` and
+    ``True``, have different keys. Dicts are keyed by their sorted items,
+    lists and tuples by their items, and sets by their sorted items, each with
+    a tag of their kind; any other value is tagged with the qualified name of
+    its type. Keys are hashable and, for colors of comparable values, ordered.
+
+    Args:
+        value: A node or edge attribute dictionary, or an attribute value.
+
+    Returns:
+        tuple: the key, a ``(tag, payload)`` pair.
+
+    """
+
+    if isinstance(value, dict):
+        return ('dict', tuple(sorted((_color_key(k), _color_key(v)) for k,v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return ('sequence', tuple(_color_key(v) for v in value))
+    if isinstance(value, (set, frozenset)):
+        return ('set', tuple(sorted(_color_key(v) for v in value)))
+    cls = type(value)
+    return (f"{cls.__module__}.{cls.__qualname__}", value)
+
+
+def _color_id_key(color):
+    """A hashable key of an attribute dictionary, equal for two colors exactly when their :func:`nautypy._color_key` are.
+
+    Cheaper than :func:`nautypy._color_key` (neither sorted nor recursive for
+    atomic values), it groups the colors of a graph before they are ranked.
+    """
+    return frozenset((type(k), k, type(v), v) if type(k) in _atomic_types and type(v) in _atomic_types
+                     else (_color_key(k), _color_key(v)) for k,v in color.items())
+
+
+def intern_color(color):
+    """The integer id of a color in the color registry of :class:`nautypy.CompactMultiGraph`, adding the color if needed.
+
+    Colors are compared by their type-tagged keys (see :func:`nautypy._color_key`),
+    so equal attribute dictionaries with values of the same types share one id.
+    Ids are assigned in order of first appearance and are only meaningful within
+    one process; the color order used for canonization depends on the colors,
+    not on their ids.
+
+    Args:
+        color (dict-like): A node or edge attribute dictionary.
+
+    Returns:
+        int: the id of ``color``.
+
+    """
+
+    key = _color_id_key(color)
+    color_id = _palette_ids.get(key)
+    if color_id==None:
+        #Store a copy, since color may be the live attribute dict of a graph.
+        color = hmap(color)
+        with _palette_lock:
+            color_id = _palette_ids.setdefault(key, len(_palette))
+            if color_id==len(_palette):
+                _palette.append(color)
+    return color_id
+
+
+def palette_color(color_id):
+    """The color (a :class:`hashable_containers.hmap`) interned as ``color_id`` by :func:`nautypy.intern_color`."""
+    return _palette[color_id]
+
+
+def _rank_colors(colors, color_sort_conditions=[]):
+    """Rank colors in the cell order of :func:`nautypy._color_partition`.
+
+    The colors are grouped by :func:`nautypy._color_id_key` in a table local to
+    the call, and only the distinct colors are sorted.
+
+    Args:
+        colors (list): Node or edge attribute dictionaries.
+
+    Keyword Args:
+        color_sort_conditions (list): See :func:`nautypy._get_color_partition`.
+
+    Returns:
+        2-element tuple containing
+
+        - **rank** (*numpy.ndarray*): the rank of each color.
+        - **distinct** (*list*): the distinct colors (the first of each group), in rank order.
+
+    """
+
+    conditions = tuple(tuple(c) for c in color_sort_conditions)
+    ids = {}
+    distinct = []
+    color_ids = np.empty(len(colors), dtype=np.intc)
+    for i,color in enumerate(colors):
+        key = _color_id_key(color)
+        color_id = ids.get(key)
+        if color_id==None:
+            color_id = ids[key] = len(distinct)
+            distinct.append(color)
+        color_ids[i] = color_id
+    keys = [_cell_order(color, conditions) for color in distinct]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    rank = np.empty(len(keys), dtype=np.intc)
+    rank[order] = np.arange(len(keys), dtype=np.intc)
+    return rank[color_ids], [distinct[i] for i in order]
+
+
 def _get_color_partition(g, color_sort_conditions=[]):
     """ Given a vertex-colored graph ``g``,
     Generate a label list ``lab`` and color partition ``ptn``.
 
     Both are formatted for argument to NAUTY.
-    Equality of colors is equivalent to equality of
-    node attribute dictionaries, so no attributes are ignored.
+    Two nodes have the same color if their attribute dictionaries are equal,
+    with values of the same types (see :func:`nautypy._color_key`), so no
+    attributes are ignored.
 
     Args:
         g (hashable_containers.HGraph)
@@ -150,30 +891,59 @@ def _get_color_partition(g, color_sort_conditions=[]):
 
     """
 
-    g = _standardize_graph_encoding(g)
-    color_cells = g._node.fibers()
-    cell_orders = hmap()
-    for color in color_cells.keys():
-        order = 0
-        for n,c in enumerate(color_sort_conditions[::-1]):
-            if c[0] in color:
-                coeff = int(color[c[0]]!=c[1])
-            else:
-                coeff = 1
-            order+= coeff*2**n
-        cell_orders[color] = order
-    colors_by_order = cell_orders.fibers()
-    lab = []
-    ptn = []
-    for order in sorted(list(colors_by_order.keys())):
-        colors = colors_by_order[order]
-        for color in sorted(colors):
-            lab += sorted(color_cells[color])
-            ptn += ([1 for i in range(0,len(color_cells[color])-1)]+[0,])
-    return lab,ptn
-
-
-def canonize_simple_graph(g, color_sort_conditions = []):
+    nodes = sorted(g._node)
+    lab, ptn, cells = _color_partition([g._node[node] for node in nodes],
+                                       color_sort_conditions=color_sort_conditions)
+    return [nodes[i] for i in lab], ptn
+
+
+def _color_partition(colors, color_sort_conditions=[]):
+    """Compute ``lab`` and ``ptn`` from a list of node colors.
+
+    Implements the color ordering described in :func:`nautypy._get_color_partition`
+    for nodes given only by position: cells are ordered first by ``color_sort_conditions``
+    and then by the colors themselves, compared by their type-tagged keys (see
+    :func:`nautypy._color_key`). Only the distinct colors are compared (see
+    :func:`nautypy._rank_colors`), and ``lab`` is a stable argsort of their ranks.
+
+    Args:
+        colors (list): The color (a dict-like) of node ``i`` at position ``i``.
+
+    Keyword Args:
+        color_sort_conditions (list): See :func:`nautypy._get_color_partition`.
+
+    Returns:
+        3-element tuple containing
+
+        - **lab** (*list*): Node positions, ordered by color cell and ascending within each cell.
+        - **ptn** (*list*): Color cell boundaries aligned to ``lab``.
+        - **cells** (*list*): One ``(color, size)`` tuple per color cell, in ``lab`` order.
+
+    """
+
+    rank, cell_colors = _rank_colors(colors, color_sort_conditions)
+    lab = np.argsort(rank, kind='stable')
+    cell = rank[lab]
+    ptn = np.append(cell[1:]==cell[:-1], False).astype(np.intc)
+    sizes = np.bincount(rank, minlength=len(cell_colors))
+    cells = list(zip(cell_colors, sizes.tolist()))
+    return lab.tolist(), ptn.tolist(), cells
+
+
+def _cell_order(color, color_sort_conditions):
+    """The sort key of a color cell in :func:`nautypy._color_partition`."""
+    order = 0
+    for n,c in enumerate(color_sort_conditions[::-1]):
+        if c[0] in color:
+            coeff = int(color[c[0]]!=c[1])
+        else:
+            coeff = 1
+        order+= coeff*2**n
+    return (order, _color_key(color))
+
+
+def canonize_simple_graph(g, color_sort_conditions = [], cache=None, return_graph=True, group=False,
+                          engine="sparse", invariant=None, canonizer=None):
     """Canonize a vertex-colored simple graph.
 
     Interfaces with the NAUTY graph canonization program [https://pallini.di.uniroma1.it/]
@@ -205,13 +975,57 @@ def canonize_simple_graph(g, color_sort_conditions = []):
 
     Keyword Args:
         color_sort_conditions (list): A list of tuples (key:state) used to establish a partial color ordering among the canonical labels (see :func:`nautypy._get_color_partition` for details).
+        cache (None or nautypy.CanonCache): if not None, look ``g`` up in ``cache`` first, and store the result there on a miss.
+        return_graph (bool or str): If True (default), construct ``g_canonical``. If False, skip stage 5 and return None in its place. If ``"view"``, return a :class:`nautypy.CanonicalView`, which constructs ``g_canonical`` on first use. If ``"frozen"``, return ``g_canonical`` as a :class:`hashable_containers.FrozenHGraph` (or :class:`hashable_containers.FrozenHMultiGraph`), with its hash computed once. With a ``cache``, the stored graph is returned for ``"view"``.
+        group (bool): If True, also return the order and orbits of `Aut(g)`, and the search statistics, as computed by NAUTY. The ``cache`` is bypassed.
+        engine (str): The NAUTY engine, ``"sparse"`` (default), ``"dense"``, ``"traces"`` or ``"auto"`` (see :func:`nautypy.canonize_arrays`). Canonical isomorphs are only comparable between calls using the same engine.
+        invariant (None, str or tuple): The NAUTY vertex invariant, e.g. ``"distances"`` or ``("cellquads", 2)`` (see :func:`nautypy.canonize_arrays`). Canonical isomorphs are only comparable between calls using the same invariant.
+        canonizer (None or nautypy.Canonizer): If not None, the reusable NAUTY workspace to canonize with (see :class:`nautypy.Canonizer`). The result is the same.
 
     Returns:
-        3-element tuple containing
+        3-element tuple (4-element tuple, with ``group``) containing
 
         - **g_canonical** (*networkx.Graph-like*): canonical isomorph of the input graph ``g``. The return object belongs to the same class as the input graph ``g``.
         - **g_autgens** (*list*): a list of dict-like automorphism generators of `Aut(g)`
         - **g_canonical_map** (*dict-like*): the node label permutation mapping ``g_canonical`` to the input graph ``g``.
+        - **g_group** (*dict*): ``'order'``, the order of `Aut(g)` (see :func:`nautypy._group_order`), ``'orbits'``,
+          a map from each node to the least node (in sorted order) of its orbit, ``'n_orbits'``, the number of orbits,
+          and ``'stats'``, the search statistics (see :func:`nautypy._search_stats`).
+
+    """
+
+    if cache!=None and not group:
+        return _cached_result(cache.canonize(g, color_sort_conditions=color_sort_conditions, engine=engine,
+                                             invariant=invariant, canonizer=canonizer), return_graph)
+    timer = _Timer() if _metrics else None
+    g, g_z, input_to_zero, lab, ptn = _prepare_simple_graph(g,
+        color_sort_conditions=color_sort_conditions)
+    if timer!=None:
+        timer.lap('prepare')
+    #Canonize
+    g_z_canonical_map, g_z_autgens, g_z_group = _canonize(g_z, lab, ptn, group=True, engine=engine,
+                                                        invariant=invariant, canonizer=canonizer)
+    if timer!=None:
+        timer.lap('canonize')
+    result = _finish_simple_graph(g, input_to_zero, g_z_canonical_map, g_z_autgens,
+                                  return_graph=return_graph, host=(g_z, g_z_group) if group else None)
+    if timer!=None:
+        timer.lap('finish')
+        _record('canonize_simple_graph', timer.stages, [(g_z.number_of_nodes(), g_z.number_of_edges())],
+                [g_z_group['stats']])
+    return result
+
+
+def _prepare_simple_graph(g, color_sort_conditions=[]):
+    """Stages 1-2 of :func:`nautypy.canonize_simple_graph`.
+
+    Returns:
+        5-element tuple containing
+
+        - **g** (*networkx.Graph-like*): standardized copy of the input graph.
+        - **g_z** (*hashable_containers.HGraph*): zero-indexed copy of ``g``.
+        - **input_to_zero** (*dict*): the map from the node labels of ``g`` to those of ``g_z``.
+        - **lab**, **ptn** (*list*): the color partition of ``g_z`` (see :func:`nautypy._get_color_partition`).
 
     """
 
@@ -219,28 +1033,123 @@ def canonize_simple_graph(g, color_sort_conditions = []):
     #Convert from input labeling to zero-indexed integer labeling.
     input_to_zero = {node:index for index,node in enumerate(sorted(g.nodes.keys()))}
     g_z = HGraph(nx.relabel_nodes(g,input_to_zero,copy=True))
-    zero_to_input = {val:key for key,val in input_to_zero.items()}
     #Compute lab and ptn arrays.
-    color_cells = g_z._node.fibers()
     lab, ptn = _get_color_partition(g_z, color_sort_conditions=color_sort_conditions)
-    #Canonize
-    g_z_canonical_map, g_z_autgens = _canonize(g_z, lab, ptn)
+    return g, g_z, input_to_zero, lab, ptn
+
+
+def _finish_simple_graph(g, input_to_zero, g_z_canonical_map, g_z_autgens, return_graph=True, host=None):
+    """Stages 4-5 of :func:`nautypy.canonize_simple_graph`, given the output
+    of :func:`nautypy._canonize` on the zero-indexed graph.
+
+    If ``host`` is not None, it is the pair ``(g_z, g_z_group)`` of the zero-indexed
+    graph and its group statistics, and the group of ``g`` is appended to the result.
+    """
+
+    zero_to_input = {val:key for key,val in input_to_zero.items()}
     #Convert from zero-indexed integer labeling to input labeling.
     g_canonical_map = {key:zero_to_input[g_z_canonical_map[val]] for key,val in input_to_zero.items()}
     g_autgens = hlist()
     for gen_z in g_z_autgens:
         gen = {key:zero_to_input[gen_z[val]] for key,val in input_to_zero.items()}
         g_autgens.append(gen)
+    g_canonical = _canonical_graph(_canonical_simple_graph, g, g_canonical_map, return_graph)
+    if host!=None:
+        g_group = _relabel_group(host[1], input_to_zero, zero_to_input)
+        return g_canonical, g_autgens, g_canonical_map, g_group
+    return g_canonical, g_autgens, g_canonical_map
+
+
+def _relabel_group(g_z_group, input_to_zero, zero_to_input):
+    """Send the orbits of a group computed by :func:`nautypy.canonize_arrays`
+    from the zero-indexed vertices to the input node labels (of the vertices in ``input_to_zero``)."""
+    orbits = g_z_group['orbits'].tolist()
+    return {'order':g_z_group['order'],
+            'orbits':{key:zero_to_input[orbits[val]] for key,val in input_to_zero.items()},
+            'n_orbits':len({orbits[val] for val in input_to_zero.values()}),
+            'stats':g_z_group['stats']}
+
+
+def _canonical_simple_graph(g, g_canonical_map):
+    """Stage 5 of :func:`nautypy.canonize_simple_graph`."""
     #Invert the canonical map.
     g_inverse_canonical_map = hmap({val:key for key,val in g_canonical_map.items()})
     #Construct the canonical isomorph.
     g_canonical = g.__class__(nx.relabel_nodes(g,g_inverse_canonical_map,copy=True))
     #Standardize dict order
-    g_canonical = _standardize_graph_encoding(g_canonical)
-    return g_canonical, g_autgens, g_canonical_map
+    return _standardize_graph_encoding(g_canonical)
+
+
+def _canonical_graph(construct, g, g_canonical_map, return_graph):
+    """Construct the canonical isomorph with ``construct``, lazily, or not at all, according to ``return_graph``."""
+    if return_graph==True:
+        return construct(g, g_canonical_map)
+    if return_graph==False:
+        return None
+    if return_graph=="view":
+        return CanonicalView(partial(construct, g, g_canonical_map))
+    if return_graph=="frozen":
+        return freeze(construct(g, g_canonical_map))
+    raise ValueError(f"return_graph must be True, False, 'view' or 'frozen', not {return_graph!r}")
+
+
+def _cached_result(result, return_graph):
+    """Apply ``return_graph`` to a result stored in a :class:`nautypy.CanonCache`."""
+    if return_graph==False:
+        return (None,)+tuple(result[1:])
+    if return_graph=="frozen" and not getattr(result[0], 'frozen', False):
+        return (freeze(result[0]),)+tuple(result[1:])
+    return result
+
+
+class CanonicalView:
+    """Canonical isomorph, constructed on first use.
+
+    Returned in place of the canonical isomorph by the canonization functions
+    when called with ``return_graph="view"``. The view keeps a reference to
+    the (standardized) input graph and the canonical map, and constructs the
+    canonical isomorph the first time it is needed: through
+    :meth:`nautypy.CanonicalView.materialize`, or implicitly on attribute access,
+    iteration, ``len``, ``in`` or indexing, which are forwarded to the graph.
+    """
+
+    __slots__ = ('_construct', '_graph')
+
+    def __init__(self, construct):
+        self._construct = construct
+        self._graph = None
+
+    def materialize(self):
+        """The canonical isomorph, constructed on the first call."""
+        if self._construct!=None:
+            self._graph = self._construct()
+            self._construct = None
+        return self._graph
+
+    def __getattr__(self, name):
+        if name in CanonicalView.__slots__:
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __len__(self):
+        return len(self.materialize())
 
+    def __contains__(self, node):
+        return node in self.materialize()
 
-def canonize_multigraph(mg, color_sort_conditions=[], hostgraphs=None):
+    def __getitem__(self, node):
+        return self.materialize()[node]
+
+    def __repr__(self):
+        state = "materialized" if self._construct==None else "pending"
+        return f"CanonicalView({state})"
+
+
+def canonize_multigraph(mg, color_sort_conditions=[], hostgraphs=None, cache=None, embedding="edges",
+                        return_graph=True, group=False, engine="sparse", invariant=None, canonizer=None):
     """Canonize an edge- and vertex-colored multigraph.
 
     Given a multigraph derived from ``networkx.MultiGraph``, canonization
@@ -248,7 +1157,8 @@ def canonize_multigraph(mg, color_sort_conditions=[], hostgraphs=None):
 
     1. The node indices of ``mg`` are mapped to zero-indexed integers. 
     2. The multigraph is embedded in a simple, vertex-colored "host" graph derived from
-       ``networkx.Graph`` by :func:`nautypy._embed_multigraph`.
+       ``networkx.Graph`` by :func:`nautypy._embed_multigraph`, using the strategy
+       selected by ``embedding``.
     3. The host graph is passed to :func:`nautypy._canonize`, producing
        the canonical isomorph of the host graph, a list of its automorphism generators,
        and the canonical map which sends the canonical host graph to the input host graph.
@@ -266,43 +1176,169 @@ def canonize_multigraph(mg, color_sort_conditions=[], hostgraphs=None):
     Keyword Args:
         color_sort_conditions (list): A list of tuples (key:state) used to establish a partial color ordering among the canonical labels (see :func:`nautypy._get_color_partition` for details).
         hostgraphs (None or dict-like): if not None, update ``hostgraphs`` with copies of the input and canonized host graphs.
+        cache (None or nautypy.CanonCache): if not None, look ``mg`` up in ``cache`` first, and store the result there on a miss. The cache is bypassed when ``hostgraphs`` is given.
+        embedding (str): The host graph construction, ``"edges"`` (default), ``"bundled"`` or ``"layered"`` (see :func:`nautypy._embed_multigraph`). Canonical isomorphs are only comparable between calls using the same embedding.
+        return_graph (bool or str): If True (default), construct ``mg_canonical``. If False, skip stage 6 and return None in its place. If ``"view"`` or ``"frozen"``, return a :class:`nautypy.CanonicalView` or a frozen graph (see :func:`nautypy.canonize_simple_graph`).
+        group (bool): If True, also return the order and orbits of `Aut(mg)` and of the automorphism group of the host graph, as computed by NAUTY. The ``cache`` is bypassed.
+        engine (str): The NAUTY engine used on the host graph (see :func:`nautypy.canonize_simple_graph`).
+        invariant (None, str or tuple): The NAUTY vertex invariant used on the host graph (see :func:`nautypy.canonize_simple_graph`).
+        canonizer (None or nautypy.Canonizer): See :func:`nautypy.canonize_simple_graph`.
 
     Returns:
-        3-element tuple containing
+        3-element tuple (4-element tuple, with ``group``) containing
 
         - **mg_canonical** (*networkx.MultiGraph-like*): canonical isomorph of the input multigraph ``mg``. The return object belongs to the same class as ``mg``.
         - **mg_autgens** (*list*): a list of dict-like automorphism generators of `Aut(mg)`
         - **mg_canonical_map** (*dict-like*): the node label permutation mapping mg_canonical to the input multigraph ``mg``.
+        - **mg_group** (*dict*): the group of the vertex permutations of ``mg`` which extend to automorphisms,
+          as in :func:`nautypy.canonize_simple_graph`, and under ``'host'``, the order, orbits (of the
+          zero-indexed host nodes) and orbit count of the automorphism group of the host graph.
+          With the ``"edges"`` embedding, the host group also permutes parallel edges of like color
+          (see :func:`nautypy.symmetry_factor`).
 
     """
 
-    mg = _standardize_graph_encoding(mg)
-    #Nauty expects zero-indexed consectutive integers as node labels.
-    #Convert from input labeling to zero-indexed integer labeling.
-    input_to_zero = {node:index for index,node in enumerate(sorted(mg.nodes.keys()))}
-    mg_z = HMultiGraph(nx.relabel_nodes(mg,input_to_zero,copy=True))
-    zero_to_input = {val:key for key,val in input_to_zero.items()}
-    #Embed MultiGraph mg in a simple, vertex-colored host graph G
-    g_z = _embed_multigraph(mg_z)
+    if cache!=None and hostgraphs==None and not group:
+        return _cached_result(cache.canonize(mg, color_sort_conditions=color_sort_conditions,
+                                             embedding=embedding, engine=engine, invariant=invariant,
+                                             canonizer=canonizer),
+                              return_graph)
+    timer = _Timer() if _metrics else None
+    mg, g_z, input_to_zero, lab, ptn = _prepare_multigraph(mg,
+        color_sort_conditions=color_sort_conditions, embedding=embedding)
     #Optionally store the host graph.
     if hostgraphs!=None:
         hostgraphs['host'] = g_z
-    #Compute lab and ptn arrays.
-    #Don't mix vertex and edge labels
-    lab, ptn = _get_color_partition(g_z,
-        color_sort_conditions = [('type','vertex')]+color_sort_conditions)
+    if timer!=None:
+        timer.lap('prepare')
     #Compute a canonically labeled host graph CG from g.
-    g_z_canonical_map, g_z_autgens = _canonize(g_z, lab, ptn)
+    g_z_canonical_map, g_z_autgens, g_z_group = _canonize(g_z, lab, ptn, group=True, engine=engine,
+                                                        invariant=invariant, canonizer=canonizer)
+    if timer!=None:
+        timer.lap('canonize')
     #Optionally store the canonized host graph.
     if hostgraphs!=None:
         g_z_inverse_canonical_map = hmap({val:key for key,val in g_z_canonical_map.items()})
         hostgraphs['host_canonical'] = nx.relabel_nodes(g_z,g_z_inverse_canonical_map,copy=True)
+    result = _finish_multigraph(mg, input_to_zero, g_z_canonical_map, g_z_autgens,
+                                return_graph=return_graph, host=(g_z, g_z_group) if group else None)
+    if timer!=None:
+        timer.lap('finish')
+        _record('canonize_multigraph', timer.stages, [(g_z.number_of_nodes(), g_z.number_of_edges())],
+                [g_z_group['stats']])
+    return result
+
+
+def _prepare_multigraph(mg, color_sort_conditions=[], embedding="edges"):
+    """Stages 1-2 of :func:`nautypy.canonize_multigraph`.
+
+    Returns:
+        5-element tuple containing
+
+        - **mg** (*networkx.MultiGraph-like*): standardized copy of the input multigraph.
+        - **g_z** (*hashable_containers.HGraph*): the zero-indexed host graph of ``mg``.
+        - **input_to_zero** (*dict*): the map from the node labels of ``mg`` to the vertex nodes of ``g_z``.
+        - **lab**, **ptn** (*list*): the color partition of ``g_z`` (see :func:`nautypy._get_color_partition`).
+
+    """
+
+    mg = _standardize_graph_encoding(mg)
+    #Nauty expects zero-indexed consectutive integers as node labels.
+    #Convert from input labeling to zero-indexed integer labeling.
+    input_to_zero = {node:index for index,node in enumerate(sorted(mg.nodes.keys()))}
+    mg_z = HMultiGraph(nx.relabel_nodes(mg,input_to_zero,copy=True))
+    #Embed MultiGraph mg in a simple, vertex-colored host graph G
+    g_z = _embed_multigraph(mg_z, embedding=embedding)
+    #Compute lab and ptn arrays.
+    if embedding=="layered":
+        #Order the layers, so that the vertices of mg are the first layer.
+        n_layers = g_z.order()//max(mg_z.order(),1)
+        conditions = [('layer',layer) for layer in range(n_layers)]
+    else:
+        #Don't mix vertex and edge labels
+        conditions = [('type','vertex')]
+    lab, ptn = _get_color_partition(g_z,
+        color_sort_conditions = conditions+color_sort_conditions)
+    return mg, g_z, input_to_zero, lab, ptn
+
+
+def _finish_multigraph(mg, input_to_zero, g_z_canonical_map, g_z_autgens, return_graph=True, host=None):
+    """Stages 4-6 of :func:`nautypy.canonize_multigraph`, given the output
+    of :func:`nautypy._canonize` on the zero-indexed host graph.
+
+    If ``host`` is not None, it is the pair ``(g_z, g_z_group)`` of the host graph
+    and its group statistics, and the group of ``mg`` is appended to the result.
+    """
+
+    zero_to_input = {val:key for key,val in input_to_zero.items()}
     #Convert from zero-indexed integer labeling to input labeling.
     mg_canonical_map = {key:zero_to_input[g_z_canonical_map[val]] for key,val in input_to_zero.items()}
     mg_autgens = hlist()
     for gen_z in g_z_autgens:
         gen = {key:zero_to_input[gen_z[val]] for key,val in input_to_zero.items()}
         mg_autgens.append(gen)
+    mg_canonical = _canonical_graph(_canonical_multigraph, mg, mg_canonical_map, return_graph)
+    if host!=None:
+        mg_group = _multigraph_group(*host, input_to_zero, zero_to_input)
+        return mg_canonical, mg_autgens, mg_canonical_map, mg_group
+    return mg_canonical, mg_autgens, mg_canonical_map
+
+
+def _multigraph_group(g_z, g_z_group, input_to_zero, zero_to_input):
+    """The group of a multigraph, given the group of its host graph ``g_z``.
+
+    The host automorphisms fixing every vertex of the multigraph permute edge
+    nodes with the same color and the same ends (twins). They form a direct
+    product of symmetric groups, the order of which is divided out of the
+    order of the host group.
+    """
+
+    twins = {}
+    for node,attrs in g_z._node.items():
+        if attrs.get('type')=='edge':
+            twin = (hmap(attrs), tuple(sorted(g_z._adj[node])))
+            twins[twin] = twins.get(twin, 0)+1
+    kernel = 1
+    for count in twins.values():
+        kernel *= math.factorial(count)
+    mg_group = _relabel_group(g_z_group, input_to_zero, zero_to_input)
+    order = g_z_group['order']
+    mg_group['order'] = order//kernel if isinstance(order, int) else order/kernel
+    mg_group['host'] = {'order':order,
+                        'orbits':dict(enumerate(g_z_group['orbits'].tolist())),
+                        'n_orbits':g_z_group['n_orbits']}
+    return mg_group
+
+
+def symmetry_factor(mg):
+    """The symmetry factor of a multigraph, e.g. of a vacuum Feynman diagram.
+
+    The symmetry factor is the order of the automorphism group of ``mg`` acting
+    on its vertices, edges and edge ends (half-edges), with colors respected.
+    It is the order of the host graph group of the ``"edges"`` embedding (which
+    already permutes parallel edges of like color), times two for every
+    self-loop, which can be flipped. No additional group computation is needed.
+
+    Args:
+        mg (networkx.MultiGraph-like): the multigraph.
+
+    Returns:
+        int or float: the symmetry factor (see :func:`nautypy._group_order`).
+
+    Example:
+        The figure-eight vacuum diagram (one vertex, two self-loops) has symmetry factor ``2!*2*2=8``::
+
+            mg = nx.MultiGraph([(0,0),(0,0)])
+            nautypy.symmetry_factor(mg)
+
+    """
+
+    mg_group = canonize_multigraph(mg, return_graph=False, group=True)[3]
+    return mg_group['host']['order']*2**nx.number_of_selfloops(mg)
+
+
+def _canonical_multigraph(mg, mg_canonical_map):
+    """Stage 6 of :func:`nautypy.canonize_multigraph`."""
     #Invert the canonical map.
     mg_inverse_canonical_map = hmap({val:key for key,val in mg_canonical_map.items()})
     #Construct the canonical isomorph.
@@ -320,8 +1356,1480 @@ def canonize_multigraph(mg, color_sort_conditions=[], hostgraphs=None):
     #Convert to input graph class
     mg_canonical = mg.__class__(mg_canonical_edgesort)
     #Standardize dict order
-    mg_canonical = _standardize_graph_encoding(mg_canonical)
-    return mg_canonical, mg_autgens, mg_canonical_map
+    return _standardize_graph_encoding(mg_canonical)
+
+
+def canonize_many(graphs, color_sort_conditions=[], workers=None, chunksize=256, ordered=True,
+                  backend="processes", embedding="edges", return_graph=True, group=False, engine="sparse",
+                  invariant=None):
+    """Canonize a batch of graphs and/or multigraphs with batched calls to NAUTY.
+
+    Each graph is prepared exactly as in :func:`nautypy.canonize_simple_graph`
+    (or :func:`nautypy.canonize_multigraph`, if ``g.is_multigraph()``), but
+    the resulting host graphs are passed to NAUTY together by
+    :func:`_nautypy.lib.canonize_batch`. The cost of crossing the FFI and of
+    allocating NAUTY's workspace is thus paid once per batch rather than once
+    per graph.
+
+    With ``workers>1``, the graphs are consumed lazily in chunks of ``chunksize``
+    and the NAUTY calls are distributed over a pool of workers. With the
+    ``"processes"`` backend, only compact integer arrays (NAUTY sparse format
+    and color partitions) are sent to the worker processes, through
+    ``multiprocessing.shared_memory``; graph preparation and the construction of
+    the results remain in the calling process. With the ``"threads"`` backend,
+    each chunk is prepared, canonized and finished by a worker thread, which
+    releases the GIL while NAUTY runs. Threads only canonize concurrently if
+    NAUTY was built with thread-local storage (see ``lib.thread_safe()``);
+    otherwise the calls to NAUTY are serialized.
+
+    Args:
+        graphs (iterable): graphs derived from ``networkx.Graph`` and/or ``networkx.MultiGraph``.
+
+    Keyword Args:
+        color_sort_conditions (list): A list of tuples (key:state) used to establish a partial color ordering among the canonical labels (see :func:`nautypy._get_color_partition` for details).
+        workers (None or int): Number of worker processes. If None (default) or 1, canonize all graphs in the calling process with a single call to NAUTY.
+        chunksize (int): Number of graphs per worker task.
+        ordered (bool): If True (default), return the results as a list in input order. Otherwise, return an iterator over ``(index, result)`` tuples, yielded as the chunks complete.
+        backend (str): ``"processes"`` (default) or ``"threads"``.
+        embedding (str): The multigraph embedding (see :func:`nautypy.canonize_multigraph`).
+        return_graph (bool or str): True (default), False, ``"view"`` or ``"frozen"`` (see :func:`nautypy.canonize_simple_graph`).
+        group (bool): If True, also return the group of each graph (see :func:`nautypy.canonize_simple_graph`).
+        engine (str): The NAUTY engine (see :func:`nautypy.canonize_simple_graph`). With ``"auto"``, the engine is picked graph by graph.
+        invariant (None, str or tuple): The NAUTY vertex invariant (see :func:`nautypy.canonize_simple_graph`).
+
+    Returns:
+        list or iterator: one 3-element tuple ``(g_canonical, g_autgens, g_canonical_map)`` (4-element tuple with ``group``) per input graph,
+        as returned by :func:`nautypy.canonize_simple_graph` or :func:`nautypy.canonize_multigraph`.
+
+    """
+
+    if workers==None or workers<=1:
+        timer = _Timer() if _metrics else None
+        prepared = [_prepare(g, color_sort_conditions, embedding) for g in graphs]
+        if timer!=None:
+            timer.lap('prepare')
+        canonized = _canonize_batch([p[2] for p in prepared],
+                                    [p[4] for p in prepared],
+                                    [p[5] for p in prepared], engine, invariant)
+        if timer!=None:
+            timer.lap('canonize')
+        results = [_finish(p, c, return_graph, group) for p,c in zip(prepared, canonized)]
+        if timer!=None and prepared:
+            timer.lap('finish')
+            _record_prepared('canonize_many', timer.stages, prepared, canonized)
+        return results if ordered else enumerate(results)
+    if backend=="processes":
+        results = _canonize_many_parallel(graphs, color_sort_conditions, workers, chunksize, embedding,
+                                          return_graph, group, engine, invariant)
+    elif backend=="threads":
+        results = _canonize_many_threaded(graphs, color_sort_conditions, workers, chunksize, embedding,
+                                          return_graph, group, engine, invariant)
+    else:
+        raise ValueError(f"backend must be 'processes' or 'threads', not {backend!r}")
+    if not ordered:
+        return results
+    results = dict(results)
+    return [results[i] for i in range(len(results))]
+
+
+def _prepare(g, color_sort_conditions, embedding="edges"):
+    """Prepare a graph or multigraph for canonization, tagging it with its finishing stage."""
+    if g.is_multigraph():
+        return (_finish_multigraph,)+_prepare_multigraph(g,
+            color_sort_conditions=color_sort_conditions, embedding=embedding)
+    return (_finish_simple_graph,)+_prepare_simple_graph(g,
+        color_sort_conditions=color_sort_conditions)
+
+
+def _finish(prepared, canonized, return_graph=True, group=False):
+    """Finish a graph tagged by :func:`nautypy._prepare`, given the output of :func:`nautypy._canonize`."""
+    finish, g, g_z, input_to_zero, lab, ptn = prepared
+    g_z_canonical_map, g_z_autgens, g_z_group = canonized
+    return finish(g, input_to_zero, g_z_canonical_map, g_z_autgens, return_graph=return_graph,
+                  host=(g_z, g_z_group) if group else None)
+
+
+def _canonize_many_parallel(graphs, color_sort_conditions, workers, chunksize, embedding="edges",
+                            return_graph=True, group=False, engine="sparse", invariant=None):
+    """Process-pool backend of :func:`nautypy.canonize_many`.
+
+    At most ``2*workers`` chunks are in flight at any time, so that the input
+    iterable is consumed no faster than the pool can canonize it.
+
+    Yields:
+        ``(index, result)`` tuples, in order of completion.
+
+    """
+
+    graphs = iter(graphs)
+    chunks = enumerate(iter(lambda: list(islice(graphs, chunksize)), []))
+    pending = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                #Keep the pool busy.
+                for n,chunk in chunks:
+                    timer = _Timer() if _metrics else None
+                    prepared = [_prepare(g, color_sort_conditions, embedding) for g in chunk]
+                    if timer!=None:
+                        timer.lap('prepare')
+                    batch = _pack_batch([p[2] for p in prepared],
+                                        [p[4] for p in prepared],
+                                        [p[5] for p in prepared], engine, invariant)
+                    shm, layout = _share_batch(batch)
+                    if timer!=None:
+                        timer.lap('marshal')
+                    future = pool.submit(_run_shared_batch, shm.name, layout, timer!=None)
+                    pending[future] = (n*chunksize, prepared, shm, layout, timer)
+                    if len(pending)>=2*workers:
+                        break
+                if not pending:
+                    return
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, prepared, shm, layout, timer = pending.pop(future)
+                    if timer!=None:
+                        #Time spent waiting for the pool is not charged to any stage.
+                        timer.last = perf_counter()
+                    try:
+                        n_auts, all_auts = future.result()
+                        batch = {name:np.array(array) for name,array in _attach_batch(shm, layout).items()}
+                    finally:
+                        shm.close()
+                        shm.unlink()
+                    canonized = _unpack_batch(batch, n_auts, all_auts)
+                    if timer!=None:
+                        timer.lap('marshal')
+                    results = [_finish(p, c, return_graph, group) for p,c in zip(prepared, canonized)]
+                    if timer!=None:
+                        timer.lap('finish')
+                        _record_prepared('canonize_many', timer.stages, prepared, canonized,
+                                         batch['stats'][lib.NAUTYPY_STAT_NAUTY_NS::lib.NAUTYPY_N_STATS].tolist())
+                    for i,result in enumerate(results):
+                        yield start+i, result
+    finally:
+        #Release the shared memory of abandoned chunks.
+        for start, prepared, shm, layout, timer in pending.values():
+            shm.close()
+            shm.unlink()
+
+
+def _canonize_many_threaded(graphs, color_sort_conditions, workers, chunksize, embedding="edges",
+                            return_graph=True, group=False, engine="sparse", invariant=None):
+    """Thread-pool backend of :func:`nautypy.canonize_many`.
+
+    As in :func:`nautypy._canonize_many_parallel`, at most ``2*workers`` chunks are in flight.
+
+    Yields:
+        ``(index, result)`` tuples, in order of completion.
+
+    """
+
+    def canonize_chunk(start, chunk):
+        return start, canonize_many(chunk, color_sort_conditions=color_sort_conditions,
+                                    embedding=embedding, return_graph=return_graph, group=group,
+                                    engine=engine, invariant=invariant)
+
+    graphs = iter(graphs)
+    chunks = enumerate(iter(lambda: list(islice(graphs, chunksize)), []))
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            for n,chunk in chunks:
+                pending.add(pool.submit(canonize_chunk, n*chunksize, chunk))
+                if len(pending)>=2*workers:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, results = future.result()
+                for i,result in enumerate(results):
+                    yield start+i, result
+
+
+def certificate(g, color_sort_conditions=[], digest_size=None, engine="sparse", invariant=None, canonizer=None):
+    """Compute a canonical certificate of a vertex-colored simple graph (or of a multigraph).
+
+    Two graphs have equal certificates if and only if they are isomorphic (with
+    colors respected), so certificates can serve as hash table keys for
+    isomorphism classes. Unlike :func:`nautypy.canonize_simple_graph`, no
+    networkx object is constructed: the graph is read once into NAUTY sparse
+    format, canonized, and the canonical edge list is serialized directly.
+    Graph attributes (``g.graph``) are ignored.
+
+    Multigraphs (``g.is_multigraph()``) are passed on to :func:`nautypy.certificate_multigraph`.
+
+    Args:
+        g (networkx.Graph-like): the graph to certify.
+
+    Keyword Args:
+        color_sort_conditions (list): A list of tuples (key:state) used to establish a partial color ordering among the canonical labels (see :func:`nautypy._get_color_partition` for details). Certificates are only comparable between calls using the same conditions.
+        digest_size (None or int): if not None, return the ``digest_size``-byte BLAKE2b digest of the certificate (e.g. 8 or 16 for a 64- or 128-bit key) instead of the certificate itself.
+        engine (str): The NAUTY engine (see :func:`nautypy.canonize_arrays`). Certificates are only comparable between calls using the same engine.
+        invariant (None, str or tuple): The NAUTY vertex invariant (see :func:`nautypy.canonize_arrays`). Certificates are only comparable between calls using the same invariant.
+        canonizer (None or nautypy.Canonizer): See :func:`nautypy.canonize_simple_graph`.
+
+    Returns:
+        bytes: the certificate (see :func:`nautypy._certificate` for its layout) or its digest.
+
+    """
+
+    if g.is_multigraph():
+        return certificate_multigraph(g, color_sort_conditions=color_sort_conditions,
+                                      digest_size=digest_size, engine=engine, invariant=invariant,
+                                      canonizer=canonizer)
+    index = {node:i for i,node in enumerate(g._node)}
+    colors = [hmap(attrs) for attrs in g._node.values()]
+    edges = np.array([(index[a],index[b]) for a,b in g.edges()], dtype=np.intc).reshape(-1,2)
+    return _certificate(len(index), edges, colors, color_sort_conditions, digest_size, engine, invariant,
+                        canonizer)
+
+
+def certificate_multigraph(mg, color_sort_conditions=[], digest_size=None, embedding="edges", engine="sparse",
+                           invariant=None, canonizer=None):
+    """Compute a canonical certificate of an edge- and vertex-colored multigraph.
+
+    The multigraph is embedded in the host graph of :func:`nautypy._embed_multigraph`,
+    built directly in NAUTY sparse format, and certified as in :func:`nautypy.certificate`.
+    As in :func:`nautypy.canonize_multigraph`, vertex colors are ordered before edge colors.
+    Certificates are only comparable between calls using the same ``embedding``.
+
+    Args:
+        mg (networkx.MultiGraph-like): the multigraph to certify.
+
+    Keyword Args:
+        color_sort_conditions (list): See :func:`nautypy.certificate`.
+        digest_size (None or int): See :func:`nautypy.certificate`.
+        embedding (str): ``"edges"`` (default), ``"bundled"`` or ``"layered"`` (see :func:`nautypy._embed_multigraph`).
+        engine (str): See :func:`nautypy.certificate`.
+        invariant (None, str or tuple): See :func:`nautypy.certificate`.
+        canonizer (None or nautypy.Canonizer): See :func:`nautypy.certificate`.
+
+    Returns:
+        bytes: the certificate of the host graph of ``mg``, or its digest.
+
+    """
+
+    index = {node:i for i,node in enumerate(mg._node)}
+    nv = len(index)
+    colors = [hmap({'type':'vertex', **attrs}) for attrs in mg._node.values()]
+    ends = []
+    if embedding=="edges":
+        for a,b,attrs in mg.edges(data=True):
+            ends.append((index[a],index[b]))
+            colors.append(hmap({'type':'edge', **attrs}))
+    elif embedding=="bundled":
+        for ab,bundle in _edge_bundles(mg, index).items():
+            ends.append(ab)
+            colors.append(hmap({'type':'edge', 'colors':bundle}))
+    elif embedding=="layered":
+        colors, edges, n_layers = _layered_host(colors, _edge_bundles(mg, index))
+        return _certificate(len(colors), edges, colors,
+                            [('layer',layer) for layer in range(n_layers)]+color_sort_conditions,
+                            digest_size, engine, invariant, canonizer)
+    else:
+        raise ValueError(f"embedding must be 'edges', 'bundled' or 'layered', not {embedding!r}")
+    ends = np.array(ends, dtype=np.intc).reshape(-1,2)
+    #Edge nodes follow the vertices. Self-loops are attached to their vertex once.
+    edge_nodes = np.arange(nv, nv+len(ends), dtype=np.intc)
+    loops = (ends[:,0]==ends[:,1])
+    edges = np.concatenate([np.stack([edge_nodes, ends[:,0]], axis=1),
+                            np.stack([edge_nodes, ends[:,1]], axis=1)[~loops]])
+    return _certificate(nv+len(ends), edges, colors,
+                        [('type','vertex')]+color_sort_conditions, digest_size, engine, invariant, canonizer)
+
+
+def _certificate(n, edges, colors, color_sort_conditions, digest_size, engine="sparse", invariant=None,
+                 canonizer=None):
+    """Canonize a vertex-colored simple graph given as an edge list and serialize the result.
+
+    The certificate is the concatenation of
+
+    1. three little-endian uint32: the number of nodes, of color cells, and of edges,
+    2. the size of each color cell (int32, in cell order),
+    3. the color table: each cell color as a length-prefixed (uint32), UTF-8 encoded ``repr``
+       of its type-tagged key (see :func:`nautypy._color_key`), in cell order,
+    4. the canonically relabeled edges, as lexicographically sorted ``(i,j)``, ``i<j`` pairs of int32.
+
+    Since canonical labels are assigned cell by cell, (2) and (3) determine the color of
+    every canonical node.
+
+    Args:
+        n (int): Number of nodes.
+        edges (numpy.ndarray): An ``(m,2)`` integer array of distinct, loop-free, undirected edges.
+        colors (list): The color (a :class:`hashable_containers.hmap`) of each node.
+        color_sort_conditions (list): See :func:`nautypy._get_color_partition`.
+        digest_size (None or int): See :func:`nautypy.certificate`.
+        engine (str): See :func:`nautypy.certificate`.
+        invariant (None, str or tuple): See :func:`nautypy.certificate`.
+        canonizer (None or nautypy.Canonizer): See :func:`nautypy.certificate`.
+
+    Returns:
+        bytes: the certificate, or its digest.
+
+    """
+
+    timer = _Timer() if _metrics else None
+    lab, ptn, cells = _color_partition(colors, color_sort_conditions=color_sort_conditions)
+    if timer!=None:
+        timer.lap('prepare')
+    if n>0:
+        v, d, e = _edges_to_sparse(n, edges)
+        arrays = canonize_arrays if canonizer==None else canonizer.canonize_arrays
+        lab, autgens, *group = arrays(v, d, e, lab, ptn, group=timer!=None, engine=engine, invariant=invariant)
+    if timer!=None:
+        timer.lap('canonize')
+    #Relabel the edges canonically.
+    inverse = np.empty(n, dtype=np.intc)
+    inverse[lab] = np.arange(n, dtype=np.intc)
+    canonical_edges = np.sort(inverse[edges], axis=1)
+    canonical_edges = canonical_edges[np.lexsort((canonical_edges[:,1], canonical_edges[:,0]))]
+    #Serialize.
+    color_table = [repr(_color_key(color)).encode() for color,size in cells]
+    cert = b''.join([struct.pack('<3I', n, len(cells), len(canonical_edges)),
+                     np.array([size for color,size in cells], dtype='<i4').tobytes()]
+                    +[struct.pack('<I', len(c))+c for c in color_table]
+                    +[canonical_edges.astype('<i4').tobytes()])
+    if digest_size!=None:
+        cert = hashlib.blake2b(cert, digest_size=digest_size).digest()
+    if timer!=None and n>0:
+        timer.lap('finish')
+        _record('certificate', timer.stages, [(n, len(edges))], [group[0]['stats']])
+    return cert
+
+
+class IsomorphismClasses:
+    """Streaming partition of graphs into isomorphism classes.
+
+    Each graph added is keyed by its canonical certificate (see :func:`nautypy.certificate`),
+    so classification costs one canonization and one hash table probe per graph.
+    Memory is bounded by the number of classes: per class, only the certificate,
+    a count and (optionally) the first graph seen and the stream positions of
+    its members are retained.
+
+    Keyword Args:
+        keep (str): What to retain per class. ``'count'`` keeps only counts,
+            ``'representative'`` (default) additionally keeps the first graph of each class,
+            and ``'members'`` additionally keeps the stream positions of all members.
+        color_sort_conditions (list): See :func:`nautypy.certificate`.
+        digest_size (None or int): If not None, key classes by ``digest_size``-byte digests
+            of the certificates (see :func:`nautypy.certificate`) to save memory.
+
+    Iterating over an :class:`nautypy.IsomorphismClasses` object yields one
+    ``(class_id, representative, count, members)`` tuple per class, in order of
+    discovery. ``representative`` and ``members`` are None when not kept.
+
+    """
+
+    def __init__(self, keep='representative', color_sort_conditions=[], digest_size=None):
+        if keep not in ('count','representative','members'):
+            raise ValueError(f"keep must be 'count', 'representative' or 'members', not {keep!r}")
+        self.keep = keep
+        self.color_sort_conditions = color_sort_conditions
+        self.digest_size = digest_size
+        self.class_ids = {}
+        self.counts = []
+        self.representatives = []
+        self.members = []
+        self.n_graphs = 0
+
+    def key(self, g):
+        """The certificate (or digest) keying the class of ``g``."""
+        return certificate(g, color_sort_conditions=self.color_sort_conditions,
+                           digest_size=self.digest_size)
+
+    def add(self, g):
+        """Add the graph ``g`` to its class, creating the class if needed.
+
+        Returns:
+            int: the class id of ``g``.
+
+        """
+
+        key = self.key(g)
+        class_id = self.class_ids.get(key)
+        if class_id==None:
+            class_id = len(self.counts)
+            self.class_ids[key] = class_id
+            self.counts.append(0)
+            self.representatives.append(g if self.keep!='count' else None)
+            self.members.append([] if self.keep=='members' else None)
+        self.counts[class_id] += 1
+        if self.keep=='members':
+            self.members[class_id].append(self.n_graphs)
+        self.n_graphs += 1
+        return class_id
+
+    def update(self, graphs):
+        """Add every graph of the iterable ``graphs``, consuming it lazily.
+
+        Returns:
+            nautypy.IsomorphismClasses: ``self``.
+
+        """
+
+        for g in graphs:
+            self.add(g)
+        return self
+
+    def stream(self, graphs):
+        """Add the graphs of the iterable ``graphs`` one by one, yielding
+        a ``(class_id, is_new)`` tuple for each as it is classified.
+        """
+
+        for g in graphs:
+            n_classes = len(self.counts)
+            class_id = self.add(g)
+            yield class_id, class_id==n_classes
+
+    def save(self, store):
+        """Merge the classes into the persistent :class:`nautypy.CertificateStore` ``store``.
+
+        Returns:
+            list: the class id in ``store`` of each class, indexed by class id in ``self``.
+
+        """
+
+        return store.update(self)
+
+    def class_id(self, g):
+        """The class id of ``g``, or None if no isomorph of ``g`` has been added."""
+        return self.class_ids.get(self.key(g))
+
+    def __contains__(self, g):
+        return self.class_id(g)!=None
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __iter__(self):
+        for class_id in range(len(self.counts)):
+            yield (class_id, self.representatives[class_id],
+                   self.counts[class_id], self.members[class_id])
+
+
+def classify(graphs, keep='representative', color_sort_conditions=[], digest_size=None, store=None):
+    """Partition an iterable of graphs and/or multigraphs into isomorphism classes.
+
+    The iterable is consumed lazily, so generators of graphs are never
+    materialized; see :class:`nautypy.IsomorphismClasses` for the options
+    controlling what is retained per class. Use :meth:`nautypy.IsomorphismClasses.stream`
+    to classify graphs one at a time as they are produced.
+
+    Args:
+        graphs (iterable): graphs derived from ``networkx.Graph`` and/or ``networkx.MultiGraph``.
+
+    Keyword Args:
+        keep (str): ``'count'``, ``'representative'`` or ``'members'`` (see :class:`nautypy.IsomorphismClasses`).
+        color_sort_conditions (list): See :func:`nautypy.certificate`.
+        digest_size (None or int): See :func:`nautypy.certificate`.
+        store (None or nautypy.CertificateStore): if not None, merge the classes into ``store``
+            once the iterable is exhausted (see :meth:`nautypy.IsomorphismClasses.save`).
+            ``color_sort_conditions`` and ``digest_size`` are then taken from the store.
+            The store only persists classes, counts and representatives across runs: it does
+            not save any canonization, since the class of every graph (known or not) is
+            looked up by its certificate.
+
+    Returns:
+        nautypy.IsomorphismClasses: the classes, iterable as ``(class_id, representative, count, members)`` tuples.
+
+    """
+
+    if store!=None:
+        color_sort_conditions = store.color_sort_conditions
+        digest_size = store.digest_size
+    classes = IsomorphismClasses(keep=keep, color_sort_conditions=color_sort_conditions,
+                                 digest_size=digest_size)
+    classes.update(graphs)
+    if store!=None:
+        classes.save(store)
+    return classes
+
+
+def _jsonable(value):
+    """Convert tuples and numpy scalars for ``json.dumps``."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (tuple, list)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {k:_jsonable(v) for k,v in value.items()}
+    return value
+
+
+def _hashable(value):
+    """Convert JSON arrays and objects to tuples and ``hmap``s."""
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return hmap({k:_hashable(v) for k,v in value.items()})
+    return value
+
+
+def _graph_to_json(g):
+    """Encode a graph or multigraph as a JSON object of its graph attributes, nodes and edges.
+
+    Unlike a pickle, the encoding can be decoded (by :func:`nautypy._graph_from_json`)
+    without running code. Node ids and attributes must be JSON-serializable;
+    attribute dict keys must be strings.
+
+    Returns:
+        str: the JSON text.
+
+    """
+
+    if g.is_multigraph():
+        edges = [[a, b, key, attrs] for a,b,key,attrs in g.edges(keys=True, data=True)]
+    else:
+        edges = [[a, b, attrs] for a,b,attrs in g.edges(data=True)]
+    return json.dumps(_jsonable({'multigraph':g.is_multigraph(), 'graph':g.graph,
+                                   'nodes':[[node, attrs] for node,attrs in g.nodes(data=True)],
+                                   'edges':edges}),
+                      separators=(',',':'))
+
+
+def _graph_from_json(text):
+    """Decode the output of :func:`nautypy._graph_to_json`.
+
+    Returns:
+        networkx.Graph or networkx.MultiGraph: the graph.
+
+    """
+
+    obj = json.loads(text)
+    g = nx.MultiGraph() if obj['multigraph'] else nx.Graph()
+    g.graph.update(_hashable(obj['graph']))
+    for node,attrs in obj['nodes']:
+        g.add_node(_hashable(node), **_hashable(attrs))
+    for edge in obj['edges']:
+        a, b, attrs = _hashable(edge[0]), _hashable(edge[1]), _hashable(edge[-1])
+        if obj['multigraph']:
+            g.add_edge(a, b, key=_hashable(edge[2]), **attrs)
+        else:
+            g.add_edge(a, b, **attrs)
+    return g
+
+
+class CertificateStore:
+    """Persistent map from canonical certificates to isomorphism classes, kept in an SQLite file.
+
+    Each class is stored as one row holding its key (the certificate or its
+    digest, see :func:`nautypy.certificate`), a class id, the number of graphs
+    counted so far and, optionally, a representative. Class ids are
+    assigned by SQLite in order of insertion, starting from 1, and never change,
+    so ids from earlier runs stay valid as classes are added.
+
+    Representatives are stored as JSON (see :func:`nautypy._graph_to_json`), never
+    pickled, so opening or merging a store from an untrusted source cannot run
+    code. Their node ids and attributes must therefore be JSON-serializable:
+    they are read back as a ``networkx.Graph`` or ``networkx.MultiGraph``, with
+    tuples and lists as tuples, and dicts as ``hmap``.
+
+    All writes go through bulk statements (``executemany``, ``INSERT ... SELECT``)
+    committed once per call, and lookups query keys in chunks, so the cost per
+    graph is that of a B-tree probe rather than of a transaction.
+
+    The store records ``color_sort_conditions`` and ``digest_size``, since
+    keys computed with different values are not comparable. Opening an existing
+    store with different values raises ``ValueError``.
+
+    Args:
+        path (str): The database file, created if needed. ``":memory:"`` gives a temporary store.
+
+    Keyword Args:
+        color_sort_conditions (list): See :func:`nautypy.certificate`.
+        digest_size (None or int): See :func:`nautypy.certificate`.
+
+    Example:
+        Classes accumulate across runs::
+
+            with nautypy.CertificateStore('classes.db', digest_size=16) as store:
+                classes = nautypy.classify(graphs, store=store)
+                for class_id, representative, count in store:
+                    ...
+
+    """
+
+    #Number of keys per lookup query (SQLite limits the number of bound parameters).
+    lookup_chunksize = 500
+
+    def __init__(self, path, color_sort_conditions=[], digest_size=None):
+        self.path = path
+        self.color_sort_conditions = color_sort_conditions
+        self.digest_size = digest_size
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS classes (
+                                     class_id INTEGER PRIMARY KEY,
+                                     key BLOB UNIQUE NOT NULL,
+                                     count INTEGER NOT NULL,
+                                     representative BLOB)""")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            self.conn.executemany("INSERT OR IGNORE INTO meta VALUES (?,?)", self._meta().items())
+        try:
+            self._check_meta("main")
+        except ValueError:
+            self.conn.close()
+            raise
+
+    def _meta(self):
+        return {'color_sort_conditions':repr([tuple(c) for c in self.color_sort_conditions]),
+                'digest_size':repr(self.digest_size)}
+
+    def _check_meta(self, schema):
+        stored = dict(self.conn.execute(f"SELECT name, value FROM {schema}.meta"))
+        if stored!=self._meta():
+            raise ValueError(f"store was created with {stored}, not {self._meta()}")
+
+    def key(self, g):
+        """The key of the class of ``g`` in this store."""
+        return certificate(g, color_sort_conditions=self.color_sort_conditions,
+                           digest_size=self.digest_size)
+
+    def lookup(self, keys):
+        """Look up the class ids of a sequence of keys.
+
+        Returns:
+            list: the class id of each key, or None for unknown keys.
+
+        """
+
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), self.lookup_chunksize):
+            chunk = keys[start:start+self.lookup_chunksize]
+            found.update(self.conn.execute(
+                "SELECT key, class_id FROM classes WHERE key IN (%s)" % ",".join("?"*len(chunk)),
+                chunk))
+        return [found.get(key) for key in keys]
+
+    def class_ids(self, graphs):
+        """The class id of each graph of the iterable ``graphs``, or None for graphs of unknown classes."""
+        return self.lookup(self.key(g) for g in graphs)
+
+    def add(self, keys, counts=None, representatives=None):
+        """Insert or update classes in bulk, in a single transaction.
+
+        Known classes have their counts incremented and keep their stored
+        representative. New classes are assigned ids in the order given.
+
+        Args:
+            keys (list): The class keys.
+
+        Keyword Args:
+            counts (None or list): Number of graphs to count per class (default: 1 each).
+            representatives (None or list): A graph (or None) per class, stored only for new classes.
+
+        Returns:
+            list: the class id of each key.
+
+        """
+
+        keys = list(keys)
+        if counts==None:
+            counts = [1]*len(keys)
+        if representatives==None:
+            representatives = [None]*len(keys)
+        rows = [(key, count, None if rep is None else _graph_to_json(rep))
+                for key,count,rep in zip(keys, counts, representatives)]
+        with self.conn:
+            self.conn.executemany("""INSERT INTO classes (key, count, representative) VALUES (?,?,?)
+                                     ON CONFLICT(key) DO UPDATE SET count=count+excluded.count,
+                                     representative=coalesce(representative, excluded.representative)""",
+                                  rows)
+        return self.lookup(keys)
+
+    def update(self, classes):
+        """Merge a :class:`nautypy.IsomorphismClasses` partition into the store.
+
+        Returns:
+            list: the class id in the store of each class, indexed by class id in ``classes``.
+
+        """
+
+        if (classes.digest_size!=self.digest_size
+                or [tuple(c) for c in classes.color_sort_conditions]!=[tuple(c) for c in self.color_sort_conditions]):
+            raise ValueError("classes were keyed with different digest_size or color_sort_conditions")
+        return self.add(list(classes.class_ids), classes.counts, classes.representatives)
+
+    def merge(self, path):
+        """Merge the store in the file ``path`` (e.g. from a separate run) into this one.
+
+        Counts are added, and classes new to this store are assigned ids in
+        their order in the other store.
+        """
+
+        self.conn.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            self._check_meta("other")
+            with self.conn:
+                self.conn.execute("""INSERT INTO classes (key, count, representative)
+                                     SELECT key, count, representative FROM other.classes
+                                     WHERE true ORDER BY class_id
+                                     ON CONFLICT(key) DO UPDATE SET count=count+excluded.count,
+                                     representative=coalesce(representative, excluded.representative)""")
+        finally:
+            self.conn.execute("DETACH DATABASE other")
+
+    def representative(self, class_id):
+        """The stored representative of class ``class_id``, or None."""
+        row = self.conn.execute("SELECT representative FROM classes WHERE class_id=?",
+                                (class_id,)).fetchone()
+        if row==None or row[0]==None:
+            return None
+        return _graph_from_json(row[0])
+
+    def count(self, class_id):
+        """The number of graphs counted in class ``class_id``."""
+        row = self.conn.execute("SELECT count FROM classes WHERE class_id=?", (class_id,)).fetchone()
+        return 0 if row==None else row[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT count(*) FROM classes").fetchone()[0]
+
+    def __contains__(self, g):
+        return self.lookup([self.key(g)])[0]!=None
+
+    def __iter__(self):
+        """Yield one ``(class_id, representative, count)`` tuple per class, in id order."""
+        for class_id, count, rep in self.conn.execute(
+                "SELECT class_id, count, representative FROM classes ORDER BY class_id"):
+            yield class_id, (None if rep==None else _graph_from_json(rep)), count
+
+
+class CanonCache:
+    """Memoizing cache for :func:`nautypy.canonize_simple_graph` and :func:`nautypy.canonize_multigraph`.
+
+    Results are keyed by the labeled input graph itself, not by its isomorphism
+    class: a hit requires the same graph class, node labels, node and edge colors,
+    graph attributes and ``color_sort_conditions`` (see :func:`nautypy.CanonCache.key`).
+    The key is a tuple built in one pass over the graph, so a hit costs one
+    traversal and one hash table probe instead of a canonization.
+
+    The least recently used entries are evicted once the cache holds more than
+    ``maxsize`` entries or more than ``max_bytes`` (approximate) bytes. Access is
+    serialized by a lock, so one cache may be shared by several threads, e.g. by
+    passing it as the ``cache`` argument of every canonization call in a pipeline.
+
+    Keyword Args:
+        maxsize (None or int): Maximum number of entries. Unbounded if None.
+        max_bytes (None or int): Maximum approximate size of the stored entries, in bytes
+            (see :func:`nautypy._cache_nbytes`). Unbounded if None.
+
+    Warning:
+        Hits return the stored ``(canonical, autgens, canonical_map)`` objects
+        themselves, not copies. They must not be modified.
+
+    """
+
+    def __init__(self, maxsize=1024, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(g, color_sort_conditions=[], embedding="edges", engine="sparse", invariant=None):
+        """The structural key of the labeled graph ``g``.
+
+        Nodes and edges are sorted, so the key does not depend on insertion
+        order. Edge keys of multigraphs are ignored, since canonization re-keys
+        parallel edges by color.
+        """
+
+        nodes = tuple(sorted((node, hmap(attrs)) for node,attrs in g._node.items()))
+        edges = tuple(sorted((*sorted((a,b)), hmap(attrs)) for a,b,attrs in g.edges(data=True)))
+        return (g.__class__, hmap(g.graph), nodes, edges,
+                tuple(tuple(c) for c in color_sort_conditions),
+                embedding if g.is_multigraph() else None, engine,
+                tuple(_invariant_options(invariant).tolist()))
+
+    def get(self, key):
+        """The stored result for ``key``, or None. Counts a hit or a miss."""
+        with self._lock:
+            result = self.entries.get(key)
+            if result==None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result[0]
+
+    def put(self, key, result):
+        """Store ``result`` under ``key``, evicting least recently used entries as needed."""
+        nbytes = _cache_nbytes(key, result)
+        with self._lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (result, nbytes)
+            self.nbytes += nbytes
+            while self.entries and ((self.maxsize!=None and len(self.entries)>self.maxsize)
+                                    or (self.max_bytes!=None and self.nbytes>self.max_bytes)):
+                self.nbytes -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def canonize(self, g, color_sort_conditions=[], embedding="edges", engine="sparse", invariant=None,
+                 canonizer=None):
+        """Canonize the graph or multigraph ``g`` through the cache.
+
+        ``embedding`` is passed on to :func:`nautypy.canonize_multigraph`, and ``engine``
+        ``invariant`` and ``canonizer`` to :func:`nautypy.canonize_simple_graph` or :func:`nautypy.canonize_multigraph`.
+
+        Returns:
+            3-element tuple ``(g_canonical, g_autgens, g_canonical_map)``, as returned by
+            :func:`nautypy.canonize_simple_graph` or :func:`nautypy.canonize_multigraph`.
+
+        """
+
+        key = self.key(g, color_sort_conditions, embedding, engine, invariant)
+        result = self.get(key)
+        if result==None:
+            if g.is_multigraph():
+                result = canonize_multigraph(g, color_sort_conditions=color_sort_conditions,
+                                             embedding=embedding, engine=engine, invariant=invariant,
+                                             canonizer=canonizer)
+            else:
+                result = canonize_simple_graph(g, color_sort_conditions=color_sort_conditions, engine=engine,
+                                               invariant=invariant, canonizer=canonizer)
+            self.put(key, result)
+        return result
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __repr__(self):
+        return (f"CanonCache(entries={len(self.entries)}, nbytes={self.nbytes}, "
+                f"hits={self.hits}, misses={self.misses}, evictions={self.evictions})")
+
+
+def _cache_nbytes(key, result):
+    """Approximate memory footprint of a :class:`nautypy.CanonCache` entry.
+
+    Sums ``sys.getsizeof`` over the containers of the key and of the result,
+    one level deep, ignoring the objects they share (node labels, colors).
+    """
+
+    g_canonical, g_autgens, g_canonical_map = result
+    nbytes = sys.getsizeof(key) + sum(map(sys.getsizeof, key[2])) + sum(map(sys.getsizeof, key[3]))
+    nbytes += sum(map(sys.getsizeof, g_canonical._node.values()))
+    nbytes += sum(map(sys.getsizeof, g_canonical._adj.values()))
+    nbytes += sys.getsizeof(g_canonical_map) + sum(map(sys.getsizeof, g_autgens))
+    return nbytes
+
+
+#Active instrumentation collectors (see Metrics). Replaced, never mutated, so
+#that canonizing threads can iterate over it without a lock.
+_metrics = ()
+_metrics_lock = threading.Lock()
+#The NAUTY wall times (in ns) of the graphs of the last libnautypy call of each
+#thread, kept while a collector is active. They are left out of the search
+#statistics, which stay deterministic.
+_nauty_ns = threading.local()
+
+
+class Metrics:
+    """Collects per-graph instrumentation records of canonizations, with aggregate histograms.
+
+    While a collector is active (between :meth:`start` and :meth:`stop`, or inside
+    a ``with`` block), every graph canonized by :func:`nautypy.canonize_simple_graph`,
+    :func:`nautypy.canonize_multigraph`, :func:`nautypy.canonize_many`,
+    :func:`nautypy.certificate`, :func:`nautypy.certificate_multigraph` or
+    :func:`nautypy.canonize_compact` produces one record, a dict with
+
+    - ``'function'``: the name of the instrumented function,
+    - ``'host_nodes'`` and ``'host_edges'``: the size of the simple graph handed to NAUTY,
+    - ``'stages'``: the seconds spent in ``'prepare'`` (relabeling, embedding and color partition),
+      ``'marshal'`` (conversion to and from NAUTY sparse format), ``'nauty'`` (the NAUTY call itself,
+      timed by libnautypy) and ``'finish'`` (reconstruction of the canonical isomorph, map and
+      generators, or serialization of a certificate). For a batch, the prepare, marshal and finish
+      times of the whole batch are apportioned to its graphs by host size; NAUTY times are always exact,
+    - the NAUTY search statistics (see :func:`nautypy._search_stats`).
+
+    Each record is passed to ``callback``, kept in :attr:`records` if ``keep_records``,
+    and aggregated into :attr:`histograms`, which have fixed buckets, so that
+    a collector can stay active indefinitely in constant memory. Cache hits of
+    :class:`nautypy.CanonCache` are not canonized and produce no records. When no
+    collector is active, instrumentation costs one test per call.
+
+    Keyword Args:
+        callback (None or callable): Called with each record, from the canonizing thread.
+        keep_records (bool): If True, keep every record in :attr:`records`. Default False.
+
+    Example:
+        Export the histograms of a batch to a Prometheus textfile collector::
+
+            with nautypy.Metrics() as metrics:
+                nautypy.canonize_many(graphs)
+            metrics.to_prometheus("/var/lib/node_exporter/nautypy.prom")
+
+    """
+
+    #Histogram buckets (upper bounds): 1-2.5-5 steps from 1us to 10s, and powers of two.
+    time_buckets = [float(f"{m}e{k}") for k in range(-6,1) for m in (1,2.5,5)]+[10.0]
+    count_buckets = [2**k for k in range(21)]
+    #Record fields aggregated into count histograms.
+    count_fields = ['host_nodes','host_edges','numnodes','numbadleaves','maxlevel','numgenerators',
+                    'tctotal','canupdates']
+
+    def __init__(self, callback=None, keep_records=False):
+        self.callback = callback
+        self.keep_records = keep_records
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop all records and empty the histograms."""
+        with self._lock:
+            self.records = []
+            self.calls = {}
+            #Per-bucket (not cumulative) counts, with a last +Inf bucket, sums and counts.
+            self.histograms = {}
+            for stage in ['prepare','marshal','nauty','finish']:
+                self.histograms[('stage_seconds',stage)] = self._histogram(self.time_buckets)
+            for field in self.count_fields:
+                self.histograms[(field,None)] = self._histogram(self.count_buckets)
+
+    @staticmethod
+    def _histogram(buckets):
+        return {'buckets':buckets, 'counts':[0]*(len(buckets)+1), 'sum':0, 'count':0}
+
+    @staticmethod
+    def _observe(histogram, value):
+        histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def add(self, record):
+        """Aggregate one record (see :class:`nautypy.Metrics`)."""
+        with self._lock:
+            self.calls[record['function']] = self.calls.get(record['function'], 0)+1
+            for stage,seconds in record['stages'].items():
+                self._observe(self.histograms[('stage_seconds',stage)], seconds)
+            for field in self.count_fields:
+                self._observe(self.histograms[(field,None)], record[field])
+            if self.keep_records:
+                self.records.append(record)
+        if self.callback!=None:
+            self.callback(record)
+
+    def start(self):
+        """Activate the collector."""
+        global _metrics
+        with _metrics_lock:
+            if self not in _metrics:
+                _metrics = _metrics+(self,)
+        return self
+
+    def stop(self):
+        """Deactivate the collector."""
+        global _metrics
+        with _metrics_lock:
+            _metrics = tuple(metrics for metrics in _metrics if metrics is not self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def to_dict(self):
+        """The call counts and histograms (with cumulative bucket counts), and the records if kept."""
+        with self._lock:
+            histograms = {}
+            for (name,label),histogram in self.histograms.items():
+                cumulative = np.cumsum(histogram['counts']).tolist()
+                histograms[name if label==None else f"{name}/{label}"] = {
+                    'buckets':[[le,count] for le,count in zip(histogram['buckets']+["+Inf"], cumulative)],
+                    'sum':histogram['sum'],
+                    'count':histogram['count']}
+            result = {'calls':dict(self.calls), 'histograms':histograms}
+            if self.keep_records:
+                result['records'] = list(self.records)
+            return result
+
+    def to_json(self, path=None):
+        """Export :meth:`to_dict` as JSON, to the file ``path`` if given.
+
+        Returns:
+            str: the JSON text.
+
+        """
+
+        text = json.dumps(self.to_dict())
+        if path!=None:
+            _write_atomic(path, text)
+        return text
+
+    def to_prometheus(self, path=None, prefix="nautypy"):
+        """Export the call counts and histograms in the Prometheus text exposition format.
+
+        The file ``path``, if given, is replaced atomically, as the textfile collector of
+        the Prometheus node exporter requires.
+
+        Keyword Args:
+            path (None or str): The file to write.
+            prefix (str): The prefix of the metric names.
+
+        Returns:
+            str: the exposition text.
+
+        """
+
+        data = self.to_dict()
+        lines = [f"# HELP {prefix}_canonizations_total Graphs canonized, by function.",
+                 f"# TYPE {prefix}_canonizations_total counter"]
+        lines += [f'{prefix}_canonizations_total{{function="{function}"}} {count}'
+                  for function,count in sorted(data['calls'].items())]
+        names = {}
+        for key,histogram in data['histograms'].items():
+            name, _, label = key.partition('/')
+            names.setdefault(name, []).append((label, histogram))
+        for name,histograms in names.items():
+            metric = f"{prefix}_{name}"
+            lines += [f"# HELP {metric} Per-graph {name.replace('_',' ')} of canonizations.",
+                      f"# TYPE {metric} histogram"]
+            for label,histogram in histograms:
+                labels = f'stage="{label}",' if label else ''
+                lines += [f'{metric}_bucket{{{labels}le="{le}"}} {count}' for le,count in histogram['buckets']]
+                labels = f'{{stage="{label}"}}' if label else ''
+                lines += [f"{metric}_sum{labels} {histogram['sum']}",
+                          f"{metric}_count{labels} {histogram['count']}"]
+        text = "\n".join(lines)+"\n"
+        if path!=None:
+            _write_atomic(path, text)
+        return text
+
+    def __repr__(self):
+        return f"Metrics(calls={self.calls})"
+
+
+def _write_atomic(path, text):
+    """Replace the file ``path`` by ``text`` in one step."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class _Timer:
+    """Stopwatch of the stages of one instrumented call (see :class:`nautypy.Metrics`)."""
+
+    __slots__ = ('stages', 'last')
+
+    def __init__(self):
+        self.stages = {}
+        self.last = perf_counter()
+
+    def lap(self, stage):
+        """Charge the time since the previous lap to ``stage``."""
+        now = perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0)+now-self.last
+        self.last = now
+
+
+def _record(function, stages, hosts, stats, nauty_ns=None):
+    """Hand the records of a batch of canonizations to the active collectors (see :class:`nautypy.Metrics`).
+
+    Args:
+        function (str): The name of the instrumented function.
+        stages (dict): The stage times of the whole batch, in seconds: ``'prepare'``, ``'finish'``, and either
+            ``'marshal'`` or ``'canonize'`` (marshalling and NAUTY calls, from which the NAUTY times are subtracted).
+        hosts (list): The ``(nodes, edges)`` of the host graph of each graph.
+        stats (list): The search statistics of each graph (see :func:`nautypy._search_stats`).
+
+    Keyword Args:
+        nauty_ns (None or list): The NAUTY wall time of each graph, in nanoseconds.
+            If None, those of the last libnautypy call of the calling thread.
+
+    """
+
+    if nauty_ns==None:
+        nauty_ns = getattr(_nauty_ns, 'last', None)
+    if nauty_ns==None or len(nauty_ns)!=len(stats):
+        #The collector was started during the call.
+        nauty_ns = [0]*len(stats)
+    nauty = [ns*1e-9 for ns in nauty_ns]
+    stages = dict(stages)
+    if 'canonize' in stages:
+        stages['marshal'] = max(stages.pop('canonize')-sum(nauty), 0.0)
+    sizes = [nodes+edges for nodes,edges in hosts]
+    total = sum(sizes)
+    for (nodes,edges),size,seconds,s in zip(hosts, sizes, nauty, stats):
+        share = size/total if total>0 else 1/len(hosts)
+        record = {'function':function, 'host_nodes':nodes, 'host_edges':edges,
+                  'stages':{**{stage:share*t for stage,t in stages.items()}, 'nauty':seconds}}
+        record.update(s)
+        for metrics in _metrics:
+            metrics.add(record)
+
+
+def _record_prepared(function, stages, prepared, canonized, nauty_ns=None):
+    """:func:`nautypy._record` for a batch of graphs tagged by :func:`nautypy._prepare`, given their
+    ``(canonical_map, autgens, group)`` tuples (see :func:`nautypy._canonize_batch`)."""
+    _record(function, stages, [(p[2].number_of_nodes(), p[2].number_of_edges()) for p in prepared],
+            [c[2]['stats'] for c in canonized], nauty_ns)
+
+
+class CompactMultiGraph:
+    """Immutable, array-backed vertex- and edge-colored multigraph.
+
+    The vertices are ``0,...,nv-1``. The edges are stored as an ``(m,2)`` array of
+    ends, the colors as arrays of ids interned by :func:`nautypy.intern_color`.
+    Each edge is stored with its smaller end first, and the edges are sorted by
+    ends and color, so equal labeled multigraphs have equal arrays. The hash is
+    computed once, from the array bytes, and cached.
+
+    Compact multigraphs are canonized by :func:`nautypy.canonize_compact` without
+    constructing any networkx object, and their canonical forms can be used
+    directly as hash table keys for isomorphism classes. Graph attributes and
+    edge keys are not represented. They pickle by color rather than by id, so
+    they can be sent to other processes.
+
+    Args:
+        nv (int): Number of vertices.
+        edges (array-like): The ``(m,2)`` ends of the edges.
+        vertex_colors (array-like): The color id of each vertex.
+        edge_colors (array-like): The color id of each edge.
+
+    """
+
+    __slots__ = ('nv', 'edges', 'vertex_colors', 'edge_colors', '_hash')
+
+    def __init__(self, nv, edges, vertex_colors, edge_colors):
+        edges = np.sort(np.asarray(edges, dtype=np.intc).reshape(-1,2), axis=1)
+        edge_colors = np.asarray(edge_colors, dtype=np.intc)
+        order = np.lexsort((edge_colors, edges[:,1], edges[:,0]))
+        self.nv = int(nv)
+        self.edges = edges[order]
+        self.edge_colors = edge_colors[order]
+        self.vertex_colors = np.array(vertex_colors, dtype=np.intc)
+        for array in (self.edges, self.edge_colors, self.vertex_colors):
+            array.flags.writeable = False
+        self._hash = None
+
+    @classmethod
+    def from_networkx(cls, mg):
+        """Convert a networkx multigraph (or graph), numbering its nodes in sorted order.
+
+        Returns:
+            2-element tuple containing
+
+            - **cmg** (*nautypy.CompactMultiGraph*): the compact multigraph.
+            - **nodes** (*list*): the node of ``mg`` numbered ``i``, at position ``i``.
+
+        """
+
+        nodes = sorted(mg._node)
+        index = {node:i for i,node in enumerate(nodes)}
+        vertex_colors = [intern_color(mg._node[node]) for node in nodes]
+        edges = []
+        edge_colors = []
+        for a,b,attrs in mg.edges(data=True):
+            edges.append((index[a],index[b]))
+            edge_colors.append(intern_color(attrs))
+        return cls(len(nodes), edges, vertex_colors, edge_colors), nodes
+
+    def to_networkx(self, nodes=None, create_using=HMultiGraph):
+        """Convert to a networkx multigraph.
+
+        Keyword Args:
+            nodes (None or list): The node label of each vertex (default: ``0,...,nv-1``).
+            create_using (type): The multigraph class to construct.
+
+        """
+
+        if nodes==None:
+            nodes = range(self.nv)
+        mg = create_using()
+        for node,color_id in zip(nodes, self.vertex_colors.tolist()):
+            mg.add_node(node, **_palette[color_id])
+        for (a,b),color_id in zip(self.edges.tolist(), self.edge_colors.tolist()):
+            mg.add_edge(nodes[a], nodes[b], **_palette[color_id])
+        return mg
+
+    def is_multigraph(self):
+        return True
+
+    def number_of_nodes(self):
+        return self.nv
+
+    def number_of_edges(self):
+        return len(self.edges)
+
+    @property
+    def nbytes(self):
+        """Size of the arrays, in bytes."""
+        return self.edges.nbytes+self.edge_colors.nbytes+self.vertex_colors.nbytes
+
+    def __hash__(self):
+        if self._hash==None:
+            self._hash = hash((self.nv, self.vertex_colors.tobytes(),
+                               self.edges.tobytes(), self.edge_colors.tobytes()))
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactMultiGraph):
+            return NotImplemented
+        return (self.nv==other.nv and hash(self)==hash(other)
+                and np.array_equal(self.vertex_colors, other.vertex_colors)
+                and np.array_equal(self.edges, other.edges)
+                and np.array_equal(self.edge_colors, other.edge_colors))
+
+    def __reduce__(self):
+        used = np.unique(np.concatenate([self.vertex_colors, self.edge_colors]))
+        return (_compact_from_colors,
+                (self.nv, self.edges, np.searchsorted(used, self.vertex_colors),
+                 np.searchsorted(used, self.edge_colors), [_palette[c] for c in used.tolist()]))
+
+    def __repr__(self):
+        return f"CompactMultiGraph(nv={self.nv}, ne={len(self.edges)})"
+
+
+def _compact_from_colors(nv, edges, vertex_colors, edge_colors, colors):
+    """Unpickle a :class:`nautypy.CompactMultiGraph`, interning its colors in this process."""
+    ids = np.array([intern_color(color) for color in colors], dtype=np.intc)
+    return CompactMultiGraph(nv, edges, ids[vertex_colors], ids[edge_colors])
+
+
+def canonize_compact(cmg, color_sort_conditions=[], engine="sparse", invariant=None, canonizer=None):
+    """Canonize a :class:`nautypy.CompactMultiGraph`.
+
+    The multigraph is embedded as in :func:`nautypy.certificate_multigraph` (one
+    host node per edge), but the host graph and its color partition are built
+    with numpy from the edge and color id arrays: the color cells are ranked by
+    ranking the distinct colors only, as in :func:`nautypy._color_partition`.
+    No networkx object is constructed.
+
+    Args:
+        cmg (nautypy.CompactMultiGraph): The multigraph to canonize.
+
+    Keyword Args:
+        color_sort_conditions (list): See :func:`nautypy.canonize_multigraph`.
+        engine (str): See :func:`nautypy.canonize_multigraph`.
+        invariant (None, str or tuple): See :func:`nautypy.canonize_multigraph`.
+        canonizer (None or nautypy.Canonizer): See :func:`nautypy.canonize_multigraph`.
+
+    Returns:
+        3-element tuple containing
+
+        - **cmg_canonical** (*nautypy.CompactMultiGraph*): the canonical isomorph of ``cmg``.
+        - **cmg_autgens** (*numpy.ndarray*): an ``(n_auts, nv)`` array of automorphism generators of ``cmg``, in one-line notation. Generators acting trivially on the vertices are omitted.
+        - **cmg_canonical_map** (*numpy.ndarray*): the canonical map, in one-line notation: vertex ``i`` of ``cmg_canonical`` is vertex ``cmg_canonical_map[i]`` of ``cmg``.
+
+    """
+
+    timer = _Timer() if _metrics else None
+    nv = cmg.nv
+    ne = len(cmg.edges)
+    #Rank the distinct host node colors, tagged with their type.
+    vertex_ids = np.unique(cmg.vertex_colors)
+    edge_ids = np.unique(cmg.edge_colors)
+    rank = _rank_colors([{'type':'vertex', **_palette[c]} for c in vertex_ids.tolist()]
+                        +[{'type':'edge', **_palette[c]} for c in edge_ids.tolist()],
+                        [('type','vertex')]+color_sort_conditions)[0]
+    host_rank = np.concatenate([rank[np.searchsorted(vertex_ids, cmg.vertex_colors)],
+                                rank[len(vertex_ids)+np.searchsorted(edge_ids, cmg.edge_colors)]])
+    #Color partition.
+    lab = np.argsort(host_rank, kind='stable').astype(np.intc)
+    cell = host_rank[lab]
+    ptn = np.append(cell[1:]==cell[:-1], False).astype(np.intc)
+    #Host graph: edge nodes follow the vertices. Self-loops are attached to their vertex once.
+    ends = cmg.edges
+    edge_nodes = np.arange(nv, nv+ne, dtype=np.intc)
+    loops = (ends[:,0]==ends[:,1])
+    host_edges = np.concatenate([np.stack([edge_nodes, ends[:,0]], axis=1),
+                                 np.stack([edge_nodes, ends[:,1]], axis=1)[~loops]])
+    if timer!=None:
+        timer.lap('prepare')
+    if nv+ne>0:
+        v, d, e = _edges_to_sparse(nv+ne, host_edges)
+        arrays = canonize_arrays if canonizer==None else canonizer.canonize_arrays
+        lab, autgens, *group = arrays(v, d, e, lab, ptn, group=timer!=None, engine=engine, invariant=invariant)
+        if timer!=None:
+            timer.lap('canonize')
+    else:
+        autgens = np.zeros((0,0), dtype=np.intc)
+    #The vertices come first in the canonical labeling.
+    canonical_map = lab[:nv]
+    autgens = autgens[:,:nv]
+    autgens = autgens[(autgens!=np.arange(nv)).any(axis=1)]
+    inverse = np.empty(nv, dtype=np.intc)
+    inverse[canonical_map] = np.arange(nv, dtype=np.intc)
+    cmg_canonical = CompactMultiGraph(nv, inverse[ends], cmg.vertex_colors[canonical_map], cmg.edge_colors)
+    if timer!=None and nv+ne>0:
+        timer.lap('finish')
+        _record('canonize_compact', timer.stages, [(nv+ne, len(host_edges))], [group[0]['stats']])
+    return cmg_canonical, autgens, canonical_map
+
+
+def generate_multigraphs(vertex_colors, valences, edge_colors, loops=None, self_loops=True, compact=False):
+    """Generate one multigraph per isomorphism class, with prescribed vertex colors, valences and edge colors.
+
+    Multigraphs are built one edge at a time by McKay's canonical construction
+    path (B. D. McKay, "Isomorph-free exhaustive generation", J. Algorithms 26 (1998) 306-324),
+    so no two isomorphic multigraphs are ever emitted and no deduplication is needed:
+
+    1. A partial multigraph ``P`` is only extended by one candidate edge per orbit
+       of ``Aut(P)`` on the candidate edges (vertex pair and color), computed from
+       the automorphism generators returned by :func:`nautypy.canonize_compact`.
+    2. An extension ``C=P+e`` is only accepted if ``e`` lies in the ``Aut(C)``-orbit
+       of the last edge of the canonical isomorph of ``C``, so that every
+       isomorphism class has a unique parent class.
+
+    A candidate edge ``(a,b)`` needs a free valence at both ends (two at ``a``
+    for a self-loop ``a==b``, which counts twice towards the valence of ``a``).
+    The valence of each vertex is part of its color during generation, so
+    vertices of equal color but different valence are never exchanged.
+    Canonization goes through :class:`nautypy.CompactMultiGraph`, without networkx.
+
+    Args:
+        vertex_colors (list): The color (attribute dict) of each vertex ``0,...,nv-1``.
+        valences (list): The valence (degree) of each vertex.
+        edge_colors (list): The allowed edge colors (attribute dicts).
+
+    Keyword Args:
+        loops (None or int): If not None, only generate connected multigraphs with ``loops``
+            independent cycles. Since the valences fix the number of edges ``ne``, a connected
+            multigraph has ``ne-nv+1`` loops, and ``loops`` must equal that number.
+        self_loops (bool): Whether to allow self-loops (default True).
+        compact (bool): If True, yield :class:`nautypy.CompactMultiGraph` objects instead of
+            :class:`hashable_containers.HMultiGraph` objects.
+
+    Yields:
+        One multigraph per isomorphism class, on the vertices ``0,...,nv-1``.
+
+    Example:
+        The two-loop vacuum diagrams of a scalar cubic theory::
+
+            for mg in nautypy.generate_multigraphs([{}]*2, [3]*2, [{}], loops=2):
+                ...
+
+    """
+
+    nv = len(vertex_colors)
+    if len(valences)!=nv:
+        raise ValueError("vertex_colors and valences must have the same length")
+    valences = np.array(valences, dtype=np.intc)
+    if valences.sum()%2:
+        raise ValueError("the valences must sum to an even number")
+    ne = int(valences.sum())//2
+    if loops!=None and loops!=ne-nv+1:
+        raise ValueError(f"connected multigraphs with these valences have {ne-nv+1} loops, not {loops}")
+    vertex_ids = np.array([intern_color(color) for color in vertex_colors], dtype=np.intc)
+    tagged_ids = np.array([intern_color({'color':hmap(color), 'valence':valence})
+                           for color,valence in zip(vertex_colors, valences.tolist())], dtype=np.intc)
+    edge_ids = sorted({intern_color(color) for color in edge_colors})
+
+    def canonize(edges, colors):
+        return canonize_compact(CompactMultiGraph(nv, edges, tagged_ids, colors))
+
+    root = ([], [], canonize([], [])[1])
+    stack = [root]
+    while stack:
+        edges, colors, autgens = stack.pop()
+        if len(edges)==ne:
+            if loops==None or _is_connected(nv, edges):
+                if compact:
+                    yield CompactMultiGraph(nv, edges, vertex_ids, colors)
+                else:
+                    yield CompactMultiGraph(nv, edges, vertex_ids, colors).to_networkx()
+            continue
+        free = valences-np.bincount(np.array(edges, dtype=np.intp).reshape(-1), minlength=nv)
+        candidates = [(a,b,c) for a in range(nv) if free[a]>0
+                      for b in range(a, nv) if (free[b]>0 if b>a else self_loops and free[a]>1)
+                      for c in edge_ids]
+        children = []
+        for a,b,c in _edge_orbit_representatives(candidates, autgens):
+            child_edges = edges+[(a,b)]
+            child_colors = colors+[c]
+            canonical, child_autgens, canonical_map = canonize(child_edges, child_colors)
+            #The last edge of the canonical isomorph, in the labels of the child.
+            ca, cb = canonical_map[canonical.edges[-1]].tolist()
+            last = (min(ca,cb), max(ca,cb), int(canonical.edge_colors[-1]))
+            if last in _edge_orbit((a,b,c), child_autgens):
+                children.append((child_edges, child_colors, child_autgens))
+        stack += children[::-1]
+
+
+def _edge_orbit_representatives(edges, autgens):
+    """One representative of each orbit of a permutation group on a set of colored edges.
+
+    Args:
+        edges (list): ``(a,b,color)`` tuples with ``a<=b``, closed under the group.
+        autgens (numpy.ndarray): Generators of the group acting on the vertices, in one-line notation.
+
+    Returns:
+        list: the first edge of each orbit, in the order of ``edges``.
+
+    """
+
+    index = {edge:i for i,edge in enumerate(edges)}
+    parent = list(range(len(edges)))
+    def find(i):
+        while parent[i]!=i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for gen in autgens.tolist():
+        for i,(a,b,c) in enumerate(edges):
+            root, image_root = find(i), find(index[(min(gen[a],gen[b]), max(gen[a],gen[b]), c)])
+            if root!=image_root:
+                parent[max(root, image_root)] = min(root, image_root)
+    return [edge for i,edge in enumerate(edges) if find(i)==i]
+
+
+def _edge_orbit(edge, autgens):
+    """The orbit of a colored edge ``(a,b,color)``, ``a<=b``, under the group generated by ``autgens``."""
+    orbit = {edge}
+    frontier = [edge]
+    gens = autgens.tolist()
+    while frontier:
+        a,b,c = frontier.pop()
+        for gen in gens:
+            image = (min(gen[a],gen[b]), max(gen[a],gen[b]), c)
+            if image not in orbit:
+                orbit.add(image)
+                frontier.append(image)
+    return orbit
+
+
+def _is_connected(nv, edges):
+    """Whether the multigraph on vertices ``0,...,nv-1`` with the given edges is connected."""
+    parent = list(range(nv))
+    def find(v):
+        while parent[v]!=v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+    for a,b in edges:
+        parent[find(a)] = find(b)
+    return len({find(v) for v in range(nv)})<=1
 
 
 def _standardize_graph_encoding(g):
@@ -338,7 +2846,7 @@ def _standardize_graph_encoding(g):
         g (networkx.Graph-like or networkx.MultiGraph-like): Any graph or multigraph derived from networkx type.
 
     Returns:
-        g_standard (networkx.Graph-like or networkx.MultiGraph-like): A copy of ``g`` with all dictionaries in key-sorted order.
+        g_standard (networkx.Graph-like or networkx.MultiGraph-like): A copy of ``g`` with all dictionaries in key-sorted order. Frozen graphs (e.g. :class:`hashable_containers.FrozenHGraph`) are copied to their mutable class.
 
     Note:
         This operation is *not* related to isomorphism, and does not 
@@ -357,7 +2865,8 @@ def _standardize_graph_encoding(g):
 
     """
 
-    g_standard = g.__class__()
+    #Frozen graphs are copied to their mutable counterparts.
+    g_standard = getattr(g, 'mutable_class', g.__class__)()
     #Copy graph attribute dictionary.
     g_standard.graph.update(g.graph)
     #Copy node dictionary in key-sorted order.
@@ -371,13 +2880,33 @@ def _standardize_graph_encoding(g):
     return g_standard
 
 
-def _embed_multigraph(mg):
+def _embed_multigraph(mg, embedding="edges"):
     """ Embed a vertex- and edge-colored multigraph (including self-loops)
     in a vertex-colored simple graph.
-    
+
+    With ``embedding="edges"``, every edge of ``mg`` becomes a host node of type
+    ``"edge"``, carrying the edge attributes and adjacent to both ends (to its one
+    end, for a self-loop).
+
+    With ``embedding="bundled"``, each bundle of parallel edges (or of self-loops
+    at one vertex) becomes a single host node of type ``"edge"``, whose color
+    ``'colors'`` is the sorted tuple of the edge colors of the bundle. Since the
+    ``k`` edges of a bundle are no longer separate nodes, NAUTY does not explore
+    their ``k!`` permutations, and the generators of the host automorphism group
+    all act nontrivially on the vertices. Edge attributes are then invisible to
+    ``color_sort_conditions``.
+
+    With ``embedding="layered"``, the bundles are instead encoded in the edges of
+    a layered host graph (see Section 14 of the `NAUTY User's Guide <https://pallini.di.uniroma1.it/Guide.html>`_
+    and :func:`nautypy._layered_host`), which has only ``ceil(log2(c+1))`` copies
+    of each vertex for ``c`` distinct bundle colors, and no edge nodes at all.
+
     Args:
         mg (networkx.MultiGraph-like): The multigraph to be embedded.
 
+    Keyword Args:
+        embedding (str): ``"edges"`` (default), ``"bundled"`` or ``"layered"``.
+
     Returns:
         g (hashable_containers.HGraph): The simple "host graph" encoding ``mg``.
 
@@ -388,6 +2917,13 @@ def _embed_multigraph(mg):
     g = HGraph()
     #Copy the graph attribute dict from mg to g.
     g.graph.update(mg.graph)
+    if embedding=="layered":
+        vertex_colors = [hmap({'type':'vertex', **mg.nodes[node]}) for node in range(mg.order())]
+        colors, edges, n_layers = _layered_host(vertex_colors, _edge_bundles(mg))
+        for node,color in enumerate(colors):
+            g.add_node(node, **color)
+        g.add_edges_from(edges.tolist())
+        return g
     # Add all multigraph nodes to the simple graph as nodes with type "vertex".
     # Copy the node attributes from mg to g.
     for node in mg.nodes():
@@ -398,6 +2934,15 @@ def _embed_multigraph(mg):
     #as nodes with type "edge".
     #Copy the edge attributes from mg to g.
     node = mg.order()
+    if embedding=="bundled":
+        for edge,bundle in _edge_bundles(mg).items():
+            g.add_node(node, type="edge", colors=bundle)
+            g.add_edge(node,edge[0])
+            g.add_edge(node,edge[1])
+            node += 1
+        return g
+    if embedding!="edges":
+        raise ValueError(f"embedding must be 'edges', 'bundled' or 'layered', not {embedding!r}")
     for edge in mg.edges:
         g.add_node(node)
         g.nodes[node]["type"]="edge"
@@ -408,6 +2953,82 @@ def _embed_multigraph(mg):
     return g
 
 
+def _edge_bundles(mg, index=None):
+    """Group the edges of a multigraph into bundles of parallel edges.
+
+    Args:
+        mg (networkx.MultiGraph-like): The multigraph.
+
+    Keyword Args:
+        index (None or dict): if not None, a map from the nodes of ``mg`` to integers, applied to the bundle ends.
+
+    Returns:
+        dict: the sorted tuple of the edge colors (:class:`hashable_containers.hmap`) of each bundle,
+        keyed by its ``(a,b)``, ``a<=b`` ends, in order of first appearance in ``mg.edges``.
+
+    """
+
+    bundles = {}
+    for a,b,attrs in mg.edges(data=True):
+        if index!=None:
+            a, b = index[a], index[b]
+        bundles.setdefault((min(a,b),max(a,b)), []).append(hmap(attrs))
+    return {ab:tuple(sorted(colors)) for ab,colors in bundles.items()}
+
+
+def _layered_host(vertex_colors, bundles):
+    """Encode a multigraph as a layered, vertex-colored simple graph.
+
+    The distinct colors of the bundles between distinct vertices are numbered
+    ``1,...,c`` in sorted order, which does not depend on the labeling of the
+    multigraph. Each vertex ``v`` is copied into ``L=ceil(log2(c+1))`` layers
+    (at least one), as host nodes ``layer*nv+v`` joined in a path, and a bundle
+    of color number ``k`` between ``a`` and ``b`` becomes an edge between the
+    copies of ``a`` and ``b`` in every layer ``i`` in which bit ``i`` of ``k``
+    is set. Self-loop bundles are folded into the color of their vertex, under
+    the key ``'loops'``, and every host node carries its layer under the key ``'layer'``.
+    The copies in layer 0 also carry the numbered bundle colors, as the tuple
+    ``'bundles'`` (color number ``k`` at position ``k-1``), so that the host graph
+    determines the bundle colors themselves, and not only their order.
+
+    Args:
+        vertex_colors (list): The color (a :class:`hashable_containers.hmap`) of each vertex.
+        bundles (dict): The bundles of the multigraph, keyed by zero-indexed ends (see :func:`nautypy._edge_bundles`).
+
+    Returns:
+        3-element tuple containing
+
+        - **colors** (*list*): The color of each of the ``L*nv`` host nodes.
+        - **edges** (*numpy.ndarray*): The ``(m,2)`` array of host edges.
+        - **n_layers** (*int*): The number of layers ``L``.
+
+    """
+
+    nv = len(vertex_colors)
+    loops = {a:bundle for (a,b),bundle in bundles.items() if a==b}
+    codes = {bundle:k for k,bundle in
+             enumerate(sorted({bundle for (a,b),bundle in bundles.items() if a!=b}), start=1)}
+    n_layers = max(1, len(codes).bit_length())
+    table = tuple(sorted(codes, key=codes.get))
+    colors = []
+    for layer in range(n_layers):
+        for v,color in enumerate(vertex_colors):
+            color = hmap(color, layer=layer)
+            if layer==0:
+                color['bundles'] = table
+            if v in loops:
+                color['loops'] = loops[v]
+            colors.append(color)
+    #Vertical threads joining the copies of each vertex.
+    edges = [(layer*nv+v, (layer+1)*nv+v) for layer in range(n_layers-1) for v in range(nv)]
+    #Bundles, written bit by bit across the layers.
+    for (a,b),bundle in bundles.items():
+        if a!=b:
+            k = codes[bundle]
+            edges += [(layer*nv+a, layer*nv+b) for layer in range(n_layers) if k>>layer & 1]
+    return colors, np.array(edges, dtype=np.intc).reshape(-1,2), n_layers
+
+
 def gprint(_g):
     """ Pretty-print graph data.
 
@@ -0,0 +1,287 @@
+#! /usr/bin/python3
+"""Streaming classification of colored multigraphs from the command line.
+
+Installed as the ``nautypy`` console script (or run as ``python3 -m nautypy_cli``).
+Multigraphs are read one per line, certified with :func:`nautypy.certificate_multigraph`
+(on a pool of worker processes with ``--workers``) and partitioned into isomorphism
+classes. Lines are read, certified and written chunk by chunk, so apart from the
+table of classes (one certificate, id and count per class) memory use does not
+grow with the input. Pass ``--digest-size`` to shrink the table further.
+
+Class ids are assigned from 0 in order of discovery. The outputs are
+
+* the table of classes (``--output``, default stdout): one tab-separated
+  ``certificate class_id count`` line per class, written once the input is
+  exhausted, with the certificate (or its digest) in hexadecimal;
+* the representatives (``--representatives``): the input line of the first member
+  of each class, written as the class is discovered, so that line ``k`` holds class ``k``;
+* the assignments (``--assignments``): the class id of every input graph, one per line.
+
+Two input formats are understood (``--format``):
+
+* ``jsonl``: one JSON object per line, with a list of ``"nodes"`` (node ids, or
+  ``[node, attributes]`` pairs) and a list of ``"edges"`` (``[a, b]`` or
+  ``[a, b, attributes]``). Nodes that only appear in edges are added without
+  attributes. JSON arrays in ids and attributes are read as tuples.
+* ``graph6``: a graph6 or sparse6 string (sparse6 for multigraphs and self-loops),
+  optionally followed by whitespace and comma-separated vertex colors (one per
+  vertex, in vertex order), then by whitespace and comma-separated edge colors,
+  one per edge, with the edges ``(i,j)``, ``i<=j`` sorted lexicographically.
+  A color is stored as the ``'color'`` attribute; the color ``-``, or a missing
+  list, leaves the vertices or edges uncolored.
+
+Every graph is certified as a multigraph, so simple graphs and multigraphs
+without parallel edges or self-loops are classified together. Blank lines are skipped.
+
+Example:
+    Deduplicate a stream, keeping one representative per class::
+
+        nautypy diagrams.jsonl --workers 8 --digest-size 16 -r unique.jsonl -o classes.tsv
+
+"""
+
+import sys
+import json
+import argparse
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import networkx as nx
+import nautypy
+from nautypy import _hashable, _jsonable
+
+
+def decode_jsonl(line):
+    """Read a multigraph from a line of the ``jsonl`` format.
+
+    Returns:
+        networkx.MultiGraph: the multigraph.
+
+    """
+
+    obj = json.loads(line)
+    mg = nx.MultiGraph()
+    for node in obj.get("nodes", []):
+        if isinstance(node, list) and len(node)==2 and isinstance(node[1], dict):
+            mg.add_node(_hashable(node[0]), **_hashable(node[1]))
+        else:
+            mg.add_node(_hashable(node))
+    for edge in obj.get("edges", []):
+        if len(edge)==2:
+            mg.add_edge(_hashable(edge[0]), _hashable(edge[1]))
+        elif len(edge)==3 and isinstance(edge[2], dict):
+            mg.add_edge(_hashable(edge[0]), _hashable(edge[1]), **_hashable(edge[2]))
+        else:
+            raise ValueError(f"edges must be [a, b] or [a, b, attributes], not {edge!r}")
+    return mg
+
+
+def encode_jsonl(mg):
+    """Write a graph or multigraph as a line of the ``jsonl`` format (without newline)."""
+    return json.dumps({"nodes":[[_jsonable(node), _jsonable(attrs)] for node,attrs in mg.nodes(data=True)],
+                       "edges":[[_jsonable(a), _jsonable(b), _jsonable(attrs)] for a,b,attrs in mg.edges(data=True)]},
+                      separators=(',',':'))
+
+
+def decode_graph6(line):
+    """Read a multigraph from a line of the ``graph6`` format.
+
+    Returns:
+        networkx.MultiGraph: the multigraph, on the nodes ``0,...,n-1``.
+
+    """
+
+    fields = line.split()
+    if not fields or len(fields)>3:
+        raise ValueError("expected a graph6/sparse6 string and at most two color lists")
+    code = fields[0].encode()
+    g = nx.from_sparse6_bytes(code) if code.startswith((b':', b'>>sparse6<<')) else nx.from_graph6_bytes(code)
+    n = g.number_of_nodes()
+    edges = sorted((min(a,b), max(a,b)) for a,b in g.edges())
+    vertex_colors = fields[1].split(',') if len(fields)>1 else ['-']*n
+    edge_colors = fields[2].split(',') if len(fields)>2 else ['-']*len(edges)
+    if len(vertex_colors)!=n or len(edge_colors)!=len(edges):
+        raise ValueError(f"expected {n} vertex colors and {len(edges)} edge colors, "
+                         f"not {len(vertex_colors)} and {len(edge_colors)}")
+    mg = nx.MultiGraph()
+    for node,color in enumerate(vertex_colors):
+        mg.add_node(node, **({'color':color} if color!='-' else {}))
+    for (a,b),color in zip(edges, edge_colors):
+        mg.add_edge(a, b, **({'color':color} if color!='-' else {}))
+    return mg
+
+
+def encode_graph6(mg):
+    """Write a graph or multigraph as a line of the ``graph6`` format (without newline).
+
+    Nodes are numbered in the order of ``mg.nodes``. Only the ``'color'``
+    attribute is kept, so graphs with other attributes raise ``ValueError``,
+    as do colors that are empty, ``-``, or contain commas or whitespace.
+    Graphs with parallel edges or self-loops are written as sparse6.
+    """
+
+    index = {node:i for i,node in enumerate(mg.nodes)}
+    g = nx.relabel_nodes(mg, index)
+    vertex_colors = [_color(attrs) for node,attrs in mg.nodes(data=True)]
+    edges = sorted(((min(index[a],index[b]), max(index[a],index[b])), _color(attrs))
+                   for a,b,attrs in mg.edges(data=True))
+    edge_colors = [color for ab,color in edges]
+    if nx.number_of_selfloops(g)>0 or len(set(ab for ab,color in edges))<len(edges):
+        code = nx.to_sparse6_bytes(g, header=False)
+    else:
+        code = nx.to_graph6_bytes(nx.Graph(g), header=False)
+    fields = [code.decode().strip()]
+    if any(c!='-' for c in vertex_colors+edge_colors):
+        fields.append(','.join(vertex_colors))
+    if any(c!='-' for c in edge_colors):
+        fields.append(','.join(edge_colors))
+    return ' '.join(fields)
+
+
+def _color(attrs):
+    """The token of the ``'color'`` attribute in the ``graph6`` format."""
+    if not attrs:
+        return '-'
+    if set(attrs)!={'color'}:
+        raise ValueError(f"the graph6 format only stores the 'color' attribute, not {sorted(attrs)}")
+    color = str(attrs['color'])
+    if not color or color=='-' or ',' in color or len(color.split())!=1:
+        raise ValueError(f"color {color!r} cannot be written in the graph6 format")
+    return color
+
+
+decoders = {'jsonl':decode_jsonl, 'graph6':decode_graph6}
+encoders = {'jsonl':encode_jsonl, 'graph6':encode_graph6}
+
+
+def _certify_lines(lines, format, options):
+    """Decode and certify a chunk of ``(line_number, line)`` pairs (a worker task)."""
+    certificates = []
+    for number,line in lines:
+        try:
+            mg = decoders[format](line)
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError, nx.NetworkXError) as exc:
+            raise ValueError(f"line {number}: {exc}") from None
+        certificates.append(nautypy.certificate_multigraph(mg, **options))
+    return certificates
+
+
+def certify_lines(lines, format="jsonl", workers=None, chunksize=256, color_sort_conditions=[],
+                  digest_size=None, embedding="edges", engine="sparse", invariant=None):
+    """Certify the multigraphs of an iterable of lines, lazily and in input order.
+
+    With ``workers>1``, chunks of ``chunksize`` lines are decoded and certified
+    by a pool of worker processes, with at most ``2*workers`` chunks in flight,
+    so the lines are consumed no faster than the pool certifies them.
+
+    Args:
+        lines (iterable): Lines of the ``format`` format. Blank lines are skipped.
+
+    Keyword Args:
+        format (str): ``"jsonl"`` (default) or ``"graph6"`` (see :mod:`nautypy_cli`).
+        workers (None or int): Number of worker processes. If None (default) or 1, certify in the calling process.
+        chunksize (int): Number of lines per worker task.
+        color_sort_conditions (list): See :func:`nautypy.certificate`.
+        digest_size (None or int): See :func:`nautypy.certificate`.
+        embedding (str): See :func:`nautypy.certificate_multigraph`.
+        engine (str): See :func:`nautypy.certificate`.
+        invariant (None, str or tuple): See :func:`nautypy.certificate`.
+
+    Yields:
+        ``(line, certificate)`` tuples, one per graph. Lines that cannot be decoded raise ``ValueError``.
+
+    """
+
+    if format not in decoders:
+        raise ValueError(f"format must be 'jsonl' or 'graph6', not {format!r}")
+    options = {'color_sort_conditions':color_sort_conditions, 'digest_size':digest_size,
+               'embedding':embedding, 'engine':engine, 'invariant':invariant}
+    numbered = ((number,line.strip()) for number,line in enumerate(lines, 1) if line.strip())
+    chunks = iter(lambda: list(islice(numbered, chunksize)), [])
+    if workers==None or workers<=1:
+        for chunk in chunks:
+            yield from zip((line for number,line in chunk), _certify_lines(chunk, format, options))
+        return
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            #Keep the pool busy.
+            for chunk in chunks:
+                pending.append((chunk, pool.submit(_certify_lines, chunk, format, options)))
+                if len(pending)>=2*workers:
+                    break
+            if not pending:
+                return
+            chunk, future = pending.popleft()
+            yield from zip((line for number,line in chunk), future.result())
+
+
+def main(argv=None):
+    """Run the ``nautypy`` command (see :mod:`nautypy_cli`).
+
+    Keyword Args:
+        argv (None or list): The arguments. If None, ``sys.argv[1:]``.
+
+    Returns:
+        int: the exit status.
+
+    """
+
+    parser = argparse.ArgumentParser(prog="nautypy",
+        description="Partition a stream of colored multigraphs, one per line, into isomorphism classes.")
+    parser.add_argument("input", nargs="?", default="-", help="input file (default: stdin)")
+    parser.add_argument("-f", "--format", choices=sorted(decoders), default="jsonl", help="input format")
+    parser.add_argument("-o", "--output", default="-",
+                        help="file for the 'certificate class_id count' table (default: stdout)")
+    parser.add_argument("-r", "--representatives", default=None,
+                        help="file for the first input line of each class")
+    parser.add_argument("-a", "--assignments", default=None, help="file for the class id of each input graph")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=256, help="number of lines per worker task")
+    parser.add_argument("--digest-size", type=int, default=None,
+                        help="key classes by digests of this many bytes instead of full certificates")
+    parser.add_argument("--embedding", choices=["edges","bundled","layered"], default="edges",
+                        help="multigraph embedding")
+    parser.add_argument("--engine", choices=["sparse","dense","traces","auto"], default="sparse",
+                        help="NAUTY engine")
+    parser.add_argument("--invariant", default=None, help="NAUTY vertex invariant (e.g. distances)")
+    args = parser.parse_args(argv)
+
+    class_ids = {}
+    counts = []
+    files = []
+    try:
+        source = sys.stdin if args.input=="-" else open(args.input)
+        files.append(source)
+        representatives = None if args.representatives==None else open(args.representatives, "w")
+        assignments = None if args.assignments==None else open(args.assignments, "w")
+        files += [f for f in (representatives, assignments) if f!=None]
+        for line, cert in certify_lines(source, format=args.format, workers=args.workers,
+                                        chunksize=args.chunksize, digest_size=args.digest_size,
+                                        embedding=args.embedding, engine=args.engine,
+                                        invariant=args.invariant):
+            class_id = class_ids.get(cert)
+            if class_id==None:
+                class_id = len(counts)
+                class_ids[cert] = class_id
+                counts.append(0)
+                if representatives!=None:
+                    representatives.write(line+"\n")
+            counts[class_id] += 1
+            if assignments!=None:
+                assignments.write(f"{class_id}\n")
+        output = sys.stdout if args.output=="-" else open(args.output, "w")
+        files.append(output)
+        output.writelines(f"{cert.hex()}\t{class_id}\t{counts[class_id]}\n"
+                          for cert,class_id in class_ids.items())
+    except (OSError, ValueError) as exc:
+        parser.exit(1, f"nautypy: error: {exc}\n")
+    finally:
+        for f in files:
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+#! /usr/bin/python3
+"""Permutation groups on numpy arrays, for the automorphism generators returned by nautypy.
+
+Permutations of ``0,...,n-1`` are numpy ``intc`` arrays in one-line notation:
+``p`` sends ``i`` to ``p[i]``. The product "``p``, then ``q``" is the array ``q[p]``.
+
+The module is available as ``nautypy.groups``. A group is built from the
+generators returned by :func:`nautypy.canonize_multigraph` (or any other
+``canonize_*`` function) with :meth:`PermutationGroup.from_autgens`, or from
+an ``(k,n)`` generator array (as returned by :func:`nautypy.canonize_arrays`)
+directly. Its stabilizer chain is computed once, by the Schreier-Sims
+algorithm, and answers order, membership, orbit and coset queries.
+"""
+
+import numpy as np
+from math import prod
+
+
+def identity(n):
+    """The identity permutation of degree ``n``."""
+    return np.arange(n, dtype=np.intc)
+
+
+def inverse(p):
+    """The inverse of the permutation ``p``."""
+    p_inv = np.empty_like(p)
+    p_inv[p] = np.arange(len(p), dtype=p.dtype)
+    return p_inv
+
+
+def as_permutations(autgens, nodes=None):
+    """Convert dict-like automorphism generators to a generator array.
+
+    Args:
+        autgens (list): Dict-like permutations of ``nodes``, as returned by :func:`nautypy.canonize_simple_graph` or :func:`nautypy.canonize_multigraph`.
+
+    Keyword Args:
+        nodes (None or list): The nodes, in the order in which they are indexed. If None, the sorted keys of the first generator.
+
+    Returns:
+        2-element tuple containing
+
+        - **perms** (*numpy.ndarray*): a ``(len(autgens), len(nodes))`` array of permutations of the node indices.
+        - **nodes** (*list*): the nodes indexed by ``0,...,len(nodes)-1``.
+
+    """
+
+    if nodes==None:
+        nodes = sorted(autgens[0]) if len(autgens)>0 else []
+    index = {node:i for i,node in enumerate(nodes)}
+    perms = np.array([[index[aut[node]] for node in nodes] for aut in autgens], dtype=np.intc)
+    return perms.reshape(len(autgens), len(nodes)), list(nodes)
+
+
+class PermutationGroup:
+    """A permutation group of degree ``n``, with its stabilizer chain.
+
+    The chain is built by the deterministic Schreier-Sims algorithm of
+    D. E. Knuth ("Efficient representation of perm groups", Combinatorica 11 (1991) 33-43),
+    with base ``0,1,...,n-1``: level ``k`` holds the stabilizer ``G_k`` of the points
+    ``0,...,k-1`` and a transversal of ``G_k`` modulo ``G_{k+1}``, i.e. one element of
+    ``G_k`` sending ``k`` to each point of its basic orbit. Every element of the group
+    factors uniquely as a product of transversal elements, one per level.
+
+    Args:
+        generators (array-like): A ``(k,n)`` array of permutations, e.g. the generators
+            returned by :func:`nautypy.canonize_arrays` or :func:`nautypy.canonize_compact`.
+
+    Keyword Args:
+        degree (None or int): The degree ``n``. Only needed if there are no generators.
+
+    Example:
+        The group of a hexagon::
+
+            mg_canonical, mg_autgens, mg_canonical_map = nautypy.canonize_simple_graph(nx.cycle_graph(6))
+            group, nodes = nautypy.groups.PermutationGroup.from_autgens(mg_autgens, nodes=range(6))
+            group.order()    # 12
+
+    """
+
+    def __init__(self, generators, degree=None):
+        generators = np.asarray(generators, dtype=np.intc)
+        if degree==None:
+            degree = generators.shape[1]
+        generators = generators.reshape(-1, degree)
+        self.degree = degree
+        self.generators = generators
+        #Strong generators of each level, and the transversal of each level (and its inverses), keyed by orbit point.
+        self._strong = [[] for k in range(degree)]
+        self._transversals = [{k:identity(degree)} for k in range(degree)]
+        self._inverses = [{k:identity(degree)} for k in range(degree)]
+        for g in generators:
+            self._add(g, 0)
+
+    @classmethod
+    def from_autgens(cls, autgens, nodes=None):
+        """Build the group generated by dict-like automorphism generators.
+
+        Args:
+            autgens (list): See :func:`nautypy.groups.as_permutations`.
+
+        Keyword Args:
+            nodes (None or list): See :func:`nautypy.groups.as_permutations`. Must be given if ``autgens`` is empty.
+
+        Returns:
+            2-element tuple ``(group, nodes)``: the group acting on the node indices, and the indexed nodes.
+
+        """
+
+        perms, nodes = as_permutations(autgens, nodes=nodes)
+        return cls(perms, degree=len(nodes)), nodes
+
+    def _sift(self, g, k=0):
+        """Sift ``g`` (which fixes ``0,...,k-1``) through the chain from level ``k``.
+
+        Returns:
+            2-element tuple: the residue, and the level at which sifting stopped (``degree`` if it went through).
+
+        """
+
+        for level in range(k, self.degree):
+            t_inv = self._inverses[level].get(int(g[level]))
+            if t_inv is None:
+                return g, level
+            g = t_inv[g]
+        return g, self.degree
+
+    def _add(self, g, k):
+        """Add ``g``, which fixes ``0,...,k-1``, to the generators of level ``k`` (Knuth's procedure A)."""
+        residue, level = self._sift(g, k)
+        if level==self.degree:
+            return
+        strong = self._strong[k]
+        strong.append(g)
+        for t in list(self._transversals[k].values()):
+            self._extend(g[t], k)
+
+    def _extend(self, g, k):
+        """Extend the basic orbit of level ``k`` by the element ``g`` of ``G_k`` (Knuth's procedure B)."""
+        pending = [g]
+        transversal = self._transversals[k]
+        inverses = self._inverses[k]
+        while pending:
+            g = pending.pop()
+            t_inv = inverses.get(int(g[k]))
+            if t_inv is not None:
+                #Schreier generator: fixes 0,...,k.
+                self._add(t_inv[g], k+1)
+            else:
+                transversal[int(g[k])] = g
+                inverses[int(g[k])] = inverse(g)
+                pending.extend(s[g] for s in self._strong[k])
+
+    @property
+    def base(self):
+        """The base points with nontrivial basic orbits."""
+        return [k for k,transversal in enumerate(self._transversals) if len(transversal)>1]
+
+    @property
+    def basic_orbits(self):
+        """The basic orbits of the points of :attr:`base`, as sorted lists."""
+        return [sorted(self._transversals[k]) for k in self.base]
+
+    @property
+    def strong_generators(self):
+        """A strong generating set relative to the base ``0,...,n-1``, as a ``(k,n)`` array."""
+        strong = [s for level in self._strong for s in level]
+        return np.array(strong, dtype=np.intc).reshape(len(strong), self.degree)
+
+    def order(self):
+        """The order of the group, as an exact int."""
+        return prod(len(transversal) for transversal in self._transversals)
+
+    def contains(self, perm):
+        """Whether the permutation ``perm`` belongs to the group."""
+        perm = np.asarray(perm, dtype=np.intc)
+        return len(perm)==self.degree and self._sift(perm)[1]==self.degree
+
+    def __contains__(self, perm):
+        return self.contains(perm)
+
+    def orbit(self, point):
+        """The orbit of ``point``, as a sorted list."""
+        orbit = {point}
+        frontier = [point]
+        while frontier:
+            p = frontier.pop()
+            for g in self.generators:
+                q = int(g[p])
+                if q not in orbit:
+                    orbit.add(q)
+                    frontier.append(q)
+        return sorted(orbit)
+
+    def orbits(self):
+        """The orbits of the group, as sorted lists, ordered by their least points."""
+        parent = np.arange(self.degree)
+        for g in self.generators:
+            for p,q in enumerate(g.tolist()):
+                while parent[p]!=p:
+                    p = parent[p]
+                while parent[q]!=q:
+                    q = parent[q]
+                parent[max(p,q)] = min(p,q)
+        for p in range(self.degree):
+            parent[p] = parent[parent[p]]
+        orbits = {}
+        for p,root in enumerate(parent.tolist()):
+            orbits.setdefault(root, []).append(p)
+        return list(orbits.values())
+
+    def elements(self):
+        """Iterate over all elements of the group."""
+        levels = [list(self._transversals[k].values()) for k in self.base]
+        def product(level, g):
+            if level<0:
+                yield g
+                return
+            for t in levels[level]:
+                yield from product(level-1, t[g])
+        yield from product(len(levels)-1, identity(self.degree))
+
+    def random_element(self, rng=None):
+        """A uniformly distributed random element of the group.
+
+        Keyword Args:
+            rng (None or numpy.random.Generator): The random number generator. If None, a fresh ``numpy.random.default_rng()``.
+
+        """
+
+        if rng==None:
+            rng = np.random.default_rng()
+        g = identity(self.degree)
+        for k in reversed(self.base):
+            transversal = list(self._transversals[k].values())
+            g = transversal[rng.integers(len(transversal))][g]
+        return g
+
+    def coset_representative(self, perm):
+        """The canonical representative of the coset ``{perm[g] : g in G}``.
+
+        These are the permutations "``g``, then ``perm``": if ``perm`` relabels a
+        graph with automorphism group ``G``, the coset holds all relabelings
+        giving the same graph. The representative is the lexicographically
+        least element of the coset, found greedily down the stabilizer chain.
+        Applied to the inverse of a canonical map (see :func:`nautypy._canonize`),
+        it tells whether two canonical maps differ by an automorphism, as
+        ``SymmetricGroup._coset_representative`` does in ``test/comparison.py``.
+
+        Args:
+            perm (array-like): A permutation of degree ``n``.
+
+        Returns:
+            numpy.ndarray: the representative.
+
+        """
+
+        perm = np.asarray(perm, dtype=np.intc)
+        for k in self.base:
+            #Among the g in G_k, minimize the image of k.
+            transversal = self._transversals[k]
+            point = min(transversal, key=lambda point:perm[point])
+            perm = perm[transversal[point]]
+        return perm
+
+    def coset_representatives(self):
+        """Iterate over the canonical representatives of all cosets ``{perm[g] : g in G}`` in the symmetric group.
+
+        A permutation is a representative (see :meth:`nautypy.groups.PermutationGroup.coset_representative`)
+        if and only if ``perm[k]<perm[p]`` for every point ``p!=k`` of every basic orbit
+        of ``k``. The values ``0,1,...`` are handed out in turn to the points whose
+        constraints are all met, so every branch yields a representative, and the
+        ``n!/|G|`` distinct relabelings of a graph with automorphism group ``G``
+        are enumerated without repetition.
+
+        Yields:
+            numpy.ndarray: the representatives, in lexicographic order of their inverses.
+
+        """
+
+        n = self.degree
+        #Number of unmet constraints perm[k]<perm[p] of each point p.
+        blockers = [0]*n
+        successors = [[] for p in range(n)]
+        for k in self.base:
+            for p in self._transversals[k]:
+                if p!=k:
+                    successors[k].append(p)
+                    blockers[p] += 1
+        perm = np.empty(n, dtype=np.intc)
+        def assign(value):
+            if value==n:
+                yield perm.copy()
+                return
+            for p in range(n):
+                if blockers[p]==0:
+                    blockers[p] = -1
+                    perm[p] = value
+                    for q in successors[p]:
+                        blockers[q] -= 1
+                    yield from assign(value+1)
+                    for q in successors[p]:
+                        blockers[q] += 1
+                    blockers[p] = 0
+        yield from assign(0)
+
+    def __repr__(self):
+        return f"PermutationGroup(degree={self.degree}, order={self.order()}, base={self.base})"
@@ -4,8 +4,9 @@ from setuptools import setup
 setup(
     name="nautypy",
     version="1.0",
-    py_modules=["nautypy"],
-    setup_requires=["cffi>=1.0.0", "path"],
-    install_requires=["networkx", "hashable_containers","matplotlib","pygraphviz","prettytable"],
+    py_modules=["nautypy", "nautypy_groups", "nautypy_cli"],
+    setup_requires=["cffi>=1.0.0", "pycparser", "path"],
+    install_requires=["networkx", "numpy", "hashable_containers","matplotlib","pygraphviz","prettytable"],
+    entry_points={"console_scripts": ["nautypy=nautypy_cli:main"]},
     cffi_modules=["cffibuild_nautypy.py:ffibuilder"],
 )
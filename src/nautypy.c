@@ -1,64 +1,413 @@
+#define _POSIX_C_SOURCE 199309L	/* clock_gettime() under -std=c11 */
 #include "nautypy.h"
 #include "nausparse.h"    /* which includes nauty.h */
+#include "traces.h"
+#include "nautinv.h"
 #include <stdlib.h>
 #include <string.h>
 #include <stddef.h>
+#include <time.h>
 
-void canonize(int _nv, size_t _nde, size_t* _v, int* _d, int* _e, int* lab, int* ptn, int* n_auts, int*** auts)
+#ifndef NAUTYPY_THREAD_SAFE
+#define NAUTYPY_THREAD_SAFE HAVE_TLS
+#endif
+
+/* Per-call state of canonize_batch(). Generators are collected in a
+   growable flat buffer by store_auts(). */
+typedef struct
 {
-	*n_auts = 0;	
-	
-	*auts = NULL;
+	int* auts;		// Generators of all graphs, stored back to back.
+	size_t len;		// Number of ints in use.
+	size_t cap;		// Number of ints allocated.
+	int* n_auts;	// Generator counter of the graph currently being canonized.
+	int failed;		// Set once the buffer could not be grown.
+} canonize_ctx;
+
+/* nauty's userautomproc takes no user data, so the context of the
+   call in progress is published through a thread-local pointer. */
+static _Thread_local canonize_ctx* current_ctx = NULL;
 
-	void store_auts(int count, int* perm, int* orbits, int numorbits, int stabvertex, int n)
+static void store_auts(int count, int* perm, int* orbits, int numorbits, int stabvertex, int n)
+{
+	canonize_ctx* ctx = current_ctx;
+	if (ctx->failed)
+	{
+		*(ctx->n_auts) = -1;
+		return;
+	}
+	if (ctx->len + n > ctx->cap)
 	{
-		*n_auts = *n_auts + 1;
-		*auts = realloc(*auts,(*n_auts)*(sizeof (int*)));
-		(*auts)[*n_auts-1] = malloc(n*sizeof(int));	
-		memcpy((*auts)[*n_auts-1],perm,n*sizeof(int));
+		size_t cap = 2*(ctx->len + n);
+		int* auts = realloc(ctx->auts, cap*sizeof(int));
+		if (auts == NULL)
+		{
+			// Keep the old buffer (it is still freed with the context), and
+			// flag the graph with a negative generator count.
+			ctx->failed = 1;
+			*(ctx->n_auts) = -1;
+			return;
+		}
+		ctx->auts = auts;
+		ctx->cap = cap;
 	}
+	memcpy(ctx->auts + ctx->len, perm, n*sizeof(int));
+	ctx->len += n;
+	*(ctx->n_auts) += 1;
+}
 
-    DYNALLSTAT(int,orbits,orbits_sz);
-    static DEFAULTOPTIONS_SPARSEGRAPH(options);
-    statsblk stats;
-    sparsegraph sg;   /* Declare sparse graph structure */
-    sparsegraph canonsg;   /* Declare sparse graph structure */
+/* Invariant procedures, indexed by NAUTYPY_INV_*: for densenauty, and
+   for sparsenauty (NULL where nauty has no sparse version). */
+typedef void (*invariant_proc)(graph*,int*,int*,int,int,int,int*,int,boolean,int,int);
+static const invariant_proc dense_invariants[] = {NULL, twopaths, adjtriang, triples, quadruples,
+	celltrips, cellquads, cellquins, distances, indsets, cliques, cellcliq, cellind,
+	adjacencies, cellfano, cellfano2, refinvar};
+static const invariant_proc sparse_invariants[] = {NULL, NULL, NULL, NULL, NULL,
+	NULL, NULL, NULL, distances_sg, NULL, NULL, NULL, NULL,
+	adjacencies_sg, NULL, NULL, NULL};
 
-	//options.writeautoms = TRUE;
-	//options.defaultptn = TRUE; 
-    options.defaultptn = FALSE; // Use initial partition from function argument.
-	options.getcanon = TRUE; // Compute canonical labeling. Will be stored in lab.
-	options.userautomproc = store_auts; // Store automorphisms as they are found.
+static void store_stats(size_t* stats, statsblk* s)
+{
+	stats[NAUTYPY_STAT_NUMNODES] = s->numnodes;
+	stats[NAUTYPY_STAT_NUMBADLEAVES] = s->numbadleaves;
+	stats[NAUTYPY_STAT_MAXLEVEL] = s->maxlevel;
+	stats[NAUTYPY_STAT_NUMGENERATORS] = s->numgenerators;
+	stats[NAUTYPY_STAT_TCTOTAL] = s->tctotal;
+	stats[NAUTYPY_STAT_CANUPDATES] = s->canupdates;
+	stats[NAUTYPY_STAT_INVAPPLICS] = s->invapplics;
+	stats[NAUTYPY_STAT_INVSUCCESSES] = s->invsuccesses;
+	stats[NAUTYPY_STAT_INVARSUCLEVEL] = s->invarsuclevel;
+}
+
+static size_t elapsed_ns(struct timespec* start)
+{
+	struct timespec end;
+	clock_gettime(CLOCK_MONOTONIC, &end);
+	return (size_t)(end.tv_sec-start->tv_sec)*1000000000u + end.tv_nsec - start->tv_nsec;
+}
+
+int thread_safe(void)
+{
+	/* nauty keeps its workspace in static variables, which are only
+	   thread-local if nauty was configured with --enable-tls. */
+	return NAUTYPY_THREAD_SAFE;
+}
+
+void canonize(int _nv, size_t _nde, size_t* _v, int* _d, int* _e, int* lab, int* ptn, int* n_auts, int** auts,
+              int* orbits, double* grpsize1, int* grpsize2, int* numorbits, size_t* stats, int engine, int* invariant, int timed)
+{
+	/* The canonical labeling overwrites lab. The *n_auts generators
+	   are returned as one contiguous (*n_auts) x _nv buffer in *auts,
+	   which the caller releases with free_auts(). If the buffer could not
+	   be allocated, *n_auts is -1 and the generators are incomplete.
+	   The automorphism group
+	   has order *grpsize1 * 10^(*grpsize2) and *numorbits orbits;
+	   orbits[i] is the least vertex in the orbit of vertex i.
+	   The NAUTYPY_N_STATS search statistics are returned in stats.
+	   engine is one of NAUTYPY_SPARSE, NAUTYPY_DENSE or NAUTYPY_TRACES,
+	   and invariant and timed are as in canonize_batch(). */
+	int vtx_off[2] = {0, _nv};
+	size_t de_off[2] = {0, _nde};
+	canonize_batch(1, &engine, vtx_off, de_off, _v, _d, _e, lab, ptn, n_auts, auts,
+	               orbits, grpsize1, grpsize2, numorbits, stats, invariant, timed);
+}
 
-	//Initialise sparse graph structure.
-    SG_INIT(sg);
-    SG_INIT(canonsg);
+static void store_traces_auts(int count, int* perm, int n)
+{
+	store_auts(count, perm, NULL, 0, 0, n);
+}
+
+/* Workspace of a canonization: the NAUTY options, the sparse graph and
+   its canonical form, the packed adjacency matrices of densenauty, and
+   the generator buffer. Buffers only grow, so a canonizer reused for
+   graphs of similar size allocates nothing once it has warmed up. */
+struct canonizer
+{
+	optionblk options;
+	optionblk dense_options;
+	TracesOptions traces_options;
+	sparsegraph sg;
+	sparsegraph canonsg;
+	graph* dg;			// Packed adjacency matrices, for densenauty
+	graph* canondg;
+	size_t dense_words;	// Number of setwords allocated for each of dg, canondg.
+	int max_nv;			// Largest order checked by nauty_check().
+	canonize_ctx ctx;
+};
+
+static void canonizer_init(canonizer* c)
+{
+	DEFAULTOPTIONS_SPARSEGRAPH(options);
+	DEFAULTOPTIONS_GRAPH(dense_options);
+	DEFAULTOPTIONS_TRACES(traces_options);
 
-    int m = SETWORDSNEEDED(_nv);
-    nauty_check(WORDSIZE,m,_nv,NAUTYVERSIONID);
+	options.defaultptn = FALSE; // Use initial partition from function argument.
+	options.getcanon = TRUE; // Compute canonical labeling. Will be stored in lab.
+	options.userautomproc = store_auts; // Store automorphisms as they are found.
+	dense_options.defaultptn = FALSE;
+	dense_options.getcanon = TRUE;
+	dense_options.userautomproc = store_auts;
+	traces_options.defaultptn = FALSE;
+	traces_options.getcanon = TRUE;
+	traces_options.userautomproc = store_traces_auts;
+	c->options = options;
+	c->dense_options = dense_options;
+	c->traces_options = traces_options;
 
-    DYNALLOC1(int,orbits,orbits_sz,_nv,"malloc");
+	//Initialise sparse graph structures.
+	SG_INIT(c->sg);
+	SG_INIT(c->canonsg);
+	c->dg = NULL;
+	c->canondg = NULL;
+	c->dense_words = 0;
+	c->max_nv = -1;
+	c->ctx = (canonize_ctx){NULL, 0, 0, NULL, 0};
+}
 
+/* Grow the workspace of c for graphs of nv vertices and nde directed
+   edges, and their packed adjacency matrices if dense is nonzero.
+   Returns 0 if the matrices could not be allocated, leaving the old ones. */
+static int canonizer_reserve(canonizer* c, int nv, size_t nde, int dense)
+{
+	if (nv > c->max_nv)
+	{
+		nauty_check(WORDSIZE,SETWORDSNEEDED(nv),nv,NAUTYVERSIONID);
+		c->max_nv = nv;
+	}
 	/* SG_ALLOC makes sure that the v,d,e fields of a sparse graph
     structure point to arrays that are large enough.  This only
     works if the structure has been initialised. */
-    SG_ALLOC(sg,_nv,_nde,"malloc");
-    SG_ALLOC(canonsg,_nv,_nde,"malloc");
+	SG_ALLOC(c->sg,nv,nde,"malloc");
+	SG_ALLOC(c->canonsg,nv,nde,"malloc");
+	size_t words = (size_t)SETWORDSNEEDED(nv)*nv;
+	if (dense && words > c->dense_words)
+	{
+		graph* dg = malloc(words*sizeof(graph));
+		graph* canondg = malloc(words*sizeof(graph));
+		if (dg == NULL || canondg == NULL)
+		{
+			free(dg);
+			free(canondg);
+			return 0;
+		}
+		free(c->dg);
+		free(c->canondg);
+		c->dg = dg;
+		c->canondg = canondg;
+		c->dense_words = words;
+	}
+	return 1;
+}
+
+static void canonizer_release(canonizer* c)
+{
+	SG_FREE(c->sg);
+	SG_FREE(c->canonsg);
+	free(c->dg);
+	free(c->canondg);
+	free(c->ctx.auts);
+}
+
+static void set_invariant(canonizer* c, int* invariant)
+{
+	if (invariant != NULL && invariant[0] != NAUTYPY_INV_NONE)
+	{
+		c->options.invarproc = sparse_invariants[invariant[0]];
+		c->dense_options.invarproc = dense_invariants[invariant[0]];
+		c->options.mininvarlevel = c->dense_options.mininvarlevel = invariant[1];
+		c->options.maxinvarlevel = c->dense_options.maxinvarlevel = invariant[2];
+		c->options.invararg = c->dense_options.invararg = invariant[3];
+	}
+	else
+	{
+		c->options.invarproc = NULL;
+		c->dense_options.invarproc = NULL;
+		c->options.mininvarlevel = c->dense_options.mininvarlevel = 0;
+		c->options.maxinvarlevel = c->dense_options.maxinvarlevel = 1;
+		c->options.invararg = c->dense_options.invararg = 0;
+	}
+}
+
+/* Canonize one graph with the reserved workspace of c, appending its
+   generators to c->ctx.auts. The arguments are those of canonize(),
+   with stats pointing to the NAUTYPY_N_STATS statistics of the graph.
+   The engine call is only timed if timed is nonzero. */
+static void canonize_one(canonizer* c, int nv, size_t nde, size_t* _v, int* _d, int* _e, int* lab, int* ptn,
+                         int* n_auts, int* orbits, double* grpsize1, int* grpsize2, int* numorbits,
+                         size_t* stats, int engine, int timed)
+{
+	sparsegraph* sg = &c->sg;
+	statsblk nauty_stats;
+	TracesStats traces_stats;
+
+	sg->nv = nv;  //Number of vertices
+	sg->nde = nde; //Number of directed edges
+	*n_auts = 0;
+	c->ctx.n_auts = n_auts;
+	memset(stats, 0, NAUTYPY_N_STATS*sizeof(size_t));
+	if (nv == 0)
+	{
+		// Nothing to canonize: the trivial group.
+		*grpsize1 = 1.0;
+		*grpsize2 = 0;
+		*numorbits = 0;
+		return;
+	}
+
+	// Copy the graph structure from the caller's arrays.
+	memcpy(sg->v, _v, nv*sizeof(size_t));
+	memcpy(sg->d, _d, nv*sizeof(int));
+	memcpy(sg->e, _e, nde*sizeof(int));
+
+	// Run the selected engine.
+	struct timespec start;
+	if (timed)
+		clock_gettime(CLOCK_MONOTONIC, &start);
+	if (engine == NAUTYPY_TRACES)
+	{
+		Traces(sg,lab,ptn,orbits,&c->traces_options,&traces_stats,&c->canonsg);
+		if (timed)
+			stats[NAUTYPY_STAT_NAUTY_NS] = elapsed_ns(&start);
+		*grpsize1 = traces_stats.grpsize1;
+		*grpsize2 = traces_stats.grpsize2;
+		*numorbits = traces_stats.numorbits;
+		stats[NAUTYPY_STAT_NUMNODES] = traces_stats.numnodes;
+		stats[NAUTYPY_STAT_MAXLEVEL] = traces_stats.treedepth;
+		stats[NAUTYPY_STAT_NUMGENERATORS] = traces_stats.numgenerators;
+		stats[NAUTYPY_STAT_CANUPDATES] = traces_stats.canupdates;
+		return;
+	}
+	if (engine == NAUTYPY_DENSE)
+	{
+		// Pack the adjacency lists into rows of m setwords.
+		int m = SETWORDSNEEDED(nv);
+		EMPTYGRAPH(c->dg,m,nv);
+		for (int i=0; i<nv; i++)
+			for (size_t j=sg->v[i]; j<sg->v[i]+sg->d[i]; j++)
+				ADDELEMENT(GRAPHROW(c->dg,i,m),sg->e[j]);
+		densenauty(c->dg,lab,ptn,orbits,&c->dense_options,&nauty_stats,m,nv,c->canondg);
+	}
+	else
+		sparsenauty(sg,lab,ptn,orbits,&c->options,&nauty_stats,&c->canonsg);
+	*grpsize1 = nauty_stats.grpsize1;
+	*grpsize2 = nauty_stats.grpsize2;
+	*numorbits = nauty_stats.numorbits;
+	store_stats(stats, &nauty_stats);
+	if (timed)
+		stats[NAUTYPY_STAT_NAUTY_NS] = elapsed_ns(&start);
+}
+
+void canonize_batch(int n_graphs, int* engines, int* vtx_off, size_t* de_off, size_t* _v, int* _d, int* _e, int* lab, int* ptn, int* n_auts, int** auts,
+                    int* orbits, double* grpsize1, int* grpsize2, int* numorbits, size_t* stats, int* invariant, int timed)
+{
+	/* Graph g occupies vertices [vtx_off[g], vtx_off[g+1]) of _v, _d, lab, ptn, orbits
+	   and directed edges [de_off[g], de_off[g+1]) of _e. Entries of _v are
+	   relative to the start of the graph's own block of _e.
+	   Graph g is canonized by engines[g]: sparsenauty (NAUTYPY_SPARSE), densenauty
+	   on a packed adjacency matrix (NAUTYPY_DENSE), or Traces (NAUTYPY_TRACES).
+	   Canonical labelings overwrite lab. The generators of all graphs are
+	   returned back to back in *auts (n_auts[g] generators of length nv_g
+	   for graph g), which the caller releases with free_auts(). If the
+	   buffer could not be allocated, n_auts[g] is -1 for the graph being
+	   canonized at the time (and every later graph with generators). If the
+	   adjacency matrices of NAUTYPY_DENSE could not be allocated, nothing is
+	   canonized, n_auts[g] is -1 for every graph and *auts is NULL.
+	   The group order and orbit count of graph g are returned in grpsize1[g],
+	   grpsize2[g] and numorbits[g], and its orbits in its block of orbits
+	   (as vertex indices relative to the start of the block), and its search
+	   statistics in stats[NAUTYPY_N_STATS*g+NAUTYPY_STAT_*]. Traces only reports
+	   numnodes, maxlevel (its tree depth), numgenerators and canupdates. If timed
+	   is nonzero, every engine reports the wall time of its call in
+	   NAUTYPY_STAT_NAUTY_NS (which is 0 otherwise, sparing two clock reads per graph).
+	   Unless invariant is NULL, the vertex invariant invariant[0] (a NAUTYPY_INV_*
+	   code) is applied at levels invariant[1] to invariant[2] of the search tree,
+	   with argument invariant[3], by densenauty and by sparsenauty (which only
+	   has NAUTYPY_INV_DISTANCES and NAUTYPY_INV_ADJACENCIES). Traces ignores it. */
+	canonizer c;
+	canonizer_init(&c);
+	set_invariant(&c, invariant);
 
-    sg.nv = _nv;  //Number of vertices
-    sg.nde = _nde; //Number of directed edges
+	// Size the workspace once, for the largest graph in the batch.
+	int max_nv = 0;
+	size_t max_nde = 0;
+	int dense = 0;
+	for (int g=0; g<n_graphs; g++)
+	{
+		if (vtx_off[g+1]-vtx_off[g] > max_nv) max_nv = vtx_off[g+1]-vtx_off[g];
+		if (de_off[g+1]-de_off[g] > max_nde) max_nde = de_off[g+1]-de_off[g];
+		if (engines[g] == NAUTYPY_DENSE) dense = 1;
+	}
+	if (!canonizer_reserve(&c, max_nv, max_nde, dense))
+	{
+		for (int g=0; g<n_graphs; g++)
+			n_auts[g] = -1;
+		*auts = NULL;
+		canonizer_release(&c);
+		return;
+	}
 
-	// Copy the graph structure from canonize() arguments.
-	memcpy(sg.v, _v, _nv*sizeof(size_t));
-	memcpy(sg.d, _d, _nv*sizeof(int));
-	memcpy(sg.e, _e, _nde*sizeof(int));
+	current_ctx = &c.ctx;
+	for (int g=0; g<n_graphs; g++)
+	{
+		int off = vtx_off[g];
+		canonize_one(&c, vtx_off[g+1]-off, de_off[g+1]-de_off[g], _v+off, _d+off, _e+de_off[g],
+		             lab+off, ptn+off, &n_auts[g], orbits+off, &grpsize1[g], &grpsize2[g], &numorbits[g],
+		             stats+(size_t)NAUTYPY_N_STATS*g, engines[g], timed);
+	}
+	current_ctx = NULL;
 
-	// Run nauty.
-    sparsenauty(&sg,lab,ptn,orbits,&options,&stats,&canonsg);
+	// Hand the generators over to the caller, and free the rest.
+	*auts = c.ctx.auts;
+	c.ctx.auts = NULL;
+	canonizer_release(&c);
+}
 
-	// Free memory.
-	SG_FREE(sg);
-	SG_FREE(canonsg);
-	DYNFREE(orbits,orbits_sz);
+canonizer* canonizer_new(int max_nv, size_t max_nde)
+{
+	/* A canonizer whose workspace is reserved for graphs of up to max_nv
+	   vertices and max_nde directed edges (and grown for larger ones),
+	   or NULL if it could not be allocated. */
+	canonizer* c = malloc(sizeof(canonizer));
+	if (c == NULL)
+		return NULL;
+	canonizer_init(c);
+	canonizer_reserve(c, max_nv, max_nde, 0);
+	// Room for max_nv generators of max_nv vertices (store_auts() grows it as needed).
+	c->ctx.cap = (size_t)max_nv*max_nv;
+	c->ctx.auts = c->ctx.cap > 0 ? malloc(c->ctx.cap*sizeof(int)) : NULL;
+	if (c->ctx.auts == NULL)
+		c->ctx.cap = 0;
+	return c;
+}
 
+void canonizer_free(canonizer* c)
+{
+	canonizer_release(c);
+	free(c);
+}
+
+void canonize_with(canonizer* c, int _nv, size_t _nde, size_t* _v, int* _d, int* _e, int* lab, int* ptn, int* n_auts, int** auts,
+                   int* orbits, double* grpsize1, int* grpsize2, int* numorbits, size_t* stats, int engine, int* invariant, int timed)
+{
+	/* As canonize(), with the workspace of c. The generators are returned
+	   in a buffer of c, which stays valid until the next call with c
+	   (it is not released with free_auts()). A canonizer must not be used
+	   by several threads at once. */
+	set_invariant(c, invariant);
+	if (!canonizer_reserve(c, _nv, _nde, engine == NAUTYPY_DENSE))
+	{
+		*n_auts = -1;
+		*auts = c->ctx.auts;
+		return;
+	}
+	c->ctx.len = 0;
+	c->ctx.failed = 0;
+	current_ctx = &c->ctx;
+	canonize_one(c, _nv, _nde, _v, _d, _e, lab, ptn, n_auts, orbits, grpsize1, grpsize2, numorbits, stats, engine, timed);
+	current_ctx = NULL;
+	*auts = c->ctx.auts;
+}
+
+void free_auts(int* auts)
+{
+	free(auts);
 }
@@ -0,0 +1,77 @@
+#! /usr/bin/python3
+import numpy as np
+import scipy.stats as stat
+import nautypy as nty
+from time import perf_counter
+from random_graphs import random_multigraph, randomize_colors
+from prettytable import PrettyTable
+
+""" Benchmark of the multigraph embeddings of ``nautypy._embed_multigraph``.
+
+Random multigraphs are canonized with the ``"edges"``, ``"bundled"`` and
+``"layered"`` embeddings while one parameter at a time is varied from the
+baseline below: the number of extra (loop-forming) edges, the number of
+edge/vertex colors, and the multiplicity with which every extra edge is
+repeated. For each embedding, the mean host graph order and the throughput
+of ``nautypy.canonize_many`` are tabulated.
+
+The edge embedding grows with the number of edges, the bundled embedding
+with the number of adjacent vertex pairs, and the layered embedding with
+the number of vertices times log2 of the number of distinct bundle colors.
+"""
+
+#==========[Options/Parameters]==========#
+fixed_seed = True
+ngraphs = 200
+#Number of vertices
+nv = 20
+#Baseline number of extra edges, colors and multiplicity
+nloops = 40
+ncolors = 3
+multiplicity = 1
+#Values swept for each parameter
+sweeps = {'nloops':[10,40,160],
+          'ncolors':[1,3,6],
+          'multiplicity':[1,2,4]}
+embeddings = ["edges","bundled","layered"]
+#=========================================#
+
+seed = 12345 if fixed_seed else int(perf_counter()*1e6)
+rng = np.random.default_rng(seed)
+tree_rv = stat.expon(loc=0,scale=1)
+tree_rv.random_state = rng
+
+
+def random_graphs(nloops, ncolors, multiplicity):
+    colors = [f"c{i}" for i in range(ncolors)]
+    graphs = []
+    for i in range(ngraphs):
+        mg = random_multigraph(nv,tree_rv,nloops,rng)
+        randomize_colors(mg,colors,rng)
+        #Repeat the extra edges (those beyond the spanning tree).
+        extra = list(mg.edges(data=True))[nv-1:]
+        for m in range(multiplicity-1):
+            for a,b,attrs in extra:
+                mg.add_edge(a,b,**attrs)
+        graphs.append(mg)
+    return graphs
+
+
+columns = ["parameter","value"]
+for embedding in embeddings:
+    columns += [f"{embedding} order", f"{embedding} graphs/s"]
+table = PrettyTable(columns)
+for parameter,values in sweeps.items():
+    for value in values:
+        params = {'nloops':nloops, 'ncolors':ncolors, 'multiplicity':multiplicity, parameter:value}
+        graphs = random_graphs(**params)
+        row = [parameter, value]
+        for embedding in embeddings:
+            order = np.mean([nty._prepare_multigraph(mg,embedding=embedding)[1].order()
+                             for mg in graphs])
+            start = perf_counter()
+            nty.canonize_many(graphs,embedding=embedding)
+            elapsed = perf_counter()-start
+            row += [f"{order:.1f}", f"{ngraphs/elapsed:.1f}"]
+        table.add_row(row)
+print(table)
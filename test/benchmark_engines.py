@@ -0,0 +1,86 @@
+#! /usr/bin/python3
+import numpy as np
+import scipy.stats as stat
+import networkx as nx
+import nautypy as nty
+from time import perf_counter
+from random_graphs import random_multigraph, randomize_colors
+from prettytable import PrettyTable
+
+""" Benchmark matrix of the NAUTY engines of ``nautypy.canonize_arrays``.
+
+Graphs of several families and orders are canonized by ``sparsenauty``
+(``"sparse"``), ``densenauty`` (``"dense"``) and Traces (``"traces"``),
+and the mean time per canonization is tabulated, together with the engine
+picked by ``"auto"`` and the winning engine. Only the NAUTY call is timed:
+the graphs are converted to NAUTY sparse format beforehand.
+
+* ``host``: the host graph (``"edges"`` embedding) of a random multigraph with
+  ``nv`` vertices and ``2*nv`` extra edges, the typical input of nautypy.
+* ``gnp``: an Erdos-Renyi graph with edge probability ``p``.
+* ``regular``: a random 3-regular graph.
+* ``paley``: the Paley graph of the largest prime order ``q=1 mod 4`` not above ``n``
+  (strongly regular, with a large automorphism group).
+* ``grid``: a square grid graph.
+
+The thresholds of ``"auto"`` are set in ``nautypy._select_engine``.
+"""
+
+#==========[Options/Parameters]==========#
+fixed_seed = True
+#Graph orders
+orders = [16,32,64,128,256,512]
+#Repetitions per graph
+nreps = 5
+engines = ["sparse","dense","traces"]
+#=========================================#
+
+seed = 12345 if fixed_seed else int(perf_counter()*1e6)
+rng = np.random.default_rng(seed)
+tree_rv = stat.expon(loc=0,scale=1)
+tree_rv.random_state = rng
+
+
+def host(n):
+    nv = max(n//4,2)
+    mg = random_multigraph(nv,tree_rv,2*nv,rng)
+    randomize_colors(mg,['red','green','blue'],rng)
+    mg, g_z, input_to_zero, lab, ptn = nty._prepare_multigraph(mg)
+    return g_z, lab, ptn
+
+
+def uncolored(g):
+    g = nx.convert_node_labels_to_integers(g)
+    return g, list(range(g.order())), [1]*(g.order()-1)+[0]
+
+
+def paley(n):
+    q = max(p for p in range(5,n+1) if p%4==1 and all(p%k for k in range(2,p)))
+    squares = {(x*x)%q for x in range(1,q)}
+    return nx.Graph((a,b) for a in range(q) for b in range(a+1,q) if (b-a)%q in squares)
+
+
+families = {'host':host,
+            'gnp p=0.1':lambda n: uncolored(nx.gnp_random_graph(n,0.1,seed=int(rng.integers(2**31)))),
+            'gnp p=0.5':lambda n: uncolored(nx.gnp_random_graph(n,0.5,seed=int(rng.integers(2**31)))),
+            'regular':lambda n: uncolored(nx.random_regular_graph(3,n,seed=int(rng.integers(2**31)))),
+            'paley':lambda n: uncolored(paley(n)),
+            'grid':lambda n: uncolored(nx.grid_2d_graph(int(n**0.5),int(n**0.5)))}
+
+table = PrettyTable(["family","n","density"]+[f"{engine} ms" for engine in engines]+["winner","auto"])
+for family,make in families.items():
+    for n in orders:
+        g, lab, ptn = make(n)
+        v, d, e = nty._sparse_arrays(g)
+        nv = len(d)
+        density = len(e)/max(nv*(nv-1),1)
+        times = {}
+        for engine in engines:
+            start = perf_counter()
+            for rep in range(nreps):
+                nty.canonize_arrays(v,d,e,lab,ptn,engine=engine)
+            times[engine] = 1e3*(perf_counter()-start)/nreps
+        auto = [name for name,number in nty._engines.items() if number==nty._select_engine("auto",nv,len(e))][0]
+        table.add_row([family, nv, f"{density:.3f}"]+[f"{times[engine]:.3f}" for engine in engines]
+                      +[min(times,key=times.get), auto])
+print(table)
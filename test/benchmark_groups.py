@@ -0,0 +1,69 @@
+#! /usr/bin/python3
+import numpy as np
+import networkx as nx
+import nautypy as nty
+from time import perf_counter
+from sympy.combinatorics import Permutation, PermutationGroup
+from sympy.combinatorics.named_groups import SymmetricGroup
+from prettytable import PrettyTable
+
+""" Benchmark of ``nautypy.groups`` against the sympy path of ``comparison.py``.
+
+The automorphism generators of a few highly symmetric graphs are turned
+into permutation groups, both by ``sympy.combinatorics.PermutationGroup``
+and by ``nautypy.groups.PermutationGroup``. For each graph, the time to
+build the group and compute its order, to test the membership of random
+permutations, and to compute the coset representatives of random canonical
+maps (``SymmetricGroup._coset_representative`` in sympy) is tabulated.
+"""
+
+#==========[Options/Parameters]==========#
+fixed_seed = True
+#Number of membership tests and coset representatives per graph
+nqueries = 50
+graphs = {'cycle C_24':nx.cycle_graph(24),
+          'complete K_10':nx.complete_graph(10),
+          'hypercube Q_5':nx.convert_node_labels_to_integers(nx.hypercube_graph(5)),
+          'Petersen':nx.petersen_graph(),
+          'grid 6x6':nx.convert_node_labels_to_integers(nx.grid_2d_graph(6,6)),
+          'star K_1,12':nx.star_graph(12)}
+#=========================================#
+
+seed = 12345 if fixed_seed else int(perf_counter()*1e6)
+rng = np.random.default_rng(seed)
+
+
+def timed(f):
+    start = perf_counter()
+    result = f()
+    return result, perf_counter()-start
+
+
+table = PrettyTable(["graph","order","sympy order s","native order s",
+                     "sympy member ms","native member ms","sympy coset ms","native coset ms"])
+for name,g in graphs.items():
+    g_canonical, g_autgens, g_canonical_map = nty.canonize_simple_graph(g)
+    n = g.order()
+    perms, nodes = nty.groups.as_permutations(g_autgens, nodes=sorted(g.nodes))
+    queries = [rng.permutation(n) for i in range(nqueries)]
+    #Group construction and order.
+    sympy_group, sympy_time = timed(lambda: PermutationGroup([Permutation(p.tolist()) for p in perms]))
+    sympy_order, t = timed(sympy_group.order)
+    sympy_time += t
+    native_group, native_time = timed(lambda: nty.groups.PermutationGroup(perms, degree=n))
+    native_order, t = timed(native_group.order)
+    native_time += t
+    assert sympy_order==native_order
+    #Membership of random elements of the group and of random permutations.
+    members = [native_group.random_element(rng) for i in range(nqueries)]
+    sympy_member = timed(lambda: [sympy_group.contains(Permutation(p.tolist())) for p in members+queries])
+    native_member = timed(lambda: [native_group.contains(p) for p in members+queries])
+    assert sympy_member[0]==native_member[0]
+    #Coset representatives.
+    symmetric = SymmetricGroup(n)
+    sympy_coset = timed(lambda: [symmetric._coset_representative(Permutation(p.tolist()), sympy_group) for p in queries])
+    native_coset = timed(lambda: [native_group.coset_representative(p) for p in queries])
+    table.add_row([name, native_order, f"{sympy_time:.4f}", f"{native_time:.4f}",
+                   f"{1e3*sympy_member[1]/(2*nqueries):.3f}", f"{1e3*native_member[1]/(2*nqueries):.3f}",
+                   f"{1e3*sympy_coset[1]/nqueries:.3f}", f"{1e3*native_coset[1]/nqueries:.3f}"])
+print(table)
@@ -0,0 +1,54 @@
+#! /usr/bin/python3
+import os
+import numpy as np
+import scipy.stats as stat
+import nautypy as nty
+from time import perf_counter
+from random_graphs import random_multigraph, randomize_colors
+from prettytable import PrettyTable
+
+""" Scaling benchmark for ``nautypy.canonize_many``.
+
+A fixed set of random multigraphs is canonized with 1 (serial, one
+batched call to NAUTY) to ``os.cpu_count()`` worker processes. Wall
+times, throughput and speedup relative to the serial batch are tabulated.
+
+Since graph preparation and result construction stay in the calling
+process, speedup is bounded by the share of time spent inside NAUTY,
+which grows with host graph size and symmetry. Increase ``nv`` and
+``nloops`` (or reduce the number of colors) to see the pool pay off.
+"""
+
+#==========[Options/Parameters]==========#
+fixed_seed = True
+ngraphs = 2000
+#Number of vertices
+nv=30
+#Number of loops
+nloops = 60
+#Edge/vertex colors
+colors = ['red','green','blue']
+#Graphs per worker task
+chunksize = 64
+#=========================================#
+
+seed = 12345 if fixed_seed else int(perf_counter()*1e6)
+rng = np.random.default_rng(seed)
+tree_rv = stat.expon(loc=0,scale=1)
+tree_rv.random_state = rng
+
+graphs = []
+for i in range(ngraphs):
+    mg = random_multigraph(nv,tree_rv,nloops,rng)
+    randomize_colors(mg,colors,rng)
+    graphs.append(mg)
+
+table = PrettyTable(["workers","time (s)","graphs/s","speedup"])
+for workers in range(1,os.cpu_count()+1):
+    start = perf_counter()
+    nty.canonize_many(graphs,workers=workers,chunksize=chunksize)
+    elapsed = perf_counter()-start
+    if workers==1:
+        serial = elapsed
+    table.add_row([workers,f"{elapsed:.3f}",f"{ngraphs/elapsed:.1f}",f"{serial/elapsed:.2f}"])
+print(table)
@@ -0,0 +1,249 @@
+#! /usr/bin/python3
+import sys
+import gc
+import json
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from time import perf_counter
+import numpy as np
+import scipy.stats as stat
+import networkx as nx
+import nautypy as nty
+from hashable_containers import hmap, hlist, HMultiGraph
+from random_graphs import random_multigraph, randomize_colors, random_isomorph
+from prettytable import PrettyTable
+
+""" Stage-level benchmark of ``nautypy.canonize_multigraph``.
+
+Each random multigraph is canonized stage by stage, with the same internal
+functions ``nautypy.canonize_multigraph`` calls, and every stage is timed
+separately:
+
+* ``relabel``: zero-indexing of the nodes (``input_to_zero``, ``nx.relabel_nodes``).
+* ``embed``: ``nautypy._embed_multigraph``.
+* ``partition``: ``nautypy._get_color_partition``.
+* ``marshal``: conversion of the host graph to NAUTY sparse format and cffi buffers
+  (``nautypy._sparse_arrays``), and of the NAUTY output back to ``hmap``/``hlist``.
+* ``nauty``: the call to ``_nautypy.lib.canonize`` alone.
+* ``reconstruct``: ``nautypy._finish_multigraph`` (canonical map, generators and canonical isomorph).
+
+Starting from the baseline below, one parameter at a time is swept: the
+number of vertices, the multiplicity of the extra (loop-forming) edges, the
+number of colors, and the symmetry of the graphs (``random``: random trees
+plus random edges; ``necklace``: a cycle with periodically colored, repeated
+edges; ``complete``: a uniformly colored complete multigraph). Every graph is
+canonized as a random isomorph (``random_isomorph``), ``nreps`` times; the
+fastest repetition of each stage is kept, and the median and mean over the
+graphs are reported in microseconds.
+
+Results are printed and written as JSON (``benchmark_stages.json`` by
+default), together with the commit and the environment, so that runs can be
+compared across commits::
+
+    python3 benchmark_stages.py -o before.json
+    (check out another commit and rebuild)
+    python3 benchmark_stages.py -o after.json --compare before.json
+
+The comparison tabulates the ratio of the median times, and flags stages
+slower than ``--threshold`` (default 1.2).
+"""
+
+#==========[Options/Parameters]==========#
+fixed_seed = True
+#Graphs per configuration, and repetitions per graph
+ngraphs = 50
+nreps = 5
+#Baseline
+baseline = {'nv':20, 'multiplicity':1, 'ncolors':3, 'symmetry':'random'}
+#Values swept for each parameter
+sweeps = {'nv':[10,20,40,80],
+          'multiplicity':[1,2,4],
+          'ncolors':[1,3,6],
+          'symmetry':['random','necklace','complete']}
+embedding = "edges"
+stages = ["relabel","embed","partition","marshal","nauty","reconstruct"]
+#=========================================#
+
+seed = 12345 if fixed_seed else int(perf_counter()*1e6)
+rng = np.random.default_rng(seed)
+tree_rv = stat.expon(loc=0,scale=1)
+tree_rv.random_state = rng
+
+
+def random_graph(nv, multiplicity, ncolors, symmetry):
+    colors = [f"c{i}" for i in range(ncolors)]
+    if symmetry=="random":
+        mg = random_multigraph(nv,tree_rv,nv,rng)
+        randomize_colors(mg,colors,rng)
+        #Repeat the extra edges (those beyond the spanning tree).
+        extra = list(mg.edges(data=True))[nv-1:]
+    elif symmetry=="necklace":
+        mg = nx.MultiGraph()
+        mg.add_nodes_from(range(nv), color=colors[0])
+        for i in range(nv):
+            mg.add_edge(i,(i+1)%nv,color=colors[i%ncolors])
+        extra = list(mg.edges(data=True))
+    elif symmetry=="complete":
+        mg = nx.MultiGraph(nx.complete_graph(nv))
+        nx.set_node_attributes(mg,colors[0],'color')
+        nx.set_edge_attributes(mg,colors[-1],'color')
+        extra = list(mg.edges(data=True))
+    else:
+        raise ValueError(f"unknown symmetry {symmetry!r}")
+    for m in range(multiplicity-1):
+        for a,b,attrs in extra:
+            mg.add_edge(a,b,**attrs)
+    return HMultiGraph(random_isomorph(mg,rng)[0])
+
+
+def canonize_stages(mg):
+    """Canonize ``mg`` as :func:`nautypy.canonize_multigraph` does, timing every stage.
+
+    Returns:
+        2-element tuple: the result of :func:`nautypy.canonize_multigraph`, and a dict of stage times in seconds.
+
+    """
+
+    times = {}
+    start = perf_counter()
+    input_to_zero = {node:index for index,node in enumerate(sorted(mg.nodes.keys()))}
+    mg_z = HMultiGraph(nx.relabel_nodes(mg,input_to_zero,copy=True))
+    times['relabel'] = perf_counter()-start
+
+    start = perf_counter()
+    g_z = nty._embed_multigraph(mg_z, embedding=embedding)
+    times['embed'] = perf_counter()-start
+
+    start = perf_counter()
+    lab, ptn = nty._get_color_partition(g_z, color_sort_conditions=[('type','vertex')])
+    times['partition'] = perf_counter()-start
+
+    start = perf_counter()
+    v, d, e = nty._sparse_arrays(g_z)
+    lab = np.array(lab, dtype=np.intc)
+    ptn = np.array(ptn, dtype=np.intc)
+    nv = len(d)
+    n_auts = nty.ffi.new("int*")
+    auts = nty.ffi.new("int**")
+    orbits = np.empty(nv, dtype=np.intc)
+    grpsize1 = nty.ffi.new("double*")
+    grpsize2 = nty.ffi.new("int*")
+    numorbits = nty.ffi.new("int*")
+    stats = np.zeros(nty.lib.NAUTYPY_N_STATS, dtype=np.uintp)
+    args = (nv, len(e), nty.ffi.from_buffer("size_t[]",v), nty.ffi.from_buffer("int[]",d),
+            nty.ffi.from_buffer("int[]",e), nty.ffi.from_buffer("int[]",lab), nty.ffi.from_buffer("int[]",ptn),
+            n_auts, auts, nty.ffi.from_buffer("int[]",orbits), grpsize1, grpsize2, numorbits,
+            nty.ffi.from_buffer("size_t[]",stats), nty.lib.NAUTYPY_SPARSE, nty.ffi.NULL, 0)
+    times['marshal'] = perf_counter()-start
+
+    start = perf_counter()
+    nty.lib.canonize(*args)
+    times['nauty'] = perf_counter()-start
+
+    start = perf_counter()
+    autgens = nty._unpack_auts(auts[0], n_auts[0]*nv).reshape(n_auts[0],nv)
+    g_z_canonical_map = hmap(enumerate(lab.tolist()))
+    g_z_autgens = hlist(hmap(enumerate(aut)) for aut in autgens.tolist())
+    times['marshal'] += perf_counter()-start
+
+    start = perf_counter()
+    result = nty._finish_multigraph(mg, input_to_zero, g_z_canonical_map, g_z_autgens)
+    times['reconstruct'] = perf_counter()-start
+    return result, times
+
+
+def run():
+    results = []
+    for parameter,values in sweeps.items():
+        for value in values:
+            params = {**baseline, parameter:value}
+            graphs = [random_graph(**params) for i in range(ngraphs)]
+            #Check the staged canonization against the library.
+            for mg in graphs[:3]:
+                assert canonize_stages(mg)[0][2]==nty.canonize_multigraph(mg)[2]
+            best = {stage:np.full(ngraphs, np.inf) for stage in stages}
+            #As in timeit, keep the garbage collector from interrupting the stages.
+            gc.collect()
+            gc.disable()
+            for rep in range(nreps):
+                for i,mg in enumerate(graphs):
+                    times = canonize_stages(mg)[1]
+                    for stage in stages:
+                        best[stage][i] = min(best[stage][i], times[stage])
+            gc.enable()
+            total = sum(best.values())
+            host_order = np.mean([nty._embed_multigraph(mg, embedding=embedding).order() for mg in graphs])
+            results.append({'parameter':parameter, 'value':value, 'params':params,
+                            'host_order':float(host_order),
+                            'stages':{stage:{'median_us':1e6*float(np.median(t)), 'mean_us':1e6*float(np.mean(t))}
+                                      for stage,t in list(best.items())+[('total',total)]}})
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git","rev-parse","HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit':commit,
+            'date':datetime.now(timezone.utc).isoformat(),
+            'python':sys.version.split()[0],
+            'numpy':np.__version__,
+            'networkx':nx.__version__,
+            'platform':platform.platform(),
+            'thread_safe':bool(nty.lib.thread_safe()),
+            'seed':seed, 'ngraphs':ngraphs, 'nreps':nreps, 'embedding':embedding}
+
+
+def print_results(results):
+    table = PrettyTable(["parameter","value","host order"]+[f"{stage} us" for stage in stages+["total"]])
+    for result in results:
+        table.add_row([result['parameter'], result['value'], f"{result['host_order']:.1f}"]
+                      +[f"{result['stages'][stage]['median_us']:.1f}" for stage in stages+["total"]])
+    print(table)
+
+
+def compare(results, baseline_results, threshold):
+    """Tabulate the ratios of the median stage times of ``results`` to those of ``baseline_results``.
+
+    Returns:
+        int: the number of stages slower than ``threshold`` times the baseline.
+
+    """
+
+    old = {(r['parameter'],r['value']):r for r in baseline_results}
+    table = PrettyTable(["parameter","value"]+[f"{stage} x" for stage in stages+["total"]])
+    regressions = 0
+    for result in results:
+        key = (result['parameter'],result['value'])
+        if key not in old:
+            continue
+        row = [result['parameter'], result['value']]
+        for stage in stages+["total"]:
+            ratio = result['stages'][stage]['median_us']/max(old[key]['stages'][stage]['median_us'],1e-9)
+            regressions += ratio>threshold
+            row.append(f"{ratio:.2f}"+(" !" if ratio>threshold else ""))
+        table.add_row(row)
+    print(table)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stage-level benchmark of nautypy.canonize_multigraph.")
+    parser.add_argument("-o", "--output", default="benchmark_stages.json", help="JSON file for the results")
+    parser.add_argument("--compare", default=None, help="JSON file of a baseline run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio flagged as a regression")
+    args = parser.parse_args()
+
+    results = run()
+    print_results(results)
+    with open(args.output, "w") as f:
+        json.dump({'metadata':metadata(), 'results':results}, f, indent=1)
+    if args.compare!=None:
+        with open(args.compare) as f:
+            baseline_run = json.load(f)
+        print(f"Ratios to {args.compare} (commit {baseline_run['metadata']['commit']}):")
+        regressions = compare(results, baseline_run['results'], args.threshold)
+        sys.exit(1 if regressions else 0)
@@ -8,6 +8,10 @@ from time import time
 from random_graphs import random_multigraph, randomize_colors, random_isomorph,recolor_random_vertex, recolor_random_edge
 from comparison import colstate, compare
 import pytest
+import pickle
+import itertools
+import copy
+from hashable_containers import hmap, fhmap, HMultiGraph, FrozenHGraph, FrozenHMultiGraph, freeze
 
 """
 Testing setup and function defs for pytest.
@@ -71,3 +75,576 @@ def test_edge_recoloring(mg):
     e_mg = nx.MultiGraph(mg)
     recolor_random_edge(e_mg,colors,rng)
     estate, data, edge_graphs = compare(mg,e_mg,verbose=verbose)
+
+def test_canonize_many():
+    """Batched canonization agrees with graph-by-graph canonization."""
+    batch = nty.canonize_many(random_multigraphs)
+    for mg,(mg_canonical,mg_autgens,mg_canonical_map) in zip(random_multigraphs,batch):
+        ref_canonical,ref_autgens,ref_canonical_map = nty.canonize_multigraph(mg)
+        assert nx.utils.graphs_equal(mg_canonical,ref_canonical)
+        assert mg_autgens==ref_autgens
+        assert mg_canonical_map==ref_canonical_map
+
+def test_canonize_arrays():
+    """Array-level canonization of a hexagon: generators are automorphisms."""
+    n = 6
+    v = np.arange(0,2*n,2,dtype=np.uintp)
+    d = np.full(n,2,dtype=np.intc)
+    e = np.array([[(i-1)%n,(i+1)%n] for i in range(n)],dtype=np.intc).ravel()
+    lab, autgens = nty.canonize_arrays(v,d,e,np.arange(n),[1]*(n-1)+[0])
+    assert sorted(lab.tolist())==list(range(n))
+    assert autgens.shape[1]==n and autgens.shape[0]>0
+    edges = {frozenset((i,(i+1)%n)) for i in range(n)}
+    for aut in autgens:
+        assert {frozenset((aut[i],aut[j])) for i,j in map(tuple,edges)}==edges
+
+@pytest.mark.parametrize("mg",random_multigraphs)
+def test_certificate(mg):
+    """Certificates agree with canonical isomorphs on isomorphism."""
+    mg_canonical = nty.canonize_multigraph(mg)[0]
+    mg_perm,label_map = random_isomorph(mg,rng)
+    assert nty.certificate_multigraph(mg)==nty.certificate_multigraph(mg_perm)
+    v_mg = nx.MultiGraph(mg)
+    recolor_random_vertex(v_mg,colors,rng)
+    v_iso = nx.utils.graphs_equal(mg_canonical,nty.canonize_multigraph(v_mg)[0])
+    assert (nty.certificate(mg)==nty.certificate(v_mg))==v_iso
+    e_mg = nx.MultiGraph(mg)
+    recolor_random_edge(e_mg,colors,rng)
+    e_iso = nx.utils.graphs_equal(mg_canonical,nty.canonize_multigraph(e_mg)[0])
+    assert (nty.certificate(mg,digest_size=16)==nty.certificate(e_mg,digest_size=16))==e_iso
+    #Simple graphs
+    g = nx.Graph(mg)
+    g.remove_edges_from(list(nx.selfloop_edges(g)))
+    g_perm = nx.relabel_nodes(g,label_map,copy=True)
+    assert nty.certificate(g)==nty.certificate(g_perm)
+
+def test_classify():
+    """Random multigraphs and their random isomorphs fall into common classes."""
+    def stream():
+        for mg in random_multigraphs:
+            yield mg
+            yield random_isomorph(mg,rng)[0]
+    n_classes = len({nty.certificate_multigraph(mg) for mg in random_multigraphs})
+    classes = nty.classify(stream(),keep='members')
+    assert len(classes)==n_classes
+    assert classes.n_graphs==2*len(random_multigraphs)
+    for class_id,representative,count,members in classes:
+        assert count%2==0 and len(members)==count
+        assert classes.class_id(representative)==class_id
+    counts = nty.classify(stream(),keep='count',digest_size=16)
+    assert [c[2] for c in counts]==[c[2] for c in classes]
+    assert all(c[1]==None and c[3]==None for c in counts)
+
+def test_canonize_many_workers():
+    """The process pool backend agrees with the serial batch, in and out of order."""
+    serial = nty.canonize_many(random_multigraphs)
+    pooled = nty.canonize_many(iter(random_multigraphs),workers=2,chunksize=16)
+    assert len(pooled)==len(serial)
+    for (s_canonical,s_autgens,s_map),(p_canonical,p_autgens,p_map) in zip(serial,pooled):
+        assert nx.utils.graphs_equal(s_canonical,p_canonical)
+        assert s_autgens==p_autgens and s_map==p_map
+    unordered = dict(nty.canonize_many(random_multigraphs,workers=2,chunksize=16,ordered=False))
+    assert [unordered[i][2] for i in range(len(serial))]==[s[2] for s in serial]
+
+def test_canonize_many_threads():
+    """The thread pool backend agrees with the serial batch."""
+    serial = nty.canonize_many(random_multigraphs)
+    threaded = nty.canonize_many(random_multigraphs,workers=3,chunksize=8,backend="threads")
+    assert [t[2] for t in threaded]==[s[2] for s in serial]
+    assert [t[1] for t in threaded]==[s[1] for s in serial]
+
+def test_canon_cache():
+    """Cache hits reproduce uncached results; LRU eviction respects maxsize."""
+    cache = nty.CanonCache(maxsize=len(random_multigraphs)//2)
+    for mg in random_multigraphs+random_multigraphs[::-1]:
+        cached = nty.canonize_multigraph(mg,cache=cache)
+        ref = nty.canonize_multigraph(mg)
+        assert nx.utils.graphs_equal(cached[0],ref[0])
+        assert cached[1]==ref[1] and cached[2]==ref[2]
+    assert len(cache)==cache.maxsize
+    assert cache.hits==cache.maxsize
+    assert cache.misses==2*len(random_multigraphs)-cache.maxsize
+    assert cache.evictions==cache.misses-cache.maxsize
+    g = nx.Graph(random_multigraphs[0])
+    g.remove_edges_from(list(nx.selfloop_edges(g)))
+    nty.canonize_simple_graph(g,cache=cache)
+    nty.canonize_simple_graph(nx.Graph(g),cache=cache)
+    assert cache.hits==cache.maxsize+1
+    small = nty.CanonCache(maxsize=None,max_bytes=1)
+    nty.canonize_simple_graph(g,cache=small)
+    assert len(small)==0 and small.evictions==1 and small.nbytes==0
+
+def test_color_types():
+    """Colors of equal value but different type are distinct, whatever order they are seen in."""
+    def path(*weights):
+        g = nx.Graph()
+        for node,w in enumerate(weights):
+            g.add_node(node,w=w)
+        g.add_edges_from(zip(range(len(weights)-1),range(1,len(weights))))
+        return g
+    probe = nty.intern_color({'probe':0})
+    certs = [nty.certificate(path(w,w)) for w in [1.0,True,1]]
+    assert len(set(certs))==3 and nty.certificate(path(1.0,1.0))==certs[0]
+    assert nty.certificate(path(1,1.0))==nty.certificate(path(1.0,1))!=certs[2]
+    #Canonizing networkx graphs does not grow the color registry.
+    nty.canonize_multigraph(nx.MultiGraph(path(2.5,"x")))
+    assert nty.intern_color({'probe':1})==probe+1
+    cmg = nty.CompactMultiGraph.from_networkx(path(1,1.0))[0]
+    assert [type(w) for w in nx.get_node_attributes(cmg.to_networkx(),'w').values()]==[int,float]
+
+
+def test_certificate_store(tmp_path):
+    """Classes persist across stores, and merged stores add up their counts."""
+    half = len(random_multigraphs)//2
+    classes = nty.classify(random_multigraphs,digest_size=16)
+    with nty.CertificateStore(str(tmp_path/"a.db"),digest_size=16) as a:
+        nty.classify(random_multigraphs[:half],store=a)
+        known = len(a)
+    with nty.CertificateStore(str(tmp_path/"a.db"),digest_size=16) as a:
+        assert len(a)==known
+        nty.classify(random_multigraphs[half:],digest_size=16).save(a)
+        assert len(a)==len(classes)
+        assert a.class_ids(random_multigraphs)==a.lookup(classes.key(mg) for mg in random_multigraphs)
+        assert sum(count for class_id,rep,count in a)==len(random_multigraphs)
+        for class_id,rep,count in a:
+            assert a.class_ids([rep])==[class_id]
+    with nty.CertificateStore(str(tmp_path/"b.db"),digest_size=16) as b:
+        nty.classify(random_multigraphs,store=b)
+        b.merge(str(tmp_path/"a.db"))
+        assert len(b)==len(classes)
+        assert sum(count for class_id,rep,count in b)==2*len(random_multigraphs)
+    with pytest.raises(ValueError):
+        nty.CertificateStore(str(tmp_path/"b.db"))
+    #Representatives are stored as JSON, and read back without unpickling.
+    with nty.CertificateStore(str(tmp_path/"c.db")) as c:
+        g = nx.MultiGraph(name="g")
+        g.add_node((0,1),color="red",w=1.0)
+        g.add_edge((0,1),2,key=5,color=(1,True,None))
+        c.add([b"k"],representatives=[g])
+        assert c.conn.execute("SELECT typeof(representative) FROM classes").fetchone()[0]=="text"
+        rep = c.representative(1)
+        assert nx.utils.graphs_equal(rep,g) and list(rep.edges(keys=True))==[((0,1),2,5)]
+        assert type(rep.nodes[(0,1)]['w']) is float and rep.graph['name']=="g"
+
+@pytest.mark.parametrize("embedding",["edges","bundled","layered"])
+def test_embedding_colors(embedding):
+    """Multigraphs differing only in the values of their edge colors are told apart by every embedding."""
+    graphs = []
+    for colors in [["red"],["blue"],["red","red"],["red","blue"],["blue","blue"]]:
+        for loop in [None,"red","blue"]:
+            mg = nx.MultiGraph()
+            mg.add_edges_from((0,1,{'color':color}) for color in colors)
+            mg.add_edge(2,1,color="red")
+            if loop!=None:
+                mg.add_edge(2,2,color=loop)
+            graphs.append(mg)
+    certs = [nty.certificate_multigraph(mg,embedding=embedding) for mg in graphs]
+    assert len(set(certs))==len(graphs)
+    assert len(nty.classify(graphs+[random_isomorph(mg,rng)[0] for mg in graphs]))==len(graphs)
+    canonical = [nty.canonize_multigraph(mg,embedding=embedding)[0] for mg in graphs]
+    assert not any(nx.utils.graphs_equal(a,b) for a,b in itertools.combinations(canonical,2))
+
+
+@pytest.mark.parametrize("embedding",["bundled","layered"])
+@pytest.mark.parametrize("mg",random_multigraphs[:20])
+def test_embeddings(mg,embedding):
+    """Alternative embeddings separate isomorphism classes exactly as the edge embedding does."""
+    mg_perm,label_map = random_isomorph(mg,rng)
+    e_mg = nx.MultiGraph(mg)
+    recolor_random_edge(e_mg,colors,rng)
+    canonical,autgens,canonical_map = nty.canonize_multigraph(mg,embedding=embedding)
+    perm_canonical = nty.canonize_multigraph(mg_perm,embedding=embedding)[0]
+    assert nx.utils.graphs_equal(canonical,perm_canonical)
+    def edge_multiset(g):
+        return sorted((tuple(sorted((a,b))),sorted(attrs.items())) for a,b,attrs in g.edges(data=True))
+    inverse = {v:k for k,v in canonical_map.items()}
+    assert edge_multiset(canonical)==edge_multiset(nx.relabel_nodes(mg,inverse))
+    for gen in autgens:
+        assert edge_multiset(nx.relabel_nodes(mg,gen))==edge_multiset(mg)
+        assert all(mg.nodes[gen[v]]==mg.nodes[v] for v in mg)
+    cert = nty.certificate_multigraph(mg,embedding=embedding)
+    assert cert==nty.certificate_multigraph(mg_perm,embedding=embedding)
+    assert ((cert==nty.certificate_multigraph(e_mg,embedding=embedding))
+            ==(nty.certificate_multigraph(mg)==nty.certificate_multigraph(e_mg)))
+
+@pytest.mark.parametrize("mg",random_multigraphs[:20])
+def test_compact_multigraph(mg):
+    """Compact canonization agrees with certificates on isomorphism and survives conversion and pickling."""
+    cmg,nodes = nty.CompactMultiGraph.from_networkx(mg)
+    assert nodes==sorted(mg.nodes)
+    assert nty.certificate_multigraph(cmg.to_networkx(nodes))==nty.certificate_multigraph(mg)
+    assert pickle.loads(pickle.dumps(cmg))==cmg
+    canonical,autgens,canonical_map = nty.canonize_compact(cmg)
+    assert canonical==nty.canonize_compact(canonical)[0]
+    mg_perm,label_map = random_isomorph(mg,rng)
+    assert nty.canonize_compact(nty.CompactMultiGraph.from_networkx(mg_perm)[0])[0]==canonical
+    e_mg = nx.MultiGraph(mg)
+    recolor_random_edge(e_mg,colors,rng)
+    e_canonical = nty.canonize_compact(nty.CompactMultiGraph.from_networkx(e_mg)[0])[0]
+    assert ((e_canonical==canonical)==(nty.certificate_multigraph(mg)==nty.certificate_multigraph(e_mg)))
+    assert hash(e_canonical)!=hash(canonical) or e_canonical==canonical
+    relabeled = nty.CompactMultiGraph(cmg.nv,np.argsort(canonical_map)[cmg.edges],
+                                      cmg.vertex_colors[canonical_map],cmg.edge_colors)
+    assert relabeled==canonical
+    for gen in autgens:
+        assert nty.CompactMultiGraph(cmg.nv,gen[cmg.edges],cmg.vertex_colors[np.argsort(gen)],cmg.edge_colors)==cmg
+
+def test_return_graph():
+    """Skipped and lazily constructed canonical isomorphs agree with the default."""
+    mg = random_multigraphs[0]
+    g = nx.Graph(mg)
+    g.remove_edges_from(list(nx.selfloop_edges(g)))
+    for canonize,graph in ((nty.canonize_multigraph,mg),(nty.canonize_simple_graph,g)):
+        canonical,autgens,canonical_map = canonize(graph)
+        assert canonize(graph,return_graph=False)==(None,autgens,canonical_map)
+        view,view_autgens,view_map = canonize(graph,return_graph="view")
+        assert view_autgens==autgens and view_map==canonical_map
+        assert len(view)==len(canonical) and set(view)==set(canonical)
+        assert nx.utils.graphs_equal(view.materialize(),canonical)
+        assert view.is_multigraph()==graph.is_multigraph()
+    batch = nty.canonize_many(random_multigraphs[:10],return_graph=False)
+    assert [b[2] for b in batch]==[nty.canonize_multigraph(mg)[2] for mg in random_multigraphs[:10]]
+    assert all(b[0]==None for b in batch)
+    with pytest.raises(ValueError):
+        nty.canonize_multigraph(mg,return_graph="maybe")
+
+def test_frozen_graphs():
+    """Frozen canonical isomorphs hash like their mutable counterparts and reject mutation."""
+    canonical = {}
+    for mg in random_multigraphs:
+        frozen = nty.canonize_multigraph(mg,return_graph="frozen")[0]
+        assert isinstance(frozen,FrozenHMultiGraph) and frozen.frozen
+        assert hash(frozen)==hash(HMultiGraph(nty.canonize_multigraph(mg)[0]))
+        canonical.setdefault(frozen,nty.certificate_multigraph(mg))
+        mg_perm = random_isomorph(mg,rng)[0]
+        assert canonical[nty.canonize_multigraph(mg_perm,return_graph="frozen")[0]]==nty.certificate_multigraph(mg)
+    assert len(canonical)==len({nty.certificate_multigraph(mg) for mg in random_multigraphs})
+    assert sorted(canonical)==sorted(canonical,key=lambda g:g.sort_key)
+    frozen = next(iter(canonical))
+    with pytest.raises(nx.NetworkXError):
+        frozen.add_edge(0,1)
+    with pytest.raises(TypeError):
+        frozen.nodes[0]['color'] = 'red'
+    assert pickle.loads(pickle.dumps(frozen))==frozen
+    assert nx.utils.graphs_equal(nty.canonize_multigraph(frozen)[0],nty.canonize_multigraph(nx.MultiGraph(frozen))[0])
+    color = fhmap(color='red',type='edge')
+    assert hash(color)==hash(hmap(color)) and color==hmap(color)
+    assert sorted([fhmap(a=2),fhmap(a=1)])==[{'a':1},{'a':2}]
+    g = FrozenHGraph(nx.path_graph(3))
+    assert g.copy()==g and hash(g.copy())==hash(g)
+
+
+@pytest.mark.parametrize("core",["edges","graph6"])
+def test_graph_codec(core,tmp_path):
+    """Graphs and multigraphs round-trip through the binary codec, directly and in archives, with their attribute types."""
+    import io
+    from hashable_containers import encode_graph, decode_graph, dump_graphs, load_graphs, GraphArchive
+    graphs = [HMultiGraph(nx.relabel_nodes(mg,int)) for mg in random_multigraphs[:20]]
+    mg = HMultiGraph(name='odd')
+    mg.add_edge('a','b',key='k',color='red')
+    mg.add_edge('a','b',color=('red',1))
+    mg.add_edge('b','b')
+    mg.add_node(('c',1),weights=[1,2],mass=-2.5,tags=frozenset({'x'}),z=1j,raw=b'\x00',big=-2**70)
+    #Equal attribute values of different types.
+    typed = HMultiGraph()
+    typed.add_nodes_from([(0,{'w':1}),(1,{'w':True}),(2,{'w':1.0}),(3,{'w':(1,)}),(4,{'w':(True,)})])
+    typed.add_edges_from([(0,1,{'w':True}),(1,2,{'w':1}),(2,3,{1.0:'w'}),(3,4,{True:'w'})])
+    graphs += [mg, typed, HMultiGraph(), FrozenHGraph(nx.petersen_graph()), freeze(graphs[0])]
+    types = lambda g: [(type(k),type(v),type(v[0]) if isinstance(v,tuple) else None)
+                       for attrs in [*g._node.values(),*(attrs for a,b,attrs in g.edges(data=True))]
+                       for k,v in attrs.items()]
+    for g in graphs:
+        decoded = decode_graph(encode_graph(g,core=core),type(g))
+        assert type(decoded) is type(g) and decoded==g and nx.utils.graphs_equal(decoded,g)
+        assert types(decoded)==types(g)
+        #Pickling and copying go through the codec.
+        for copied in [pickle.loads(pickle.dumps(g)),copy.deepcopy(g)]:
+            assert type(copied) is type(g) and copied==g and types(copied)==types(g)
+    with open(tmp_path/"archive","wb") as f:
+        assert dump_graphs(iter(graphs),f,core=core)==len(graphs)
+    with open(tmp_path/"archive","rb") as f:
+        assert list(load_graphs(f))==graphs
+    archive = GraphArchive((tmp_path/"archive").read_bytes())
+    assert len(archive)==len(graphs) and archive[-5]==mg and archive[3:5]==graphs[3:5]
+    assert list(archive)==graphs
+    with pytest.raises(EOFError):
+        GraphArchive((tmp_path/"archive").read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        encode_graph(nx.DiGraph([(0,1)]))
+    with pytest.raises(TypeError):
+        encode_graph(nx.Graph([(0,1,{'w':object()})]))
+
+
+def brute_force_multigraphs(vertex_colors, valences, edge_colors):
+    """All multigraphs with the given vertex colors, valences and edge colors, up to isomorphism."""
+    nv = len(vertex_colors)
+    slots = [(a,b,c) for a in range(nv) for b in range(a,nv) for c in range(len(edge_colors))]
+    classes = set()
+    for edges in itertools.combinations_with_replacement(slots,sum(valences)//2):
+        degrees = [0]*nv
+        for a,b,c in edges:
+            degrees[a] += 1
+            degrees[b] += 1
+        if degrees==list(valences):
+            mg = nx.MultiGraph()
+            mg.add_nodes_from((v,attrs) for v,attrs in enumerate(vertex_colors))
+            mg.add_edges_from((a,b,edge_colors[c]) for a,b,c in edges)
+            classes.add(nty.certificate_multigraph(mg))
+    return classes
+
+
+@pytest.mark.parametrize("vertex_colors,valences,edge_colors",[
+    ([{}]*4,[3]*4,[{}]),
+    ([{}]*4,[3]*4,[{'color':'red'},{'color':'blue'}]),
+    ([{'color':'red'}]*2+[{'color':'blue'}]*2,[1,3,2,4],[{'color':'red'},{'color':'blue'}]),
+])
+def test_generate_multigraphs(vertex_colors,valences,edge_colors):
+    """The orderly generator emits exactly one multigraph per isomorphism class."""
+    generated = [nty.certificate_multigraph(mg) for mg in nty.generate_multigraphs(vertex_colors,valences,edge_colors)]
+    assert len(generated)==len(set(generated))
+    assert set(generated)==brute_force_multigraphs(vertex_colors,valences,edge_colors)
+    compact = [cmg.to_networkx() for cmg in nty.generate_multigraphs(vertex_colors,valences,edge_colors,compact=True)]
+    assert [nty.certificate_multigraph(mg) for mg in compact]==generated
+    connected = list(nty.generate_multigraphs(vertex_colors,valences,edge_colors,loops=sum(valences)//2-len(valences)+1))
+    assert len(connected)==sum(nx.is_connected(mg) for mg in nty.generate_multigraphs(vertex_colors,valences,edge_colors))
+    assert all(nx.is_connected(mg) for mg in connected)
+    loopless = list(nty.generate_multigraphs(vertex_colors,valences,edge_colors,self_loops=False))
+    assert all(nx.number_of_selfloops(mg)==0 for mg in loopless)
+    with pytest.raises(ValueError):
+        next(nty.generate_multigraphs(vertex_colors,valences,edge_colors,loops=-1))
+
+
+@pytest.mark.parametrize("embedding",["edges","bundled","layered"])
+def test_group(embedding):
+    """Group orders and orbits from NAUTY agree with the group generated by the autgens."""
+    from sympy.combinatorics import Permutation, PermutationGroup
+    graphs = random_multigraphs[:20]+[nx.MultiGraph(nx.cycle_graph(6))]
+    batch = nty.canonize_many(graphs,embedding=embedding,group=True)
+    for mg,result in zip(graphs,batch):
+        mg_canonical,mg_autgens,mg_canonical_map,mg_group = nty.canonize_multigraph(mg,embedding=embedding,group=True)
+        nodes = sorted(mg.nodes)
+        index = {node:i for i,node in enumerate(nodes)}
+        autgp = PermutationGroup([Permutation([index[aut[node]] for node in nodes]) for aut in mg_autgens] or
+                                 [Permutation(len(nodes)-1)])
+        assert mg_group['order']==autgp.order()
+        assert mg_group['n_orbits']==len(autgp.orbits())
+        for orbit in autgp.orbits():
+            assert {mg_group['orbits'][nodes[i]] for i in orbit}=={nodes[min(orbit)]}
+        assert result[3]==mg_group
+    mg = nx.MultiGraph([(0,1),(0,1),(1,2),(1,2),(2,0),(1,1)])
+    assert nty.canonize_multigraph(mg,embedding=embedding,group=True)[3]['order']==2
+    c6_group = nty.canonize_simple_graph(nx.cycle_graph(6),group=True)[3]
+    assert c6_group.pop('stats')['numnodes']>0
+    assert c6_group=={'order':12,'orbits':dict.fromkeys(range(6),0),'n_orbits':1}
+
+
+def test_symmetry_factor():
+    """Symmetry factors of vacuum diagrams count edge permutations and self-loop flips."""
+    assert nty.symmetry_factor(nx.MultiGraph([(0,0),(0,0)]))==8
+    assert nty.symmetry_factor(nx.MultiGraph([(0,1)]*3))==12
+    assert nty.symmetry_factor(nx.MultiGraph([(0,0),(0,1),(1,1)]))==8
+    assert nty.symmetry_factor(nx.MultiGraph([(0,1)]*4))==48
+    assert nty.symmetry_factor(nx.MultiGraph([(0,1),(0,1),(0,0),(1,1)]))==16
+    mg = nx.MultiGraph([(0,1),(0,1)])
+    mg.edges[0,1,0]['color'] = 'red'
+    assert nty.symmetry_factor(mg)==2
+
+
+def test_permutation_groups():
+    """Stabilizer chains agree with sympy on random groups and on automorphism groups."""
+    from sympy.combinatorics import Permutation, PermutationGroup
+    for trial in range(100):
+        n = int(rng.integers(1,8))
+        gens = np.array([rng.permutation(n) for k in range(int(rng.integers(0,4)))],dtype=np.intc).reshape(-1,n)
+        group = nty.groups.PermutationGroup(gens,degree=n)
+        ref = PermutationGroup([Permutation(g.tolist()) for g in gens] or [Permutation(n-1)])
+        assert group.order()==ref.order()
+        assert group.orbits()==sorted(sorted(orbit) for orbit in ref.orbits())
+        elements = {tuple(g) for g in group.elements()}
+        assert len(elements)==group.order()
+        assert all(tuple(g) in elements for g in group.strong_generators)
+        perm = rng.permutation(n)
+        assert group.contains(perm)==ref.contains(Permutation(perm.tolist()))
+        assert tuple(group.random_element(rng)) in elements
+        reps = [tuple(r) for r in group.coset_representatives()]
+        assert len(set(reps))==len(reps)==np.prod(range(1,n+1))//group.order()
+        rep = group.coset_representative(perm)
+        assert tuple(rep)==min(tuple(perm[list(g)]) for g in elements) and tuple(rep) in reps
+    for mg in random_multigraphs[:20]:
+        mg_canonical,mg_autgens,mg_canonical_map,mg_group = nty.canonize_multigraph(mg,group=True)
+        group, nodes = nty.groups.PermutationGroup.from_autgens(mg_autgens,nodes=sorted(mg.nodes))
+        assert group.order()==mg_group['order']
+        #Canonical maps of isomorphs differ by an automorphism (see test/comparison.py).
+        mg_perm, perm = random_isomorph(mg,rng)
+        mg_perm_canonical_map = nty.canonize_multigraph(mg_perm)[2]
+        index = {node:i for i,node in enumerate(nodes)}
+        canonical = [index[mg_canonical_map[node]] for node in nodes]
+        canonical_perm = [index[perm_inverse] for perm_inverse in
+                          ({val:key for key,val in perm.items()}[mg_perm_canonical_map[node]] for node in nodes)]
+        assert np.array_equal(group.coset_representative(nty.groups.inverse(np.array(canonical,dtype=np.intc))),
+                              group.coset_representative(nty.groups.inverse(np.array(canonical_perm,dtype=np.intc))))
+
+
+@pytest.mark.parametrize("engine",["sparse","dense","traces","auto"])
+def test_engines(engine):
+    """Every engine gives isomorphs identical canonical forms and certificates, and the same groups."""
+    graphs = random_multigraphs[:20]+[nx.MultiGraph(nx.petersen_graph()),nx.MultiGraph(nx.random_regular_graph(3,80,seed=1))]
+    batch = nty.canonize_many(graphs,engine=engine,group=True)
+    for mg,result in zip(graphs,batch):
+        mg_perm = random_isomorph(nx.convert_node_labels_to_integers(mg),rng)[0]
+        mg_canonical,mg_autgens,mg_canonical_map,mg_group = nty.canonize_multigraph(mg,engine=engine,group=True)
+        assert nx.utils.graphs_equal(mg_canonical,nty.canonize_multigraph(mg_perm,engine=engine)[0])
+        assert nx.utils.graphs_equal(mg_canonical,result[0]) and mg_canonical_map==result[2]
+        assert nty.certificate_multigraph(mg,engine=engine)==nty.certificate_multigraph(mg_perm,engine=engine)
+        assert mg_group['order']==nty.canonize_multigraph(mg,group=True)[3]['order']
+        edges = lambda g: sorted((*sorted((a,b)),hmap(attrs)) for a,b,attrs in g.edges(data=True))
+        for aut in mg_autgens:
+            assert edges(nx.relabel_nodes(mg,aut))==edges(mg)
+    with pytest.raises(ValueError):
+        nty.canonize_simple_graph(nx.path_graph(3),engine="bliss")
+
+
+@pytest.mark.parametrize("engine,invariant",[("sparse","distances"),("sparse",("adjacencies",2)),
+                                             ("dense",("adjtriang",2)),("dense",("cellquads",(1,2))),
+                                             ("dense",("cellfano",2)),("dense",("cliques",1,3)),("auto","refinvar")])
+def test_invariants(engine,invariant):
+    """Vertex invariants keep canonical forms and certificates deterministic, and prune regular graphs."""
+    graphs = random_multigraphs[:10]+[nx.MultiGraph(nx.petersen_graph())]
+    batch = nty.canonize_many(graphs,engine=engine,invariant=invariant,group=True)
+    for mg,result in zip(graphs,batch):
+        mg_perm = random_isomorph(nx.convert_node_labels_to_integers(mg),rng)[0]
+        mg_canonical,mg_autgens,mg_canonical_map,mg_group = nty.canonize_multigraph(mg,engine=engine,invariant=invariant,group=True)
+        assert nx.utils.graphs_equal(mg_canonical,nty.canonize_multigraph(mg_perm,engine=engine,invariant=invariant)[0])
+        assert nx.utils.graphs_equal(mg_canonical,result[0]) and mg_canonical_map==result[2]
+        assert result[3]==mg_group
+        assert mg_group['order']==nty.canonize_multigraph(mg,group=True)[3]['order']
+        assert nty.certificate_multigraph(mg,engine=engine,invariant=invariant)==nty.certificate_multigraph(mg_perm,engine=engine,invariant=invariant)
+    #Refinement alone cannot split the vertices of a regular graph with a trivial group.
+    g = nx.random_regular_graph(3,40,seed=3)
+    stats = nty.canonize_simple_graph(g,group=True,engine=engine,invariant=invariant,return_graph=False)[3]['stats']
+    plain = nty.canonize_simple_graph(g,group=True,engine=engine,return_graph=False)[3]['stats']
+    assert stats['invapplics']>0 and plain['invapplics']==0
+    if invariant!=("adjacencies",2):
+        assert stats['invsuccesses']>0 and stats['numnodes']<plain['numnodes']
+
+
+def test_invariant_options():
+    """Invariant levels and arguments default as documented, and reach NAUTY."""
+    g = nx.random_regular_graph(3,40,seed=3)
+    def run(invariant):
+        canonical_map,group = nty.canonize_simple_graph(g,group=True,invariant=invariant,return_graph=False)[2:]
+        return canonical_map,group['stats']
+    default = run("distances")
+    assert default[1]['invapplics']==1 and default[1]['invarsuclevel']==1
+    assert run(("distances",1))==default and run(("distances",(0,1),0))==default
+    #Levels 2 to 2 skip the root, so the invariant is never applied on this graph.
+    assert run(("distances",(2,2)))==run(None) and run(None)[1]['invapplics']==0
+    assert run(("distances",1,1))[0]!=default[0]
+    for engine,invariant in [("sparse","cellfano"),("traces","distances"),("dense","bliss"),("dense",("distances",1,0,0))]:
+        with pytest.raises(ValueError):
+            nty.canonize_simple_graph(nx.path_graph(3),engine=engine,invariant=invariant)
+    cache = nty.CanonCache()
+    g = nx.petersen_graph()
+    cache.canonize(g,invariant="distances")
+    cache.canonize(g,invariant=("distances",1))
+    cache.canonize(g)
+    assert (cache.hits,cache.misses)==(1,2)
+
+
+@pytest.mark.parametrize("engine,invariant",[("sparse",None),("dense",None),("traces",None),
+                                             ("sparse","distances"),("dense",("cellquads",2))])
+def test_canonizer(engine,invariant):
+    """A reused Canonizer gives the results of the free functions, and grows its buffers as needed."""
+    canonizer = nty.Canonizer(max_nodes=8,max_edges=8)
+    graphs = random_multigraphs[:20]+[nx.MultiGraph(nx.petersen_graph())]
+    for mg in graphs:
+        kwargs = dict(engine=engine,invariant=invariant)
+        result = nty.canonize_multigraph(mg,group=True,**kwargs)
+        for reused in [canonizer.canonize_multigraph(mg,group=True,**kwargs),
+                       nty.canonize_multigraph(mg,group=True,canonizer=canonizer,**kwargs)]:
+            assert nx.utils.graphs_equal(reused[0],result[0]) and reused[2]==result[2]
+            #Traces does not reproduce its generators from call to call.
+            if engine!="traces":
+                assert reused[1]==result[1] and reused[3]==result[3]
+            assert reused[3]['order']==result[3]['order']
+        assert canonizer.certificate(mg,**kwargs)==nty.certificate(mg,**kwargs)
+        cmg = nty.CompactMultiGraph.from_networkx(mg)[0]
+        reused,free = canonizer.canonize_compact(cmg,**kwargs),nty.canonize_compact(cmg,**kwargs)
+        assert reused[0]==free[0] and np.array_equal(reused[2],free[2])
+        assert engine=="traces" or np.array_equal(reused[1],free[1])
+    assert canonizer.max_nodes>8
+    #Results are copied out of the workspace, so later calls leave them unchanged.
+    g = nx.petersen_graph()
+    v,d,e = nty._sparse_arrays(g)
+    lab,ptn = np.arange(10),np.append(np.ones(9),0)
+    def equal(a,b):
+        if isinstance(a,dict):
+            return a.keys()==b.keys() and all(equal(a[key],b[key]) for key in a)
+        if isinstance(a,tuple):
+            return len(a)==len(b) and all(equal(x,y) for x,y in zip(a,b))
+        return np.array_equal(a,b)
+    first = canonizer.canonize_arrays(v,d,e,lab,ptn,group=True,**kwargs)
+    saved = copy.deepcopy(first)
+    canonizer.canonize_arrays(*nty._sparse_arrays(nx.cycle_graph(10)),lab,ptn,group=True,**kwargs)
+    assert equal(first,saved)
+    free = nty.canonize_arrays(v,d,e,lab,ptn,group=True,**kwargs)
+    assert equal(free[0],saved[0]) and (engine=="traces" or equal(free,saved))
+
+
+@pytest.mark.parametrize("workers,backend",[(None,"processes"),(2,"processes"),(2,"threads")])
+def test_metrics(workers,backend,tmp_path):
+    """Instrumentation records one graph per canonization, only while a collector is active."""
+    import json
+    graphs = random_multigraphs[:20]
+    seen = []
+    with nty.Metrics(callback=seen.append,keep_records=True) as metrics:
+        nty.canonize_many(graphs,workers=workers,chunksize=6,backend=backend)
+        nty.canonize_multigraph(graphs[0])
+        nty.certificate(graphs[0])
+    nty.canonize_many(graphs)
+    assert metrics.calls=={'canonize_many':20,'canonize_multigraph':1,'certificate':1}
+    assert seen==metrics.records and len(seen)==22
+    #Pools record chunks in order of completion.
+    hosts = [nty._prepare_multigraph(mg)[1] for mg in graphs+2*graphs[:1]]
+    assert sorted((r['host_nodes'],r['host_edges']) for r in seen)==sorted((h.order(),h.size()) for h in hosts)
+    for record in seen:
+        assert set(record['stages'])=={'prepare','marshal','nauty','finish'}
+        assert all(t>=0 for t in record['stages'].values()) and record['stages']['nauty']>0
+        assert record['numnodes']>=1 and record['maxlevel']>=1
+    data = json.loads(metrics.to_json(tmp_path/"metrics.json"))
+    assert data==json.loads((tmp_path/"metrics.json").read_text())
+    assert data['histograms']['stage_seconds/nauty']['count']==22
+    assert data['histograms']['numnodes']['buckets'][-1]==["+Inf",22]
+    text = metrics.to_prometheus(tmp_path/"metrics.prom")
+    assert 'nautypy_canonizations_total{function="canonize_many"} 20' in text
+    assert 'nautypy_stage_seconds_count{stage="nauty"} 22' in text
+    assert 'nautypy_host_nodes_bucket{le="+Inf"} 22' in text
+    metrics.reset()
+    assert metrics.calls=={} and metrics.records==[]
+
+@pytest.mark.parametrize("fmt",["jsonl","graph6"])
+@pytest.mark.parametrize("workers",[None,2])
+def test_cli(fmt,workers,tmp_path):
+    """The nautypy command classifies a stream of encoded multigraphs as nautypy.classify does."""
+    import nautypy_cli
+    graphs = []
+    for mg in random_multigraphs[:30]:
+        graphs += [mg, random_isomorph(mg,rng)[0]]
+    lines = [nautypy_cli.encoders[fmt](mg) for mg in graphs]
+    for line,mg in zip(lines,graphs):
+        assert nty.certificate_multigraph(nautypy_cli.decoders[fmt](line))==nty.certificate_multigraph(mg)
+    (tmp_path/"in").write_text("\n".join(lines[:10])+"\n\n"+"\n".join(lines[10:])+"\n")
+    status = nautypy_cli.main([str(tmp_path/"in"),"-f",fmt,"-o",str(tmp_path/"classes.tsv"),
+                               "-r",str(tmp_path/"reps"),"-a",str(tmp_path/"ids"),
+                               "--digest-size","16","--chunksize","7"]+(["-w",str(workers)] if workers else []))
+    assert status==0
+    classes = nty.classify(graphs,digest_size=16)
+    table = [row.split("\t") for row in (tmp_path/"classes.tsv").read_text().splitlines()]
+    assert [(bytes.fromhex(c),int(i),int(n)) for c,i,n in table]==[
+        (key,i,classes.counts[i]) for key,i in classes.class_ids.items()]
+    assert [int(i) for i in (tmp_path/"ids").read_text().split()]==[classes.class_id(mg) for mg in graphs]
+    reps = (tmp_path/"reps").read_text().splitlines()
+    assert [classes.class_id(nautypy_cli.decoders[fmt](line)) for line in reps]==list(range(len(classes)))
+    (tmp_path/"bad").write_text(lines[0]+"\n{\n")
+    with pytest.raises(SystemExit):
+        nautypy_cli.main([str(tmp_path/"bad"),"-o",str(tmp_path/"out")])